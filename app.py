@@ -3,29 +3,80 @@
 """
 微博搜索Web系统 API
 """
+import hmac
 import os
 import json
 import threading
 import time
 import logging
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, url_for
-from spider_service import WeiboSpiderService
-
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+from flask import Flask, Response, render_template, request, jsonify, url_for
+from flask.json.provider import DefaultJSONProvider
+from log_config import dropped_count, setup_logging
+from spider_service import TaskBudget, WeiboSpiderService, session_pool
+from weibospider.spiders import metrics
+from weibospider.spiders.items import SlotItem
+from weibospider.spiders.tracing import SamplingProfiler
+from weibospider.spiders.tweet_index import TweetIndex
+
+# 配置日志（与 spider_service 共用异步日志队列）
+setup_logging()
 logger = logging.getLogger(__name__)
 
+
+class ItemJSONProvider(DefaultJSONProvider):
+    """支持SlotItem数据项的JSON序列化"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, SlotItem):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
+
+
 app = Flask(__name__)
+app.json = ItemJSONProvider(app)
 app.secret_key = 'weibo_spider_secret_key_2024'  # 用于session
 
 # 全局变量存储爬取结果
 crawl_results = {}
 crawl_status = {}
 crawl_stop_flags = {}  # 存储停止标志
+crawl_threads = {}  # 运行中任务的线程ID，用于采样分析
+
+# 管理接口的令牌，需要在请求头 X-Admin-Token 中携带；未设置时管理接口不可用
+ADMIN_TOKEN = os.environ.get('WEIBO_ADMIN_TOKEN')
+# 单次采样分析的最长时间（秒）
+MAX_PROFILE_SECONDS = 60
+
+# 批量查询用户接口单次最多接受的用户数
+MAX_BATCH_USERS = 500
+
+# 已采集推文的全文索引，任务运行中增量更新；WEIBO_INDEX_FILES 可指定启动时载入的jsonl文件（支持通配符）
+tweet_index = TweetIndex()
+if os.environ.get('WEIBO_INDEX_FILES'):
+    logger.info(f"载入推文索引: {tweet_index.load_jsonl(os.environ['WEIBO_INDEX_FILES'])} 条")
+# 推文检索单页最多返回的条数
+MAX_SEARCH_LIMIT = 200
+# 监控任务在内存中保留的最近结果数，更早的结果只能通过推文检索接口查询
+MAX_MONITOR_RESULTS = 5000
+
+TASKS = metrics.REGISTRY.gauge('weibo_tasks', '各状态的搜索任务数', ('status',))
+LOG_DROPPED = metrics.REGISTRY.gauge('weibo_log_dropped', '日志队列满时丢弃的日志条数')
+
+
+def collect_task_counts():
+    """输出指标前按状态统计搜索任务"""
+    counts = {'running': 0, 'monitoring': 0, 'stopping': 0, 'completed': 0, 'stopped': 0,
+              'budget_exhausted': 0, 'error': 0}
+    for status in list(crawl_status.values()):
+        counts[status.get('status')] = counts.get(status.get('status'), 0) + 1
+    for name, count in counts.items():
+        TASKS.set(count, status=name)
+
+
+metrics.REGISTRY.add_collector(collect_task_counts)
+metrics.REGISTRY.add_collector(lambda: LOG_DROPPED.set(dropped_count()))
 
 def get_cookie():
     """获取Cookie"""
@@ -38,17 +89,37 @@ def get_cookie():
         logger.error(f"读取Cookie失败: {e}")
     return None
 
-def run_spider(keyword, start_time_str, end_time_str, is_split_by_hour, task_id):
-    """在后台线程中运行爬虫"""
+def parse_budget(data):
+    """
+    从请求参数解析任务预算，返回 (TaskBudget, 错误信息)；未指定的项不限制
+    """
+    limits = {}
+    for name in TaskBudget.LIMITS:
+        value = data.get(name)
+        if value in (None, ''):
+            continue
+        try:
+            value = float(value) if name == 'max_seconds' else int(value)
+        except (TypeError, ValueError):
+            return None, f'{name} 应为数字'
+        if value <= 0:
+            return None, f'{name} 应大于0'
+        limits[name] = value
+    return TaskBudget(**limits), None
+
+def run_spider(keywords, start_time_str, end_time_str, is_split_by_hour, task_id, near_dup=None,
+               budget=None):
+    """在后台线程中运行爬虫，keywords 为关键词列表，多个关键词共用一个任务并跨关键词去重"""
     try:
         # 创建停止标志
         stop_flag = threading.Event()
         crawl_stop_flags[task_id] = stop_flag
+        crawl_threads[task_id] = threading.get_ident()
         
-        crawl_status[task_id] = {'status': 'running', 'count': 0, 'error': None, 'logs': []}
+        crawl_status[task_id] = {'status': 'running', 'count': 0, 'error': None, 'logs': [], 'keywords': keywords}
         crawl_results[task_id] = []
         
-        logger.info(f"任务 {task_id} 开始: 关键词={keyword}, 时间={start_time_str} 到 {end_time_str}")
+        logger.info(f"任务 {task_id} 开始: 关键词={', '.join(keywords)}, 时间={start_time_str} 到 {end_time_str}")
         
         # 解析时间
         start_time = datetime.strptime(start_time_str, '%Y-%m-%d %H:%M')
@@ -59,11 +130,19 @@ def run_spider(keyword, start_time_str, end_time_str, is_split_by_hour, task_id)
             raise Exception("Cookie未配置，请在Cookie配置中填入有效的Cookie")
         
         # 创建爬虫服务（传入停止标志）
-        spider = WeiboSpiderService(cookie=cookie, stop_flag=stop_flag)
+        spider = WeiboSpiderService(cookie=cookie, stop_flag=stop_flag, task_id=task_id, near_dup=near_dup,
+                                    budget=budget)
         
+        # 已写入索引的结果数
+        indexed = {'count': 0}
+
         # 进度回调函数
         def progress_callback(count, items):
             crawl_status[task_id]['count'] = count
+            tweet_index.add_many(items[indexed['count']:], task_id)
+            indexed['count'] = len(items)
+            crawl_status[task_id]['timing'] = spider.timer.breakdown()
+            crawl_status[task_id]['budget'] = spider.budget.snapshot()
             crawl_results[task_id] = items.copy()
             log_msg = f"已找到 {count} 条结果"
             if task_id in crawl_status:
@@ -78,8 +157,8 @@ def run_spider(keyword, start_time_str, end_time_str, is_split_by_hour, task_id)
                     crawl_status[task_id]['logs'] = crawl_status[task_id]['logs'][-50:]
         
         # 执行搜索
-        results = spider.search_by_keyword(
-            keyword=keyword,
+        results = spider.search_by_keywords(
+            keywords=keywords,
             start_time=start_time,
             end_time=end_time,
             is_split_by_hour=is_split_by_hour,
@@ -89,10 +168,17 @@ def run_spider(keyword, start_time_str, end_time_str, is_split_by_hour, task_id)
         if stop_flag.is_set():
             crawl_status[task_id]['status'] = 'stopped'
             logger.info(f"任务 {task_id} 已停止")
+        elif spider.budget.reason:
+            # 预算用完，保留已获取的部分结果
+            crawl_status[task_id]['status'] = 'budget_exhausted'
+            logger.info(f"任务 {task_id} 预算已用完（{spider.budget.reason}），共 {len(results)} 条结果")
         else:
             crawl_status[task_id]['status'] = 'completed'
             logger.info(f"任务 {task_id} 完成，共 {len(results)} 条结果")
         
+        crawl_status[task_id]['timing'] = spider.timer.breakdown()
+        crawl_status[task_id]['budget'] = spider.budget.snapshot()
+        tweet_index.add_many(results[indexed['count']:], task_id)
         crawl_results[task_id] = results
         
     except Exception as e:
@@ -104,6 +190,75 @@ def run_spider(keyword, start_time_str, end_time_str, is_split_by_hour, task_id)
         # 清理停止标志
         if task_id in crawl_stop_flags:
             del crawl_stop_flags[task_id]
+        crawl_threads.pop(task_id, None)
+
+def run_monitor(keyword, since_mid, min_interval, max_interval, task_id, near_dup=None, budget=None):
+    """在后台线程中持续监控关键词，新推文按发布顺序追加到结果末尾，直到任务被停止或预算用完"""
+    try:
+        stop_flag = threading.Event()
+        crawl_stop_flags[task_id] = stop_flag
+        crawl_threads[task_id] = threading.get_ident()
+
+        crawl_status[task_id] = {'status': 'monitoring', 'count': 0, 'error': None, 'logs': [],
+                                 'keywords': [keyword], 'results_offset': 0, 'monitor': None}
+        crawl_results[task_id] = []
+
+        logger.info(f"监控任务 {task_id} 开始: 关键词={keyword}")
+
+        cookie = get_cookie()
+        if not cookie:
+            raise Exception("Cookie未配置，请在Cookie配置中填入有效的Cookie")
+
+        spider = WeiboSpiderService(cookie=cookie, stop_flag=stop_flag, task_id=task_id, near_dup=near_dup,
+                                    budget=budget)
+        seen = {'count': 0}
+
+        def progress_callback(count, items):
+            # items 为本轮的新推文，取出上次回调之后新增的部分
+            new_items = items[len(items) - (count - seen['count']):]
+            seen['count'] = count
+            tweet_index.add_many(new_items, task_id)
+            results = crawl_results[task_id]
+            results.extend(new_items)
+            # 只保留最近的结果，游标按累计序号计算，不受裁剪影响
+            if len(results) > MAX_MONITOR_RESULTS:
+                dropped = len(results) - MAX_MONITOR_RESULTS
+                del results[:dropped]
+                crawl_status[task_id]['results_offset'] += dropped
+            crawl_status[task_id]['count'] = count
+            crawl_status[task_id]['timing'] = spider.timer.breakdown()
+
+        def state_callback(state):
+            crawl_status[task_id]['monitor'] = state
+            crawl_status[task_id]['budget'] = spider.budget.snapshot()
+            if state['last_new']:
+                crawl_status[task_id]['logs'].append({
+                    'time': datetime.now().strftime('%H:%M:%S'),
+                    'message': f"新增 {state['last_new']} 条，下次轮询间隔 {state['interval']} 秒"
+                })
+                crawl_status[task_id]['logs'] = crawl_status[task_id]['logs'][-50:]
+
+        spider.monitor_keyword(keyword, since_mid=since_mid, min_interval=min_interval,
+                               max_interval=max_interval, progress_callback=progress_callback,
+                               state_callback=state_callback)
+
+        if not stop_flag.is_set() and spider.budget.reason:
+            crawl_status[task_id]['status'] = 'budget_exhausted'
+            logger.info(f"监控任务 {task_id} 预算已用完（{spider.budget.reason}）")
+        else:
+            crawl_status[task_id]['status'] = 'stopped'
+            logger.info(f"监控任务 {task_id} 已停止")
+        crawl_status[task_id]['timing'] = spider.timer.breakdown()
+        crawl_status[task_id]['budget'] = spider.budget.snapshot()
+
+    except Exception as e:
+        import traceback
+        error_msg = str(e) + '\n' + traceback.format_exc()
+        logger.error(f"监控任务 {task_id} 失败: {error_msg}")
+        crawl_status[task_id] = {'status': 'error', 'error': error_msg}
+    finally:
+        crawl_stop_flags.pop(task_id, None)
+        crawl_threads.pop(task_id, None)
 
 @app.route('/')
 def index():
@@ -121,8 +276,10 @@ def search():
     parameters:
       - name: keyword
         type: string
-        required: true
-        description: 搜索关键词
+        description: 搜索关键词（与 keywords 二选一）
+      - name: keywords
+        type: array
+        description: 批量搜索的关键词列表，同一条推文只获取一次，并标注命中的全部关键词
       - name: start_time
         type: string
         required: true
@@ -134,14 +291,43 @@ def search():
       - name: is_split_by_hour
         type: boolean
         description: 是否按小时切分搜索
+      - name: near_dup
+        type: string
+        description: 近似重复推文的处理方式，tag 标记（duplicate_of）/ drop 丢弃 / 空字符串不处理，默认取 WEIBO_NEAR_DUP
+      - name: max_requests
+        type: integer
+        description: 任务预算，最多发送的请求数（搜索页、推文详情、长微博全文都计入）
+      - name: max_items
+        type: integer
+        description: 任务预算，最多获取的推文数
+      - name: max_seconds
+        type: number
+        description: 任务预算，最长运行时间（秒）
+      - name: requests_per_minute
+        type: integer
+        description: 任务预算，每分钟最多请求数，超过时等待
     """
     data = request.json
     keyword = data.get('keyword', '').strip()
+    keywords = data.get('keywords') or []
+    if not isinstance(keywords, list):
+        return jsonify({'success': False, 'error': 'keywords 应为关键词列表'})
+    keywords = [str(k).strip() for k in keywords if str(k).strip()]
+    if keyword and keyword not in keywords:
+        keywords.insert(0, keyword)
     start_time = data.get('start_time', '')
     end_time = data.get('end_time', '')
     is_split_by_hour = data.get('is_split_by_hour', False)
+    near_dup = data.get('near_dup')
     
-    if not keyword:
+    if near_dup not in (None, '', 'tag', 'drop'):
+        return jsonify({'success': False, 'error': 'near_dup 应为 tag、drop 或空'})
+    
+    budget, error = parse_budget(data)
+    if error:
+        return jsonify({'success': False, 'error': error})
+    
+    if not keywords:
         return jsonify({'success': False, 'error': '请输入关键词'})
     
     if not start_time or not end_time:
@@ -153,13 +339,102 @@ def search():
     # 在后台线程中运行爬虫
     thread = threading.Thread(
         target=run_spider,
-        args=(keyword, start_time, end_time, is_split_by_hour, task_id)
+        args=(keywords, start_time, end_time, is_split_by_hour, task_id, near_dup, budget)
     )
     thread.daemon = True
     thread.start()
     
     return jsonify({'success': True, 'task_id': task_id})
 
+@app.route('/api/spider/monitor', methods=['POST'])
+def monitor():
+    """
+    开始关键词监控任务，持续轮询实时搜索的最新结果，通过停止任务接口结束
+    ---
+    parameters:
+      - name: keyword
+        type: string
+        required: true
+        description: 监控关键词
+      - name: since_mid
+        type: integer
+        description: 起始水位线（推文mid），只获取更新的推文；默认从上次监控该关键词的位置继续
+      - name: min_interval
+        type: number
+        description: 最短轮询间隔（秒），默认10
+      - name: max_interval
+        type: number
+        description: 最长轮询间隔（秒），默认600
+      - name: near_dup
+        type: string
+        description: 近似重复推文的处理方式，tag / drop / 空字符串，默认取 WEIBO_NEAR_DUP
+      - name: max_requests / max_items / max_seconds / requests_per_minute
+        type: number
+        description: 任务预算，同搜索接口；任一项用完时任务以 budget_exhausted 状态结束
+    """
+    data = request.json or {}
+    keyword = str(data.get('keyword', '')).strip()
+    if not keyword:
+        return jsonify({'success': False, 'error': '请输入关键词'})
+    try:
+        since_mid = int(data['since_mid']) if data.get('since_mid') else None
+        min_interval = float(data.get('min_interval', 10))
+        max_interval = float(data.get('max_interval', 600))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'since_mid、min_interval、max_interval 应为数字'})
+    if min_interval <= 0 or max_interval < min_interval:
+        return jsonify({'success': False, 'error': '轮询间隔应满足 0 < min_interval <= max_interval'})
+    near_dup = data.get('near_dup')
+    if near_dup not in (None, '', 'tag', 'drop'):
+        return jsonify({'success': False, 'error': 'near_dup 应为 tag、drop 或空'})
+    budget, error = parse_budget(data)
+    if error:
+        return jsonify({'success': False, 'error': error})
+
+    task_id = f"monitor_{int(time.time() * 1000)}"
+    thread = threading.Thread(
+        target=run_monitor,
+        args=(keyword, since_mid, min_interval, max_interval, task_id, near_dup, budget)
+    )
+    thread.daemon = True
+    thread.start()
+
+    return jsonify({'success': True, 'task_id': task_id})
+
+@app.route('/api/spider/tasks/<task_id>/results', methods=['GET'])
+def get_task_results(task_id):
+    """
+    按游标增量获取任务结果，适合轮询监控任务的新推文
+    ---
+    parameters:
+      - name: task_id
+        type: string
+        required: true
+        description: 任务ID
+      - name: cursor
+        type: integer
+        description: 上次返回的 next_cursor，默认0（从头开始）
+      - name: limit
+        type: integer
+        description: 本次最多返回的条数，默认100，最大1000
+    """
+    if task_id not in crawl_status:
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+    cursor = request.args.get('cursor', 0, type=int)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+    offset = crawl_status[task_id].get('results_offset', 0)
+    results = crawl_results.get(task_id, [])
+    # 游标早于内存中保留的最早结果时，从保留的最早结果开始，并标出跳过的条数
+    start = max(cursor - offset, 0)
+    items = results[start:start + limit]
+    return jsonify({
+        'success': True,
+        'status': crawl_status[task_id].get('status'),
+        'results': items,
+        'next_cursor': offset + start + len(items),
+        'skipped': max(offset - cursor, 0),
+    })
+
 @app.route('/api/spider/tasks/<task_id>', methods=['GET'])
 @app.route('/api/status/<task_id>', methods=['GET']) # 兼容旧接口
 def get_task_status(task_id):
@@ -225,6 +500,115 @@ def get_user_info_api(user_id):
     else:
         return jsonify({'success': False, 'error': '获取用户信息失败'})
 
+@app.route('/api/spider/users', methods=['POST'])
+def get_users_info_api():
+    """
+    批量获取用户信息
+    ---
+    parameters:
+      - name: user_ids
+        type: array
+        required: true
+        description: 用户ID列表，单次最多500个
+      - name: timeout
+        type: number
+        description: 最长等待秒数，超时的用户返回 timeout 状态，其余结果照常返回
+    """
+    data = request.json or {}
+    user_ids = data.get('user_ids') or []
+    if not isinstance(user_ids, list) or not user_ids:
+        return jsonify({'success': False, 'error': '请提供用户ID列表 user_ids'})
+    if len(user_ids) > MAX_BATCH_USERS:
+        return jsonify({'success': False, 'error': f'单次最多查询 {MAX_BATCH_USERS} 个用户'})
+    timeout = data.get('timeout')
+    if timeout is not None:
+        try:
+            timeout = float(timeout)
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'timeout 应为数字'})
+        if timeout <= 0:
+            return jsonify({'success': False, 'error': 'timeout 应大于0'})
+
+    cookie = get_cookie()
+    if not cookie:
+         return jsonify({'success': False, 'error': 'Cookie未配置'})
+
+    spider = WeiboSpiderService(cookie=cookie)
+    results = spider.get_users_info(user_ids, timeout=timeout)
+    summary = {}
+    for result in results:
+        summary[result['status']] = summary.get(result['status'], 0) + 1
+    return jsonify({'success': True, 'total': len(results), 'summary': summary, 'results': results})
+
+def _parse_search_time(value):
+    """检索接口的时间参数: YYYY-MM-DD HH:MM 或 YYYY-MM-DD"""
+    for fmt in ('%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt).timestamp()
+        except ValueError:
+            continue
+    raise ValueError(f'时间格式错误: {value}')
+
+@app.route('/api/tweets/search', methods=['GET'])
+def search_tweets():
+    """
+    检索已采集的推文
+    ---
+    parameters:
+      - name: q
+        type: string
+        description: 正文检索词，空格分隔的多个词需同时出现
+      - name: user_id
+        type: string
+        description: 作者用户ID
+      - name: task_id
+        type: string
+        description: 只检索某个任务采集的推文
+      - name: keyword
+        type: string
+        description: 命中的搜索关键词
+      - name: start_time
+        type: string
+        description: 发布时间下限 (YYYY-MM-DD HH:MM)
+      - name: end_time
+        type: string
+        description: 发布时间上限（不含）(YYYY-MM-DD HH:MM)
+      - name: min_reposts
+        type: integer
+        description: 最少转发数（min_comments、min_attitudes 同理）
+      - name: sort
+        type: string
+        description: 排序字段 time/reposts/comments/attitudes，降序，默认 time
+      - name: offset
+        type: integer
+        description: 分页偏移，默认0
+      - name: limit
+        type: integer
+        description: 返回条数，默认20，最多200
+    """
+    args = request.args
+    try:
+        start_time = _parse_search_time(args['start_time']) if args.get('start_time') else None
+        end_time = _parse_search_time(args['end_time']) if args.get('end_time') else None
+        total, results, took_ms, total_exact = tweet_index.search(
+            query=args.get('q'),
+            user_id=args.get('user_id'),
+            task_id=args.get('task_id'),
+            keyword=args.get('keyword'),
+            start_time=start_time,
+            end_time=end_time,
+            min_reposts=int(args.get('min_reposts', 0)),
+            min_comments=int(args.get('min_comments', 0)),
+            min_attitudes=int(args.get('min_attitudes', 0)),
+            sort=args.get('sort', 'time'),
+            offset=max(int(args.get('offset', 0)), 0),
+            limit=min(max(int(args.get('limit', 20)), 1), MAX_SEARCH_LIMIT),
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)})
+    return jsonify({'success': True, 'total': total, 'total_exact': total_exact, 'took_ms': took_ms,
+                    'results': results})
+
 @app.route('/api/config/cookie', methods=['GET', 'POST'])
 @app.route('/api/cookie', methods=['GET', 'POST']) # 兼容旧接口
 def manage_cookie():
@@ -253,16 +637,80 @@ def manage_cookie():
         except Exception as e:
             return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/system/sessions', methods=['GET'])
+def session_stats():
+    """
+    连接池复用统计
+    """
+    return jsonify({'success': True, 'data': session_pool.stats()})
+
+@app.route('/api/admin/tasks/<task_id>/profile', methods=['POST'])
+def profile_task(task_id):
+    """
+    对运行中的任务采样分析调用栈
+    ---
+    parameters:
+      - name: task_id
+        type: string
+        required: true
+        description: 任务ID
+      - name: duration
+        type: number
+        description: 采样时长（秒），默认10，最长60；任务提前结束时随之结束
+      - name: interval_ms
+        type: number
+        description: 采样间隔（毫秒），默认5
+      - name: format
+        type: string
+        description: json（默认，按函数汇总）或 folded（折叠栈文本，可生成火焰图）
+    """
+    if not ADMIN_TOKEN:
+        # 采样会占用一个工作线程最长60秒并暴露调用栈，未配置令牌时不开放
+        return jsonify({'success': False, 'error': '未设置 WEIBO_ADMIN_TOKEN，管理接口不可用'}), 403
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN):
+        return jsonify({'success': False, 'error': '无权限'}), 403
+    thread_id = crawl_threads.get(task_id)
+    if thread_id is None:
+        return jsonify({'success': False, 'error': '任务不存在或已完成'})
+    data = request.get_json(silent=True) or {}
+    try:
+        duration = min(float(data.get('duration', 10)), MAX_PROFILE_SECONDS)
+        interval = max(float(data.get('interval_ms', 5)), 1) / 1000
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'duration/interval_ms 应为数字'})
+    logger.info(f"开始采样分析任务 {task_id}: {duration} 秒")
+    profiler = SamplingProfiler(thread_id, interval=interval).run_for(duration)
+    if data.get('format') == 'folded':
+        return Response(profiler.folded(), mimetype='text/plain')
+    result = profiler.summary()
+    if task_id in crawl_status:
+        result['timing'] = crawl_status[task_id].get('timing')
+    return jsonify({'success': True, 'data': result})
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Prometheus 格式的运行指标: 各接口请求耗时、响应类型、采集速率、队列长度和缓存命中率
+    """
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/docs')
 def api_docs():
     """API文档简述"""
     return jsonify({
         'endpoints': {
-            'POST /api/spider/search': '创建关键词搜索任务',
+            'POST /api/spider/search': '创建关键词搜索任务（keywords 可批量搜索多个关键词，可设置请求数/推文数/时长/速率预算）',
             'GET /api/spider/tasks/<task_id>': '获取任务状态和结果',
             'POST /api/spider/tasks/<task_id>/stop': '停止任务',
+            'POST /api/spider/monitor': '创建关键词监控任务（自适应轮询实时搜索的新推文）',
+            'GET /api/spider/tasks/<task_id>/results': '按游标增量获取任务结果',
             'GET /api/spider/user/<user_id>': '获取用户信息',
-            'GET/POST /api/config/cookie': '管理微博Cookie'
+            'POST /api/spider/users': '批量获取用户信息',
+            'GET /api/tweets/search': '检索已采集的推文（全文、时间、用户、互动数过滤）',
+            'GET/POST /api/config/cookie': '管理微博Cookie',
+            'GET /api/system/sessions': '连接池复用统计',
+            'POST /api/admin/tasks/<task_id>/profile': '对运行中的任务采样分析调用栈',
+            'GET /metrics': 'Prometheus 格式的运行指标'
         }
     })
 
@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+离线回放基准测试
+
+把 fixtures/ 下录制好的响应直接喂给各爬虫的解析回调（以及 WeiboSpiderService
+的搜索/用户解析路径），不访问微博。统计每个用例的产出速度（outputs_per_sec）、每次产出的耗时
+（us_per_output，微秒）和峰值内存，并与 baseline.json 对比，超过容忍度即视为性能回退。
+产出指解析回调的一次 yield，包括数据项和后续请求；其中的数据项数单独记为 items。
+
+耗时与机器和当时的负载有关: 每个用例计时前后各测一次固定的纯Python负载（calibrate），与结果一起
+保存在基线中，对比时按两次的校准结果之比换算基线耗时，换一台机器或负载升高时不会误报。每个用例
+默认累计计时至少1秒取最快一次，单次只有几毫秒的用例也不会被调度抖动放大；超出容忍度的用例会再测。
+
+用法:
+    python benchmarks/bench_parse.py                     # 运行并与基线对比
+    python benchmarks/bench_parse.py --save-baseline     # 用本次结果覆盖基线
+    python benchmarks/bench_parse.py --only comment fan  # 只跑指定用例
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+FIXTURE_DIR = os.path.join(BENCH_DIR, 'fixtures')
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baseline.json')
+
+# Scrapy 工程内部以 spiders.xxx 方式导入，requests 服务以 weibospider.spiders.xxx 方式导入
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'weibospider'))
+
+from itemadapter import is_item  # noqa: E402
+from scrapy.http import Request, TextResponse  # noqa: E402
+
+from spiders.comment import CommentSpider  # noqa: E402
+from spiders.common import parse_long_tweet, parse_tweet_info, parse_user_info  # noqa: E402
+from spiders.fan import FanSpider  # noqa: E402
+from spiders.items import UserItem  # noqa: E402
+from spiders.follower import FollowerSpider  # noqa: E402
+from spiders.repost import RepostSpider  # noqa: E402
+from spiders.tweet_by_keyword import TweetSpiderByKeyword  # noqa: E402
+from spiders.tweet_by_tweet_id import TweetSpiderByTweetID  # noqa: E402
+from spiders.tweet_by_user_id import TweetSpiderByUserID  # noqa: E402
+from spiders.profile import ProfileCache, ProfileFetcher  # noqa: E402
+from spider_service import WeiboSpiderService  # noqa: E402
+
+
+def load_fixture(name):
+    """
+    读取录制的响应体
+    """
+    with open(os.path.join(FIXTURE_DIR, name), 'rb') as f:
+        return f.read()
+
+
+class ReplayResponse(object):
+    """
+    requests.Response 的最小替身
+    """
+
+    def __init__(self, url, body, status_code=200):
+        self.url = url
+        self.status_code = status_code
+        self.content = body
+        self.encoding = 'utf-8'
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding)
+
+
+class ReplaySession(object):
+    """
+    按URL片段回放录制响应的 requests.Session 替身
+    """
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.headers = {}
+
+    def get(self, url, **kwargs):
+        for pattern, body in self.routes:
+            if pattern in url:
+                return ReplayResponse(url, body)
+        return ReplayResponse(url, b'', status_code=404)
+
+
+class Case(object):
+    """
+    一个基准用例: prepare(n) 生成 n 份输入，consume(unit) 返回该输入的全部产出
+    """
+
+    def __init__(self, name, prepare, consume):
+        self.name = name
+        self.prepare = prepare
+        self.consume = consume
+
+
+def spider_case(name, callback, url, fixture, meta_factory=dict):
+    """
+    构造Scrapy解析回调的用例，每份输入都是一个全新的响应
+    """
+    body = load_fixture(fixture)
+
+    def prepare(n):
+        return [TextResponse(url, body=body, encoding='utf-8', request=Request(url, meta=meta_factory()))
+                for _ in range(n)]
+
+    def consume(response):
+        return list(callback(response) or [])
+
+    return Case(name, prepare, consume)
+
+
+def keyword_search(response):
+    """
+    搜索页解析加上随后发出的推文详情请求（详情在搜索页全部完成后才发出）
+    """
+    spider = TweetSpiderByKeyword()
+    return list(spider.parse(response)) + list(spider.detail_requests())
+
+
+def profile_callback(part, user_item):
+    """
+    ProfileFetcher 的解析回调；另一半资料预先放好，每份响应都能拼出一条用户数据
+    """
+    fetcher = ProfileFetcher(ProfileCache(ttl=0))
+    info = parse_user_info(user_item).to_dict()
+
+    def callback(response):
+        uid = response.meta['profile_uid']
+        if part == 'info':
+            fetcher.pending[uid] = {'info': None, 'detail': {}}
+            return fetcher.parse_info(response)
+        fetcher.pending[uid] = {'info': UserItem(**info), 'detail': None}
+        return fetcher.parse_detail(response)
+
+    return callback
+
+
+def service_search_case():
+    """
+    WeiboSpiderService 的搜索页+推文详情解析路径
+    """
+    # 去掉下一页链接，只回放一页
+    search_html = load_fixture('search.html').replace(b'class="next"', b'class="last"')
+    routes = [
+        ('s.weibo.com/weibo', search_html),
+        ('/ajax/statuses/show', load_fixture('status.json')),
+        ('/ajax/statuses/longtext', load_fixture('longtext.json')),
+    ]
+    url = 'https://s.weibo.com/weibo?q=%E6%B5%8B%E8%AF%95&page=1'
+
+    def prepare(n):
+        services = []
+        for _ in range(n):
+            service = WeiboSpiderService(cookie='', request_interval=0, page_interval=0)
+            service.session = ReplaySession(routes)
+            services.append(service)
+        return services
+
+    def consume(service):
+        return service._crawl_search_page(url, '测试')
+
+    return Case('service_search', prepare, consume)
+
+
+def service_user_case():
+    """
+    WeiboSpiderService.get_user_info 的解析路径
+    """
+    routes = [
+        ('/ajax/profile/info', load_fixture('profile_info.json')),
+        ('/ajax/profile/detail', load_fixture('profile_detail.json')),
+    ]
+
+    def prepare(n):
+        services = []
+        for _ in range(n):
+            # ttl=0 不命中缓存，每次都走完整的请求解析
+            service = WeiboSpiderService(cookie='', profile_cache=ProfileCache(ttl=0))
+            service.session = ReplaySession(routes)
+            services.append(service)
+        return services
+
+    def consume(service):
+        return [service.get_user_info('1000007919')]
+
+    return Case('service_user', prepare, consume)
+
+
+def build_cases():
+    """
+    全部用例
+    """
+    user_item = json.loads(load_fixture('profile_info.json'))['data']['user']
+    status = json.loads(load_fixture('status_long.json'))
+    comment_url = 'https://weibo.com/ajax/statuses/buildComments?is_reload=1&id=4829255386537989' \
+                  '&is_show_bulletin=2&is_mix=0&count=20'
+    profile_url = 'https://weibo.com/ajax/statuses/searchProfile?uid=1000007919&page=1&hasori=1&hastext=1' \
+                  '&haspic=1&hasvideo=1&hasmusic=1&hasret=1'
+    return [
+        spider_case('keyword_search', keyword_search,
+                    'https://s.weibo.com/weibo?q=%E6%B5%8B%E8%AF%95&page=1', 'search.html',
+                    lambda: {'keyword': '测试'}),
+        spider_case('keyword_tweet', TweetSpiderByKeyword().parse_tweet,
+                    'https://weibo.com/ajax/statuses/show?id=MbXyZ', 'status.json',
+                    lambda: {'keyword': '测试'}),
+        spider_case('tweet_by_tweet_id', TweetSpiderByTweetID().parse,
+                    'https://weibo.com/ajax/statuses/show?id=MbXyZ', 'status.json'),
+        spider_case('tweet_by_user_id', TweetSpiderByUserID().parse, profile_url, 'search_profile.json',
+                    lambda: {'user_id': '1000007919', 'page_num': 1, 'fan_out_key': '1000007919'}),
+        spider_case('longtext', parse_long_tweet,
+                    'https://weibo.com/ajax/statuses/longtext?id=MbXyZ', 'longtext.json',
+                    lambda: {'item': parse_tweet_info(status)}),
+        spider_case('comment', CommentSpider().parse, comment_url, 'comments.json',
+                    lambda: {'source_url': comment_url, 'mid': '4829255386537989'}),
+        spider_case('repost', RepostSpider().parse,
+                    'https://weibo.com/ajax/statuses/repostTimeline?id=4829255386537989&page=1&moduleID=feed&count=10',
+                    'reposts.json', lambda: {'page_num': 1, 'mid': 4829255386537989, 'fan_out_key': '4829255386537989'}),
+        spider_case('fan', FanSpider().parse,
+                    'https://weibo.com/ajax/friendships/friends?relate=fans&page=1&uid=1000007919&type=fans',
+                    'fans.json', lambda: {'user': '1000007919', 'page_num': 1, 'fan_out_key': '1000007919'}),
+        spider_case('follower', FollowerSpider().parse,
+                    'https://weibo.com/ajax/friendships/friends?page=1&uid=1000007919',
+                    'followers.json', lambda: {'user': '1000007919', 'page_num': 1, 'fan_out_key': '1000007919'}),
+        spider_case('user', profile_callback('info', user_item),
+                    'https://weibo.com/ajax/profile/info?uid=1000007919', 'profile_info.json',
+                    lambda: {'profile_uid': '1000007919'}),
+        spider_case('user_detail', profile_callback('detail', user_item),
+                    'https://weibo.com/ajax/profile/detail?uid=1000007919', 'profile_detail.json',
+                    lambda: {'profile_uid': '1000007919'}),
+        service_search_case(),
+        service_user_case(),
+    ]
+
+
+def run_case(case, iterations, repeat=3, min_time=1.0):
+    """
+    运行单个用例，返回统计结果；至少计时 repeat 次且累计不少于 min_time 秒，耗时取最小值以降低抖动。
+    计时前后各跑一次校准负载，取较快的一次记为 calibration
+    """
+    # 预热，同时排除首次导入/编译正则的开销
+    for unit in case.prepare(1):
+        case.consume(unit)
+
+    before = calibrate()
+    elapsed = None
+    runs = total = 0
+    while runs < repeat or total < min_time:
+        units = case.prepare(iterations)
+        gc.collect()
+        produced = items = 0
+        start = time.perf_counter()
+        for unit in units:
+            for output in case.consume(unit):
+                produced += 1
+                if not isinstance(output, Request) and is_item(output):
+                    items += 1
+        cost = time.perf_counter() - start
+        elapsed = cost if elapsed is None else min(elapsed, cost)
+        runs += 1
+        total += cost
+    calibration = min(before, calibrate())
+
+    # 峰值内存单独测一遍：保留全部产出，模拟Web服务持有结果的情况
+    units = case.prepare(iterations)
+    gc.collect()
+    tracemalloc.start()
+    kept = []
+    for unit in units:
+        kept.extend(case.consume(unit))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+
+    produced = max(produced, 1)
+    return {
+        'outputs': produced,
+        'items': items,
+        'outputs_per_sec': round(produced / elapsed, 1),
+        'us_per_output': round(elapsed / produced * 1e6, 2),
+        'peak_kb': round(peak / 1024, 1),
+        'calibration': calibration,
+    }
+
+
+def calibrate(iterations=50, min_time=0.2):
+    """
+    固定的纯Python负载（JSON解码、正则、字典操作）每次的耗时（微秒），累计计时 min_time 秒取最小值。
+    计时期间关闭gc，结果不受前一个用例留下的对象数量影响
+    """
+    body = load_fixture('status.json').decode('utf-8')
+    pattern = re.compile(r'"(\w+)":')
+    best = None
+    total = 0
+    gc.disable()
+    try:
+        while total < min_time:
+            start = time.perf_counter()
+            for _ in range(iterations):
+                data = json.loads(body)
+                {key: data.get(key) for key in pattern.findall(body)}
+            cost = time.perf_counter() - start
+            best = cost if best is None else min(best, cost)
+            total += cost
+    finally:
+        gc.enable()
+    return round(best / iterations * 1e6, 2)
+
+
+def compare(results, baseline, tolerance):
+    """
+    与基线对比，返回回退的用例列表；耗时按两次运行该用例时的校准负载之比换算
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        scale = result['calibration'] / base['calibration'] if base.get('calibration') else 1.0
+        for key, factor in (('us_per_output', scale), ('peak_kb', 1.0)):
+            if base.get(key) and result[key] > base[key] * factor * (1 + tolerance):
+                regressions.append((name, key, round(base[key] * factor, 2), result[key]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='离线回放解析基准测试')
+    parser.add_argument('--iterations', type=int, default=200, help='每个用例回放的响应份数')
+    parser.add_argument('--only', nargs='*', help='只运行指定名称的用例')
+    parser.add_argument('--repeat', type=int, default=3, help='最少计时次数，取最快一次')
+    parser.add_argument('--min-time', type=float, default=1.0, help='每个用例累计计时的最少秒数')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='允许相对基线变慢/变大的比例')
+    parser.add_argument('--recheck', type=int, default=2, help='耗时超出容忍度的用例最多再测的次数')
+    parser.add_argument('--save-baseline', action='store_true', help='将本次结果写入基线文件')
+    args = parser.parse_args()
+
+    # 解析路径上的INFO日志会主导耗时，基准中只保留警告
+    logging.getLogger('spider_service').setLevel(logging.WARNING)
+
+    cases = build_cases()
+    if args.only:
+        cases = [case for case in cases if case.name in args.only]
+
+    results = {}
+    print(f"{'case':<20}{'outputs':>10}{'items':>10}{'outputs/s':>14}{'us/output':>12}{'peak KB':>12}{'calib us':>10}")
+    for case in cases:
+        result = run_case(case, args.iterations, args.repeat, args.min_time)
+        results[case.name] = result
+        print(f"{case.name:<20}{result['outputs']:>10}{result['items']:>10}{result['outputs_per_sec']:>14}"
+              f"{result['us_per_output']:>12}{result['peak_kb']:>12}{result['calibration']:>10}")
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(BASELINE_PATH):
+            with open(BASELINE_PATH, 'rt', encoding='utf-8') as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(BASELINE_PATH, 'wt', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f'baseline saved: {BASELINE_PATH}')
+        return 0
+
+    if not os.path.exists(BASELINE_PATH):
+        print('no baseline found, run with --save-baseline first')
+        return 0
+    with open(BASELINE_PATH, 'rt', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    # 负载高的时段可能正好覆盖某个用例，耗时超限的用例再测几次，取相对校准负载最快的一次
+    for _ in range(args.recheck):
+        names = {name for name, key, _, _ in regressions if key == 'us_per_output'}
+        if not names:
+            break
+        for case in cases:
+            if case.name in names:
+                result = run_case(case, args.iterations, args.repeat, args.min_time)
+                old = results[case.name]
+                if result['us_per_output'] / result['calibration'] < old['us_per_output'] / old['calibration']:
+                    results[case.name] = result
+                print(f"recheck {case.name}: {result['us_per_output']} us/output, calibration {result['calibration']} us")
+        regressions = compare(results, baseline, args.tolerance)
+    for name, key, old, new in regressions:
+        print(f'REGRESSION {name}.{key}: {old} -> {new}')
+    if not regressions:
+        print('no regression against baseline')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
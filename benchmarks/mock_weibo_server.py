@@ -0,0 +1,468 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+本地模拟微博服务，用于端到端的并发、限流与退避测试
+
+同时模拟 s.weibo.com 的搜索页和 weibo.com/ajax/* 接口（两者路径不冲突），
+数据按ID确定性生成并带有真实的分页行为。支持注入延迟、418/414错误、
+验证码页面以及按Cookie的频率限制。
+
+启动:
+    python benchmarks/mock_weibo_server.py --port 8765 --latency 50 --rate-limit 60
+
+让爬虫指向模拟服务:
+    WEIBO_MOCK_SERVER=http://127.0.0.1:8765 python app.py
+    cd weibospider && WEIBO_MOCK_SERVER=http://127.0.0.1:8765 python run_spider.py comment
+
+运行统计: GET /mock/stats   修改故障配置: POST /mock/config
+"""
+import argparse
+import copy
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+
+from flask import Flask, Response, jsonify, request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from weibospider.spiders.common import mid_to_url, url_to_mid  # noqa: E402
+
+FIXTURE_DIR = os.path.join(BENCH_DIR, 'fixtures')
+
+CAPTCHA_HTML = '''<!DOCTYPE html><html><head><meta charset="utf-8"><title>微博-出错了</title></head>
+<body><div class="m-error"><p>您的访问频次过高，请输入验证码后继续访问</p>
+<img src="https://passport.weibo.com/captcha/image?r=mock"></div></body></html>'''
+
+EMPTY_SEARCH_HTML = '<html><body><div class="card card-no-result"><p>抱歉，未找到相关结果。</p></div></body></html>'
+
+TEXTS = [
+    '今天天气真好，出门散步看到很多花开了',
+    '#热门话题# 转发这条微博，一起来关注',
+    '这个视频太好笑了哈哈哈哈哈',
+    '分享图片',
+    '回复@某用户:说得很有道理',
+    '丽江小漾日出 推出户外移动餐桌 接受私人定制 让美食融入美景心情自然美丽了！',
+]
+
+
+class MockConfig(object):
+    """
+    模拟服务的可调参数，可在运行时通过 /mock/config 修改
+    """
+
+    def __init__(self, **kwargs):
+        self.latency_ms = 0  # 基础延迟
+        self.jitter_ms = 0  # 随机抖动
+        self.error_418_rate = 0.0  # 随机返回418的比例
+        self.error_414_rate = 0.0  # 随机返回414的比例
+        self.captcha_rate = 0.0  # 随机返回验证码页面的比例
+        self.rate_limit = 0  # 每个Cookie在窗口内允许的请求数，0表示不限制
+        self.rate_window = 60  # 频率限制窗口（秒）
+        self.search_pages = 10  # 每个搜索条件的结果页数
+        self.keyword_overlap = 0.0  # 不同关键词之间搜索结果重叠的比例
+        self.live_rate = 60.0  # 实时搜索中每个关键词每分钟新增的推文数
+        self.media_kb = 64  # 图片/视频文件的大小（KB）
+        self.comments_per_tweet = 200
+        self.replies_per_comment = 30
+        self.reposts_per_tweet = 100
+        self.relations_per_user = 200
+        self.tweets_per_day = 3  # 用户发帖密度，决定searchProfile每个时间窗口的条数
+        self.seed = 0
+        self.update(**kwargs)
+
+    def update(self, **kwargs):
+        for key, value in kwargs.items():
+            if value is not None and hasattr(self, key):
+                setattr(self, key, type(getattr(self, key))(value))
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+class MockState(object):
+    """
+    请求计数与按Cookie的频率限制状态
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(int)
+        self.cookie_hits = defaultdict(deque)
+        self.live = {}  # 关键词 -> [已发布推文数, 上次更新时间]
+
+    def count(self, key):
+        with self.lock:
+            self.counters[key] += 1
+
+    def live_count(self, keyword, rate):
+        """
+        实时搜索: 按当前速率累计关键词已发布的推文数，初始已有200条
+        """
+        now = time.time()
+        with self.lock:
+            stream = self.live.setdefault(keyword, [200.0, now])
+            stream[0] += rate * (now - stream[1]) / 60
+            stream[1] = now
+            return int(stream[0])
+
+    def over_limit(self, cookie, limit, window):
+        now = time.time()
+        with self.lock:
+            hits = self.cookie_hits[cookie]
+            while hits and hits[0] <= now - window:
+                hits.popleft()
+            if len(hits) >= limit:
+                return True
+            hits.append(now)
+            return False
+
+
+def _load_template(name):
+    with open(os.path.join(FIXTURE_DIR, name), 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+
+TWEET_TEMPLATE = _load_template('status.json')
+USER_TEMPLATE = _load_template('profile_info.json')['data']['user']
+DETAIL_TEMPLATE = _load_template('profile_detail.json')['data']
+COMMENT_TEMPLATE = _load_template('comments.json')['data'][0]
+
+
+def _rng(*parts):
+    """
+    根据参数得到确定性的随机数发生器，保证同一ID每次返回相同数据
+    """
+    digest = hashlib.md5('|'.join(str(p) for p in (config.seed,) + parts).encode()).hexdigest()
+    return random.Random(int(digest[:16], 16))
+
+
+def _weibo_time(dt):
+    return dt.strftime('%a %b %d %H:%M:%S +0800 %Y')
+
+
+def make_user(uid):
+    rng = _rng('user', uid)
+    user = copy.deepcopy(USER_TEMPLATE)
+    user.update({
+        'id': int(uid), 'idstr': str(uid), 'screen_name': f'用户{uid}',
+        'avatar_hd': f'https://tvax1.sinaimg.cn/crop.0.0.180.180.1024/{uid}.jpg',
+        'verified': rng.random() < 0.3, 'followers_count': rng.randint(0, 10 ** 6),
+        'friends_count': rng.randint(0, 2000), 'statuses_count': rng.randint(0, 50000),
+        'gender': rng.choice(['m', 'f']),
+    })
+    return user
+
+
+def make_tweet(mid, created_at=None, uid=None):
+    rng = _rng('tweet', mid)
+    mid = int(mid)
+    tweet = copy.deepcopy(TWEET_TEMPLATE)
+    uid = uid or 1000000000 + rng.randint(0, 10 ** 8)
+    created_at = created_at or datetime(2022, 10, 19) - timedelta(seconds=rng.randint(0, 86400 * 30))
+    is_long = rng.random() < 0.1
+    tweet.update({
+        'id': mid, 'idstr': str(mid), 'mid': str(mid), 'mblogid': mid_to_url(mid),
+        'created_at': _weibo_time(created_at), 'user': make_user(uid),
+        'text_raw': rng.choice(TEXTS), 'isLongText': is_long,
+        'reposts_count': rng.randint(0, 1000), 'comments_count': rng.randint(0, 1000),
+        'attitudes_count': rng.randint(0, 10000),
+    })
+    if is_long:
+        tweet['continue_tag'] = {'title': '全文', 'pic': '', 'scheme': ''}
+    else:
+        tweet.pop('continue_tag', None)
+    if rng.random() < 0.7:
+        tweet.pop('page_info', None)
+    # 图片从一个小的图片池中抽取，模拟热门图片被大量推文引用
+    tweet['pic_ids'] = [f'005media{rng.randint(0, 199):04d}' for _ in range(rng.randint(0, 4))]
+    tweet['pic_num'] = len(tweet['pic_ids'])
+    return tweet
+
+
+def make_comment(parent_id, offset, root_id=None):
+    """
+    评论按偏移量生成，越靠后越早，与真实接口的时间倒序一致
+    """
+    rng = _rng('comment', parent_id, offset)
+    cid = 4800000000000000 + rng.randint(0, 10 ** 14)
+    comment = copy.deepcopy(COMMENT_TEMPLATE)
+    comment.update({
+        'id': cid, 'mid': str(cid), 'rootid': root_id or cid, 'rootidstr': str(root_id or cid),
+        'created_at': _weibo_time(datetime(2022, 10, 19) - timedelta(minutes=offset)),
+        'text_raw': rng.choice(TEXTS), 'like_counts': rng.randint(0, 500),
+        'user': make_user(1000000000 + rng.randint(0, 10 ** 8)),
+    })
+    comment.pop('more_info', None)
+    comment.pop('reply_comment', None)
+    if root_id is not None and rng.random() < 0.3:
+        # 楼中楼里回复更早的一条回复
+        reply_offset = offset + rng.randint(1, 5)
+        if reply_offset < config.replies_per_comment:
+            reply = make_comment(parent_id, reply_offset, root_id)
+            comment['reply_comment'] = {'id': reply['id'], 'text': reply['text_raw'], 'user': reply['user']}
+    if root_id is None and rng.random() < 0.2:
+        comment['more_info'] = {'scheme': '', 'text': f'共{config.replies_per_comment}条回复', 'highlight': True}
+        comment['total_number'] = config.replies_per_comment
+    return comment
+
+
+def page_slice(total, page, size):
+    start = (page - 1) * size
+    return range(start, min(start + size, total))
+
+
+def _json(data):
+    return Response(json.dumps(data, ensure_ascii=False), mimetype='application/json')
+
+
+config = MockConfig()
+state = MockState()
+app = Flask(__name__)
+
+
+@app.before_request
+def inject_faults():
+    """
+    统一注入延迟、频率限制和随机错误
+    """
+    if request.path.startswith('/mock/'):
+        return None
+    state.count('requests')
+    delay = config.latency_ms + random.uniform(0, config.jitter_ms)
+    if delay > 0:
+        time.sleep(delay / 1000)
+    cookie = request.headers.get('Cookie', '')
+    if config.rate_limit and state.over_limit(cookie, config.rate_limit, config.rate_window):
+        state.count('rate_limited')
+        return Response('', status=418)
+    roll = random.random()
+    if roll < config.error_418_rate:
+        state.count('error_418')
+        return Response('', status=418)
+    roll -= config.error_418_rate
+    if roll < config.error_414_rate:
+        state.count('error_414')
+        return Response('', status=414)
+    roll -= config.error_414_rate
+    if roll < config.captcha_rate:
+        state.count('captcha')
+        return Response(CAPTCHA_HTML, mimetype='text/html')
+    return None
+
+
+@app.route('/weibo')
+def search():
+    keyword = request.args.get('q', '')
+    timescope = request.args.get('timescope', '')
+    page = request.args.get('page', 1, type=int)
+    state.count('search')
+    if not keyword or page > config.search_pages:
+        return Response(EMPTY_SEARCH_HTML, mimetype='text/html')
+    cards = []
+    for idx in range(20):
+        rng = _rng('search', keyword, timescope, page, idx)
+        if _rng('search-shared', keyword, timescope, page, idx).random() < config.keyword_overlap:
+            # 相关关键词在同一位置返回同一条推文，模拟多个关键词结果高度重叠
+            rng = _rng('search', timescope, page, idx)
+        mid = 4800000000000000 + rng.randint(0, 10 ** 14)
+        uid = 1000000000 + rng.randint(0, 10 ** 8)
+        cards.append(
+            f'<div class="card-wrap" action-type="feed_list_item" mid="{mid}"><div class="card">'
+            f'<p class="txt" node-type="feed_list_content">{rng.choice(TEXTS)}</p>'
+            f'<div class="from" >\n<a href="//weibo.com/{uid}/{mid_to_url(mid)}?refer_flag=1001030103_" '
+            f'target="_blank">10月19日 23:44</a>\n</div></div></div>'
+        )
+    next_link = ''
+    if page < config.search_pages:
+        query = request.query_string.decode().replace(f'page={page}', f'page={page + 1}')
+        next_link = f'<a href="/weibo?{query}" class="next">下一页</a>'
+    html = '<html><body><div id="pl_feedlist_index">' + '\n'.join(cards) + \
+           f'<div class="m-page">{next_link}</div></div></body></html>'
+    return Response(html, mimetype='text/html')
+
+
+@app.route('/realtime')
+def realtime():
+    """
+    实时搜索: 按发布时间倒序，推文按 live_rate 持续新增，mid 随发布顺序递增
+    """
+    keyword = request.args.get('q', '')
+    page = request.args.get('page', 1, type=int)
+    state.count('realtime')
+    if not keyword or page > config.search_pages:
+        return Response(EMPTY_SEARCH_HTML, mimetype='text/html')
+    newest = state.live_count(keyword, config.live_rate)
+    base = 4900000000000000 + int(hashlib.md5(keyword.encode()).hexdigest()[:6], 16) % 1000
+    cards = []
+    for idx in range(newest - (page - 1) * 20, max(newest - page * 20, 0), -1):
+        mid = base + idx * 1000
+        uid = 1000000000 + _rng('realtime', keyword, idx).randint(0, 10 ** 8)
+        cards.append(
+            f'<div class="card-wrap" action-type="feed_list_item" mid="{mid}"><div class="card">'
+            f'<div class="from" >\n<a href="//weibo.com/{uid}/{mid_to_url(mid)}?refer_flag=1001030103_" '
+            f'target="_blank">刚刚</a>\n</div></div></div>'
+        )
+    if not cards:
+        return Response(EMPTY_SEARCH_HTML, mimetype='text/html')
+    next_link = ''
+    if page < config.search_pages and newest - page * 20 > 0:
+        query = request.query_string.decode().replace(f'page={page}', f'page={page + 1}')
+        next_link = f'<a href="/realtime?{query}" class="next">下一页</a>'
+    html = '<html><body><div id="pl_feedlist_index">' + '\n'.join(cards) + \
+           f'<div class="m-page">{next_link}</div></div></body></html>'
+    return Response(html, mimetype='text/html')
+
+
+@app.route('/ajax/statuses/show')
+def statuses_show():
+    state.count('show')
+    tweet_id = request.args.get('id', '')
+    mid = int(tweet_id) if tweet_id.isdigit() else url_to_mid(tweet_id)
+    return _json(dict(make_tweet(mid), ok=1))
+
+
+@app.route('/ajax/statuses/longtext')
+def statuses_longtext():
+    state.count('longtext')
+    text = _rng('longtext', request.args.get('id', '')).choice(TEXTS)
+    return _json({'ok': 1, 'http_code': 200, 'data': {'longTextContent': text * 30}})
+
+
+@app.route('/ajax/statuses/buildComments')
+def build_comments():
+    state.count('comments')
+    root = int(request.args.get('id', 0))
+    max_id = int(request.args.get('max_id', 0))
+    fetch_level = request.args.get('fetch_level', '0')
+    count = min(int(request.args.get('count', 20)), 100)
+    total = config.replies_per_comment if fetch_level == '1' else config.comments_per_tweet
+    # max_id 即下一页的起始偏移，最后一页返回0
+    offsets = range(max_id, min(max_id + count, total))
+    comments = [make_comment(root, offset, root if fetch_level == '1' else None) for offset in offsets]
+    next_max_id = offsets.stop if offsets.stop < total else 0
+    return _json({'ok': 1, 'data': comments, 'rootComment': [], 'total_number': total, 'max_id': next_max_id})
+
+
+@app.route('/ajax/statuses/repostTimeline')
+def repost_timeline():
+    state.count('reposts')
+    mid = int(request.args.get('id', 0))
+    page = request.args.get('page', 1, type=int)
+    count = request.args.get('count', 10, type=int)
+    total = config.reposts_per_tweet
+    root = make_tweet(mid)
+    root_status = {'mid': str(mid), 'id': mid, 'mblogid': mid_to_url(mid),
+                   'created_at': root['created_at'], 'user': root['user']}
+    data = []
+    for idx in page_slice(total, page, count):
+        # 越新的转发下标越小；一部分转发自更早的转发，正文带 "//@来源昵称:" 转发链
+        tweet = make_tweet(mid + idx + 1, datetime(2022, 10, 19) + timedelta(minutes=total - idx))
+        rng = _rng('repost', mid, idx)
+        source_idx = rng.randint(idx + 1, total)
+        if source_idx < total and rng.random() < 0.6:
+            source_uid = make_tweet(mid + source_idx + 1)['user']['id']
+            tweet['text_raw'] = f'转发 //@用户{source_uid}:{rng.choice(TEXTS)}'
+        tweet['retweeted_status'] = root_status
+        data.append(tweet)
+    return _json({'ok': 1, 'data': data, 'total_number': total, 'max_page': (total + count - 1) // count})
+
+
+@app.route('/ajax/friendships/friends')
+def friendships():
+    state.count('relations')
+    uid = int(request.args.get('uid', 0))
+    page = request.args.get('page', 1, type=int)
+    relate = request.args.get('relate', 'follow')
+    total = config.relations_per_user
+    users = [make_user(1000000000 + (uid * 31 + idx * 7 + (relate == 'fans')) % 10 ** 8)
+             for idx in page_slice(total, page, 20)]
+    return _json({'ok': 1, 'users': users, 'total_number': total, 'display_total_number': total})
+
+
+@app.route('/ajax/profile/info')
+def profile_info():
+    state.count('profile')
+    return _json({'ok': 1, 'data': {'user': make_user(int(request.args.get('uid', 0)))}})
+
+
+@app.route('/ajax/profile/detail')
+def profile_detail():
+    state.count('profile_detail')
+    return _json({'ok': 1, 'data': DETAIL_TEMPLATE})
+
+
+@app.route('/ajax/statuses/searchProfile')
+def search_profile():
+    state.count('profile_tweets')
+    uid = int(request.args.get('uid', 0))
+    page = request.args.get('page', 1, type=int)
+    end = request.args.get('endtime', type=int) or int(datetime(2023, 1, 1).timestamp())
+    start = request.args.get('starttime', type=int) or end - 365 * 86400
+    total = max(int((end - start) / 86400 * config.tweets_per_day), 0)
+    tweets = []
+    for idx in page_slice(total, page, 20):
+        # 按时间倒序均匀分布在窗口内
+        created_at = datetime.fromtimestamp(end - (idx + 1) * (end - start) / (total + 1))
+        tweets.append(make_tweet(4800000000000000 + uid * 100000 + idx, created_at, uid))
+    return _json({'ok': 1, 'data': {'list': tweets, 'total': total}})
+
+
+@app.route('/<any(orj360, orj480, orj960, large, mw2000):size>/<pic_id>')
+def media_picture(size, pic_id):
+    """
+    图片CDN: 内容只由 pic_id 决定，同一图片的不同尺寸URL返回相同内容
+    """
+    state.count('media')
+    return Response(_rng('media', pic_id).randbytes(config.media_kb * 1024), mimetype='image/jpeg')
+
+
+@app.route('/o0/<name>')
+def media_video(name):
+    state.count('media')
+    return Response(_rng('media', name).randbytes(config.media_kb * 1024), mimetype='video/mp4')
+
+
+@app.route('/mock/stats')
+def mock_stats():
+    return jsonify({'config': config.to_dict(), 'counters': dict(state.counters)})
+
+
+@app.route('/mock/config', methods=['POST'])
+def mock_config():
+    config.update(**(request.json or {}))
+    return jsonify({'success': True, 'config': config.to_dict()})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟微博服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=int, dest='latency_ms', help='每个请求的基础延迟（毫秒）')
+    parser.add_argument('--jitter', type=int, dest='jitter_ms', help='随机附加延迟上限（毫秒）')
+    parser.add_argument('--error-418', type=float, dest='error_418_rate', help='随机418的比例')
+    parser.add_argument('--error-414', type=float, dest='error_414_rate', help='随机414的比例')
+    parser.add_argument('--captcha', type=float, dest='captcha_rate', help='随机验证码页面的比例')
+    parser.add_argument('--rate-limit', type=int, dest='rate_limit', help='每个Cookie在窗口内的请求上限')
+    parser.add_argument('--rate-window', type=int, dest='rate_window', help='频率限制窗口（秒）')
+    parser.add_argument('--search-pages', type=int, dest='search_pages')
+    parser.add_argument('--keyword-overlap', type=float, dest='keyword_overlap', help='不同关键词搜索结果重叠的比例')
+    parser.add_argument('--media-kb', type=int, dest='media_kb', help='图片/视频文件的大小（KB）')
+    parser.add_argument('--live-rate', type=float, dest='live_rate', help='实时搜索每个关键词每分钟新增的推文数')
+    parser.add_argument('--seed', type=int)
+    args = vars(parser.parse_args())
+    host, port = args.pop('host'), args.pop('port')
+    config.update(**args)
+    print(f'mock weibo server: http://{host}:{port}  (export WEIBO_MOCK_SERVER=http://{host}:{port})')
+    app.run(host=host, port=port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Web服务的日志配置
+
+日志先放入内存队列，由后台线程写入按大小轮转的文件和控制台，采集线程不再等待文件I/O:
+- WEIBO_LOG_FILE: 日志文件，默认 spider.log
+- WEIBO_LOG_LEVEL: 日志级别，默认 INFO
+- WEIBO_LOG_JSON=1: 每行输出一个JSON对象（含 extra 中的字段），便于日志系统采集
+- WEIBO_LOG_MAX_MB / WEIBO_LOG_BACKUPS: 单个文件的大小上限和保留的历史文件数
+- WEIBO_LOG_SAMPLE: 每条推文/每个用户级别的日志（extra=SAMPLED）每N条只输出1条，1为不采样
+队列满时直接丢弃新日志并计数，不阻塞采集线程。
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# 按数据条目输出的日志加上 extra=SAMPLED，由采样过滤器按调用位置抽样
+SAMPLED = {'sampled': True}
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# LogRecord 自带的属性，其余属性视为 extra 字段
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener = None
+_queue_handler = None
+_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    每条日志输出为一行JSON
+    """
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key not in data:
+                data[key] = value
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exc_info'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SampleFilter(logging.Filter):
+    """
+    带 sampled 标记的 INFO 及以下日志，同一调用位置每 every 条只保留第1条，并记下采样率
+    """
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = every
+        self.counts = {}
+
+    def filter(self, record):
+        if self.every <= 1 or not getattr(record, 'sampled', False) or record.levelno > logging.INFO:
+            return True
+        key = (record.pathname, record.lineno)
+        # 多线程下计数偶有偏差不影响采样效果，不加锁
+        count = self.counts.get(key, 0)
+        self.counts[key] = count + 1
+        if count % self.every:
+            return False
+        record.sampled = self.every
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    队列满时丢弃日志而不是阻塞或报错
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # 保留 extra 字段和异常信息，由后台线程格式化
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+class _TextFormatter(logging.Formatter):
+    """
+    文本格式，被采样的日志标出采样率
+    """
+
+    def format(self, record):
+        text = super().format(record)
+        sampled = getattr(record, 'sampled', None)
+        if isinstance(sampled, int) and not isinstance(sampled, bool) and sampled > 1:
+            text += f' [1/{sampled}]'
+        return text
+
+
+def setup_logging(log_file=None, level=None, json_format=None, max_bytes=None, backup_count=None,
+                  sample_every=None, queue_size=10000):
+    """
+    配置根日志器，重复调用时直接返回已有的队列处理器
+    """
+    global _listener, _queue_handler
+    with _lock:
+        if _queue_handler is not None:
+            return _queue_handler
+        log_file = log_file or os.environ.get('WEIBO_LOG_FILE', 'spider.log')
+        level = level or os.environ.get('WEIBO_LOG_LEVEL', 'INFO')
+        if json_format is None:
+            json_format = os.environ.get('WEIBO_LOG_JSON', '') == '1'
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get('WEIBO_LOG_MAX_MB', 10)) * 1024 * 1024)
+        if backup_count is None:
+            backup_count = int(os.environ.get('WEIBO_LOG_BACKUPS', 5))
+        if sample_every is None:
+            sample_every = int(os.environ.get('WEIBO_LOG_SAMPLE', 100))
+
+        formatter = JsonFormatter() if json_format else _TextFormatter(LOG_FORMAT)
+        file_handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count,
+                                           encoding='utf-8', delay=True)
+        stream_handler = logging.StreamHandler()
+        for handler in (file_handler, stream_handler):
+            handler.setFormatter(formatter)
+
+        log_queue = queue.Queue(maxsize=queue_size)
+        _queue_handler = NonBlockingQueueHandler(log_queue)
+        _queue_handler.addFilter(SampleFilter(sample_every))
+        _listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+        root = logging.getLogger()
+        root.setLevel(level)
+        root.addHandler(_queue_handler)
+        return _queue_handler
+
+
+def shutdown_logging():
+    """
+    写完队列中剩余的日志
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def dropped_count():
+    return _queue_handler.dropped if _queue_handler is not None else 0
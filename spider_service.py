@@ -8,35 +8,257 @@ import json
 import re
 import time
 import logging
+import threading
 import urllib.parse
+from collections import OrderedDict
 import requests
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
-from weibospider.spiders.common import parse_tweet_info, parse_long_tweet
-
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('spider.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+from requests.adapters import HTTPAdapter
+from log_config import SAMPLED, setup_logging
+from weibospider.spiders import metrics
+from weibospider.spiders.common import parse_tweet_info, parse_long_tweet, parse_user_info, rewrite_host, url_to_mid
+from weibospider.spiders.near_dup import NearDuplicateIndex
+from weibospider.spiders.profile import ProfileCache, parse_user_detail
+from weibospider.spiders.tracing import StageTimer
+from weibospider.spiders.watermark import WatermarkStore
+
+# 配置日志: 异步写入按大小轮转的 spider.log，逐条推文的日志按 WEIBO_LOG_SAMPLE 采样
+setup_logging()
 logger = logging.getLogger(__name__)
 
+# 进程内共享的用户资料缓存，默认与Scrapy爬虫使用同一个sqlite文件
+PROFILE_CACHE_PATH = os.environ.get('WEIBO_PROFILE_CACHE',
+                                    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                 'output', 'profile_cache.db'))
+PROFILE_CACHE_TTL = int(os.environ.get('WEIBO_PROFILE_CACHE_TTL', 24 * 3600))
+# 关键词监控的水位线（每个关键词已见过的最大mid），重启后从上次的位置继续
+MONITOR_WATERMARK_PATH = os.environ.get('WEIBO_MONITOR_WATERMARKS',
+                                        os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                     'output', 'watermarks.json'))
+REALTIME_URL = "https://s.weibo.com/realtime?q={}&rd=realtime&tw=realtime&Refer=weibo_realtime&page={}"
+_shared_profile_cache = None
+_shared_profile_cache_lock = threading.Lock()
+# 用户详细信息与基本信息并发请求时使用的线程池
+_profile_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='profile')
+# 批量查询用户时所有请求共用的线程池，限制整个进程的并发查询数
+_lookup_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='user-lookup')
+
+
+def get_profile_cache():
+    """
+    进程内共享的用户资料缓存，首次使用时创建
+    """
+    global _shared_profile_cache
+    with _shared_profile_cache_lock:
+        if _shared_profile_cache is None:
+            _shared_profile_cache = ProfileCache(ttl=PROFILE_CACHE_TTL, path=PROFILE_CACHE_PATH)
+            metrics.watch_cache('profile', _shared_profile_cache)
+        return _shared_profile_cache
+
+
+class MockServerAdapter(HTTPAdapter):
+    """把发往微博站点的请求改写到本地模拟服务"""
+
+    def __init__(self, base_url, **kwargs):
+        self.base_url = base_url
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        request.url = rewrite_host(request.url, self.base_url)
+        return super().send(request, **kwargs)
+
+
+def _accept_encoding():
+    """
+    requests 会自动解压响应；装了 brotli 时额外接受 br 压缩
+    """
+    try:
+        import brotli  # noqa: F401
+        return 'gzip, deflate, br'
+    except ImportError:
+        return 'gzip, deflate'
+
+
+class SessionPool:
+    """
+    进程内共享的 requests.Session 池，每个账号（Cookie）一个长连接会话
+
+    同一账号的搜索任务、用户查询共用连接，省去重复的TCP/TLS握手；
+    超过 max_accounts 时关闭最久未使用的会话
+    """
+
+    def __init__(self, max_accounts=16, pool_connections=8, pool_maxsize=32):
+        self.max_accounts = max_accounts
+        self.pool_connections = pool_connections  # 每个会话缓存的主机连接池数
+        self.pool_maxsize = pool_maxsize  # 每个主机保持的最大连接数，应不小于并发线程数
+        self.sessions = OrderedDict()  # (cookie, mock_server) -> Session
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def get(self, cookie, mock_server=None):
+        """
+        获取账号对应的会话，不存在时创建
+        """
+        key = (cookie or '', mock_server or '')
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is None:
+                session = self.sessions[key] = self._create(cookie, mock_server)
+                self.created += 1
+                while len(self.sessions) > self.max_accounts:
+                    _, old = self.sessions.popitem(last=False)
+                    old.close()
+            self.sessions.move_to_end(key)
+            return session
+
+    def _create(self, cookie, mock_server):
+        session = requests.Session()
+        session.headers.update({
+            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.13; rv:61.0) Gecko/20100101 Firefox/61.0',
+            'Cookie': cookie or '',
+            'Referer': 'https://s.weibo.com/',
+            'Accept-Encoding': _accept_encoding(),
+        })
+        sizes = {'pool_connections': self.pool_connections, 'pool_maxsize': self.pool_maxsize}
+        if mock_server:
+            # 指定了模拟服务时，所有请求改发到本地
+            adapter = MockServerAdapter(mock_server, **sizes)
+            session.mount('https://s.weibo.com/', adapter)
+            session.mount('https://weibo.com/', adapter)
+            logger.info(f"使用模拟服务: {mock_server}")
+        else:
+            adapter = HTTPAdapter(**sizes)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        return session
+
+    def stats(self):
+        """
+        连接复用统计: 请求数、新建连接数和复用率
+        """
+        with self.lock:
+            sessions = list(self.sessions.values())
+        requests_count = connections = 0
+        for session in sessions:
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools.get(key)
+                    if pool is not None:
+                        requests_count += pool.num_requests
+                        connections += pool.num_connections
+        return {
+            'accounts': len(sessions),
+            'sessions_created': self.created,
+            'requests': requests_count,
+            'connections': connections,
+            'reuse_ratio': round(1 - connections / requests_count, 4) if requests_count else 0.0,
+        }
+
+
+class BudgetExhausted(Exception):
+    """
+    任务预算已用完，不再发送请求
+    """
+
+
+class TaskBudget:
+    """
+    单个任务的资源预算: 最多请求数、最多推文数、最长运行时间（秒）和每分钟请求数，为空的项不限制
+
+    请求数和速率在每次发送请求前检查，推文数和运行时间在爬取循环中与停止标志一起检查；
+    任一项用完后 reason 记录原因（max_requests/max_items/max_seconds），任务停止并保留已获取的结果
+    """
+    LIMITS = ('max_requests', 'max_items', 'max_seconds', 'requests_per_minute')
+
+    def __init__(self, max_requests=None, max_items=None, max_seconds=None, requests_per_minute=None):
+        self.max_requests = max_requests
+        self.max_items = max_items
+        self.max_seconds = max_seconds
+        self.requests_per_minute = requests_per_minute
+        self.started = time.time()
+        self.requests = 0
+        self.items = 0
+        self.reason = None
+        self.next_request_at = 0  # 按速率限制下一次请求最早的发送时间
+        self.lock = threading.Lock()
+
+    def check(self):
+        """
+        返回已用完的预算项，都未用完时返回None
+        """
+        with self.lock:
+            if self.reason is None:
+                if self.max_seconds and time.time() - self.started >= self.max_seconds:
+                    self.reason = 'max_seconds'
+                elif self.max_requests and self.requests >= self.max_requests:
+                    self.reason = 'max_requests'
+                elif self.max_items and self.items >= self.max_items:
+                    self.reason = 'max_items'
+            return self.reason
+
+    def acquire(self):
+        """
+        登记一次请求，返回按速率限制需要等待的秒数；预算已用完时抛出 BudgetExhausted
+        """
+        reason = self.check()
+        if reason:
+            raise BudgetExhausted(reason)
+        with self.lock:
+            self.requests += 1
+            if not self.requests_per_minute:
+                return 0
+            now = time.time()
+            wait = max(self.next_request_at - now, 0)
+            self.next_request_at = max(self.next_request_at, now) + 60.0 / self.requests_per_minute
+            return wait
+
+    def remaining(self):
+        """
+        距离最长运行时间的秒数，不限制时返回None
+        """
+        if not self.max_seconds:
+            return None
+        return max(self.started + self.max_seconds - time.time(), 0)
+
+    def add_item(self, count=1):
+        with self.lock:
+            self.items += count
+
+    def snapshot(self):
+        with self.lock:
+            state = {name: getattr(self, name) for name in self.LIMITS}
+            state.update(requests=self.requests, items=self.items,
+                         elapsed=round(time.time() - self.started, 1), reason=self.reason)
+            return state
+
+
+session_pool = SessionPool()
+# 不属于搜索任务的请求（如用户查询）的指标标签
+SERVICE_TASK = 'service'
+metrics.start_task(SERVICE_TASK)
+
 
 class WeiboSpiderService:
     """微博爬虫服务类"""
     
-    def __init__(self, cookie=None, stop_flag=None):
+    def __init__(self, cookie=None, stop_flag=None, request_interval=0.5, page_interval=1,
+                 mock_server=None, profile_cache=None, task_id=None, near_dup=None, budget=None):
         self.cookie = cookie
+        self.task_id = task_id or SERVICE_TASK  # 运行指标中的 task 标签
+        self.profile_cache = profile_cache or get_profile_cache()
         self.stop_flag = stop_flag  # 停止标志
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.13; rv:61.0) Gecko/20100101 Firefox/61.0',
-            'Cookie': cookie or '',
-            'Referer': 'https://s.weibo.com/'
-        })
+        self.budget = budget or TaskBudget()  # 任务预算，默认不限制
+        self.request_interval = request_interval  # 推文详情请求间隔（秒）
+        self.page_interval = page_interval  # 翻页/时间切片间隔（秒）
+        self.tweet_index = {}  # 本次搜索已获取的推文ID -> 推文，用于跨关键词去重
+        # 近似重复的推文: tag 在 duplicate_of 中标出最早的相似推文，drop 直接丢弃；默认取 WEIBO_NEAR_DUP 环境变量
+        self.near_dup = os.environ.get('WEIBO_NEAR_DUP', '') if near_dup is None else near_dup
+        self.near_dups = NearDuplicateIndex() if self.near_dup in ('tag', 'drop') else None
+        self.timer = StageTimer()  # 各阶段耗时: network.*（按接口）、extract、json、parse、sleep
+        # 同一账号复用进程内共享的长连接会话；WEIBO_MOCK_SERVER 环境变量同样可以指定模拟服务
+        self.session = session_pool.get(cookie, mock_server or os.environ.get('WEIBO_MOCK_SERVER'))
     
     def search_by_keyword(self, keyword, start_time, end_time, is_split_by_hour=False, 
                          progress_callback=None):
@@ -53,144 +275,264 @@ class WeiboSpiderService:
         Returns:
             list: 搜索结果列表
         """
+        return self.search_by_keywords([keyword], start_time, end_time, is_split_by_hour, progress_callback)
+
+    def search_by_keywords(self, keywords, start_time, end_time, is_split_by_hour=False,
+                           progress_callback=None):
+        """
+        批量关键词搜索
+
+        所有关键词按时间片交替调度，共用一个推文ID去重表：同一条推文只请求一次详情，
+        之后其他关键词再搜到时只把关键词追加到该推文的 keywords 中
+        
+        Args:
+            keywords: 搜索关键词列表
+            start_time: 开始时间 (datetime对象)
+            end_time: 结束时间 (datetime对象)
+            is_split_by_hour: 是否按小时切分
+            progress_callback: 进度回调函数 callback(count, items)
+        
+        Returns:
+            list: 去重后的搜索结果列表
+        """
+        keywords = list(dict.fromkeys(keyword for keyword in keywords if keyword))
         results = []
+        self.tweet_index = {}
+        self.timer = StageTimer()
+        metrics.start_task(self.task_id)
         
         try:
-            logger.info(f"开始搜索关键词: {keyword}, 时间范围: {start_time} 到 {end_time}")
+            logger.info(f"开始搜索关键词: {', '.join(keywords)}, 时间范围: {start_time} 到 {end_time}")
             
             if not is_split_by_hour:
                 # 不按小时切分
-                _start_time = start_time.strftime("%Y-%m-%d-%H")
-                _end_time = end_time.strftime("%Y-%m-%d-%H")
-                # URL编码关键词
-                encoded_keyword = urllib.parse.quote(keyword)
-                url = f"https://s.weibo.com/weibo?q={encoded_keyword}&timescope=custom%3A{_start_time}%3A{_end_time}&page=1"
-                logger.info(f"搜索URL: {url}")
-                results.extend(self._crawl_search_page(url, keyword, progress_callback))
+                time_slices = [(start_time, end_time)]
             else:
                 # 按小时切分
+                time_slices = []
                 time_cur = start_time
                 while time_cur < end_time:
-                    if self.stop_flag and self.stop_flag.is_set():
-                        logger.info("收到停止信号，停止搜索")
+                    time_slices.append((time_cur, time_cur + timedelta(hours=1)))
+                    time_cur = time_cur + timedelta(hours=1)
+            
+            for slice_start, slice_end in time_slices:
+                _start_time = slice_start.strftime("%Y-%m-%d-%H")
+                _end_time = slice_end.strftime("%Y-%m-%d-%H")
+                for keyword in keywords:
+                    if self._stopped():
+                        logger.info("收到停止信号或任务预算已用完，停止搜索")
                         break
-                    
-                    _start_time = time_cur.strftime("%Y-%m-%d-%H")
-                    _end_time = (time_cur + timedelta(hours=1)).strftime("%Y-%m-%d-%H")
+                    # URL编码关键词
                     encoded_keyword = urllib.parse.quote(keyword)
                     url = f"https://s.weibo.com/weibo?q={encoded_keyword}&timescope=custom%3A{_start_time}%3A{_end_time}&page=1"
-                    results.extend(self._crawl_search_page(url, keyword, progress_callback))
-                    time_cur = time_cur + timedelta(hours=1)
-                    time.sleep(1)  # 避免请求过快
+                    logger.info(f"搜索URL: {url}")
+                    self._crawl_search_page(url, keyword, progress_callback, collected=results)
+                    if len(time_slices) > 1 or len(keywords) > 1:
+                        self._sleep(self.page_interval)  # 避免请求过快
+                if self._stopped():
+                    break
             
+            if self.budget.reason:
+                logger.info(f"任务预算已用完（{self.budget.reason}），保留已获取的 {len(results)} 条结果")
             logger.info(f"搜索完成，共找到 {len(results)} 条结果")
         
         except Exception as e:
             logger.error(f"搜索失败: {str(e)}", exc_info=True)
             raise Exception(f"搜索失败: {str(e)}")
+        finally:
+            metrics.finish_task(self.task_id)
         
         return results
     
-    def _crawl_search_page(self, url, keyword, progress_callback=None):
-        """爬取搜索页面"""
+    def monitor_keyword(self, keyword, since_mid=None, min_interval=10, max_interval=600, max_pages=5,
+                        target_per_poll=10, progress_callback=None, state_callback=None, max_polls=None):
+        """
+        持续监控关键词的实时搜索结果，直到收到停止信号
+
+        每轮只从最新一页往后翻，遇到不大于水位线（已见过的最大mid）的推文即停止；没有水位线时
+        第一轮只取第一页作为起点。轮询间隔按新推文速率（指数平滑）自适应: 目标是每轮约
+        target_per_poll 条新推文，安静时逐步拉长到 max_interval，突增时缩短；翻完 max_pages
+        仍未到达水位线说明间隔过长漏了数据，立即回到 min_interval。
+
+        Args:
+            keyword: 监控的关键词
+            since_mid: 起始水位线，为空时使用上次监控保存的水位线
+            progress_callback: 进度回调函数 callback(count, items)，count 为累计新推文数，
+                items 为本轮已获取的新推文（按发布顺序），长时间运行也不会累积全部结果
+            state_callback: 每轮结束后的回调 callback(state)，state 含水位线、间隔、速率等
+            max_polls: 最多轮询次数，为空时一直运行到停止
+
+        Returns:
+            int: 监控期间获取的新推文数
+        """
+        count = 0
+        self.timer = StageTimer()
+        watermarks = WatermarkStore(MONITOR_WATERMARK_PATH, 'monitor')
+        if since_mid is None:
+            since_mid = watermarks.get(keyword)
+        interval = min_interval
+        rate = None  # 新推文速率（条/秒）
+        last_poll = None
+        polls = 0
+        metrics.start_task(self.task_id)
+        logger.info(f"开始监控关键词: {keyword}, 水位线: {since_mid}")
+
+        try:
+            while not self._stopped():
+                poll_started = time.time()
+                new_ids, reached = self._poll_realtime(keyword, since_mid, max_pages)
+                results = []
+                # 按发布顺序获取详情，结果流与时间线一致
+                for mid, tweet_id in reversed(new_ids):
+                    if self._stopped():
+                        break
+                    tweet = self._get_tweet_detail(tweet_id, keyword)
+                    if tweet:
+                        results.append(tweet)
+                        count += 1
+                        self.budget.add_item()
+                        metrics.ITEMS.inc(task=self.task_id)
+                        logger.info(f"监控获取新推文: {tweet.get('_id', 'unknown')}",
+                                    extra=dict(SAMPLED, task_id=self.task_id, keyword=keyword))
+                        if progress_callback:
+                            progress_callback(count, results)
+                    self._sleep(self.request_interval)
+                if new_ids and not self._stopped():
+                    since_mid = max(since_mid or 0, new_ids[0][0])
+                    watermarks.set(keyword, since_mid)
+                    watermarks.save()
+
+                if last_poll is not None:
+                    observed = len(new_ids) / max(poll_started - last_poll, 1e-3)
+                    rate = observed if rate is None else 0.5 * rate + 0.5 * observed
+                last_poll = poll_started
+                if not reached:
+                    logger.warning(f"监控 {keyword}: 翻完 {max_pages} 页仍未到达水位线，中间的推文已被跳过，缩短轮询间隔")
+                if not reached or rate is None:
+                    interval = min_interval
+                elif rate > 0:
+                    interval = min(max(target_per_poll / rate, min_interval), max_interval)
+                else:
+                    interval = min(interval * 2, max_interval)
+                polls += 1
+
+                state = {
+                    'since_mid': since_mid,
+                    'interval': round(interval, 1),
+                    'rate_per_minute': round(rate * 60, 2) if rate is not None else None,
+                    'polls': polls,
+                    'last_new': len(new_ids),
+                    'gap': not reached,
+                }
+                logger.info(f"监控 {keyword} 第 {polls} 轮: 新推文 {len(new_ids)} 条，下次间隔 {interval:.1f} 秒")
+                if state_callback:
+                    state_callback(state)
+                if max_polls and polls >= max_polls:
+                    break
+                self._sleep(interval)
+
+            if self.budget.reason:
+                logger.info(f"任务预算已用完（{self.budget.reason}），停止监控")
+            logger.info(f"监控结束，共获取 {count} 条新推文")
+        except Exception as e:
+            logger.error(f"监控失败: {str(e)}", exc_info=True)
+            raise Exception(f"监控失败: {str(e)}")
+        finally:
+            metrics.finish_task(self.task_id)
+
+        return count
+    
+    def _crawl_search_page(self, url, keyword, progress_callback=None, collected=None):
+        """
+        爬取搜索页面，返回本次新获取的推文
+
+        collected 为批量搜索的汇总列表，新推文同时追加进去，进度回调按汇总列表计数
+        """
         results = []
+        collected = results if collected is None else collected
+        tweet_index = self.tweet_index
         page = 1
         max_pages = 100  # 限制最大页数，避免无限循环
         
         while page <= max_pages:
             # 检查停止标志
-            if self.stop_flag and self.stop_flag.is_set():
-                logger.info("收到停止信号，停止爬取")
+            if self._stopped():
+                logger.info("收到停止信号或任务预算已用完，停止爬取")
                 break
             
             try:
                 logger.info(f"正在爬取第 {page} 页: {url}")
                 
                 # 请求搜索页面
-                response = self.session.get(url, timeout=15)
+                response = self._get(url)
                 response.encoding = 'utf-8'
                 
                 if response.status_code != 200:
                     logger.warning(f"请求失败，状态码: {response.status_code}")
                     break
                 
+                extract_started = time.perf_counter()
                 html = response.text
                 
                 # 检查是否有结果
                 if '<p>抱歉，未找到相关结果。</p>' in html or '抱歉，未找到相关结果' in html:
+                    self.timer.add('extract', time.perf_counter() - extract_started)
                     logger.info("未找到相关结果")
                     break
                 
-                # 提取推文ID - 使用多种正则表达式模式
-                tweets_infos = re.findall('<div class="from"\s+>(.*?)</div>', html, re.DOTALL)
-                tweet_ids = []
-                
-                # 方法1: 在from div中查找（原始Scrapy方法，但去掉末尾空格要求）
-                for tweets_info in tweets_infos:
-                    # 尝试多种变体
-                    ids = re.findall(r'weibo\.com/\d+/(.+?)\?refer_flag=1001030103_"', tweets_info)
-                    if not ids:
-                        # 尝试协议相对URL
-                        ids = re.findall(r'//weibo\.com/\d+/(.+?)\?refer_flag=1001030103_"', tweets_info)
-                    tweet_ids.extend(ids)
-                
-                # 方法2: 如果方法1没找到，直接在整个HTML中查找（更可靠）
-                if not tweet_ids:
-                    # 匹配所有包含refer_flag=1001030103_的推文链接
-                    all_matches = re.findall(r'(?:https?://|//)?weibo\.com/(\d+)/([A-Za-z0-9]{6,})\?refer_flag=1001030103_', html)
-                    tweet_ids = [tid[1] for tid in all_matches]  # 提取推文ID（第二个捕获组）
-                    # 去重
-                    tweet_ids = list(set(tweet_ids))
-                    if tweet_ids:
-                        logger.info(f"使用方法2（全HTML搜索）找到 {len(tweet_ids)} 个推文ID")
-                
-                # 方法3: 尝试匹配 mid 属性 (如 mid="4829255386537989") - 针对新版页面结构
-                if not tweet_ids:
-                    mid_matches = re.findall(r'mid="(\d+)"', html)
-                    if mid_matches:
-                        tweet_ids = list(set(mid_matches))
-                        logger.info(f"使用方法3（mid属性）找到 {len(tweet_ids)} 个推文ID")
-                
-                # 如果还是没找到，记录警告
-                if not tweet_ids:
-                    logger.warning("未找到任何推文ID，HTML可能已变化")
-                    # 尝试最简单的模式作为最后手段
-                    simple_matches = re.findall(r'weibo\.com/\d+/([A-Za-z0-9]{6,})\?', html)
-                    tweet_ids = list(set(simple_matches))
-                    if tweet_ids:
-                        logger.info(f"使用简单模式找到 {len(tweet_ids)} 个推文ID")
+                tweet_ids = self._extract_tweet_ids(html)
+                self.timer.add('extract', time.perf_counter() - extract_started)
                 
                 logger.info(f"第 {page} 页找到 {len(tweet_ids)} 条推文ID")
                 
                 # 获取每条推文详情
                 for idx, tweet_id in enumerate(tweet_ids):
-                    if self.stop_flag and self.stop_flag.is_set():
-                        logger.info("收到停止信号，停止获取推文详情")
+                    metrics.QUEUE_DEPTH.set(len(tweet_ids) - idx, task=self.task_id, queue='tweet_detail')
+                    if self._stopped():
+                        logger.info("收到停止信号或任务预算已用完，停止获取推文详情")
                         break
                     
+                    known = tweet_index.get(tweet_id)
+                    if known is not None:
+                        # 其他关键词（或其他时间片）已获取过，只记录命中的关键词
+                        if keyword not in known['keywords']:
+                            known['keywords'].append(keyword)
+                        continue
+                    
                     try:
-                        logger.debug(f"正在获取推文详情 {idx+1}/{len(tweet_ids)}: {tweet_id}")
+                        logger.debug(f"正在获取推文详情 {idx+1}/{len(tweet_ids)}: {tweet_id}", extra=SAMPLED)
                         tweet = self._get_tweet_detail(tweet_id, keyword)
                         if tweet:
+                            tweet_index[tweet_id] = tweet
                             results.append(tweet)
-                            logger.info(f"成功获取推文: {tweet.get('_id', 'unknown')}")
+                            if collected is not results:
+                                collected.append(tweet)
+                            self.budget.add_item()
+                            metrics.ITEMS.inc(task=self.task_id)
+                            logger.info(f"成功获取推文: {tweet.get('_id', 'unknown')}",
+                                        extra=dict(SAMPLED, task_id=self.task_id, keyword=keyword))
                             if progress_callback:
-                                progress_callback(len(results), results)
-                        time.sleep(0.5)  # 避免请求过快
+                                progress_callback(len(collected), collected)
+                        self._sleep(self.request_interval)  # 避免请求过快
+                    except BudgetExhausted:
+                        break
                     except Exception as e:
                         logger.warning(f"获取推文详情失败 {tweet_id}: {e}")
                         continue
+                metrics.QUEUE_DEPTH.set(0, task=self.task_id, queue='tweet_detail')
                 
                 # 查找下一页
                 next_page = re.search('<a href="(.*?)" class="next">下一页</a>', html)
                 if next_page:
                     url = "https://s.weibo.com" + next_page.group(1)
                     page += 1
-                    time.sleep(1)  # 页面间延迟
+                    self._sleep(self.page_interval)  # 页面间延迟
                 else:
                     logger.info("没有更多页面")
                     break
                     
+            except BudgetExhausted:
+                break
             except requests.exceptions.RequestException as e:
                 logger.error(f"网络请求失败 {url}: {e}")
                 break
@@ -201,11 +543,102 @@ class WeiboSpiderService:
         logger.info(f"本批次爬取完成，共获取 {len(results)} 条结果")
         return results
     
+    def _poll_realtime(self, keyword, since_mid, max_pages):
+        """
+        从实时搜索第一页往后翻，返回 ([(mid, 推文ID)]（mid降序）, 是否到达水位线)
+        """
+        found = {}
+        reached = since_mid is None
+        pages = 1 if since_mid is None else max_pages
+        encoded_keyword = urllib.parse.quote(keyword)
+        for page in range(1, pages + 1):
+            if self._stopped():
+                break
+            url = REALTIME_URL.format(encoded_keyword, page)
+            try:
+                response = self._get(url)
+            except BudgetExhausted:
+                break
+            except requests.exceptions.RequestException as e:
+                logger.error(f"网络请求失败 {url}: {e}")
+                # 本轮未能确认是否漏数据，按到达处理，避免错误地缩短间隔
+                reached = True
+                break
+            response.encoding = 'utf-8'
+            if response.status_code != 200:
+                logger.warning(f"请求失败，状态码: {response.status_code}")
+                reached = True
+                break
+            html = response.text
+            if '抱歉，未找到相关结果' in html:
+                reached = True
+                break
+            with self.timer.span('extract'):
+                tweet_ids = self._extract_tweet_ids(html)
+            for tweet_id in tweet_ids:
+                mid = int(tweet_id) if tweet_id.isdigit() else url_to_mid(tweet_id)
+                if since_mid is not None and mid <= since_mid:
+                    reached = True
+                else:
+                    found[mid] = tweet_id
+            if reached:
+                break
+            if 'class="next"' not in html:
+                reached = True
+                break
+            if page < pages:
+                self._sleep(self.page_interval)
+        return sorted(found.items(), reverse=True), reached
+
+    def _extract_tweet_ids(self, html):
+        """
+        从搜索结果页提取推文ID（mblogid，新版页面可能为数字mid）
+        """
+        # 提取推文ID - 使用多种正则表达式模式
+        tweets_infos = re.findall('<div class="from"\s+>(.*?)</div>', html, re.DOTALL)
+        tweet_ids = []
+        
+        # 方法1: 在from div中查找（原始Scrapy方法，但去掉末尾空格要求）
+        for tweets_info in tweets_infos:
+            # 尝试多种变体
+            ids = re.findall(r'weibo\.com/\d+/(.+?)\?refer_flag=1001030103_"', tweets_info)
+            if not ids:
+                # 尝试协议相对URL
+                ids = re.findall(r'//weibo\.com/\d+/(.+?)\?refer_flag=1001030103_"', tweets_info)
+            tweet_ids.extend(ids)
+        
+        # 方法2: 如果方法1没找到，直接在整个HTML中查找（更可靠）
+        if not tweet_ids:
+            # 匹配所有包含refer_flag=1001030103_的推文链接
+            all_matches = re.findall(r'(?:https?://|//)?weibo\.com/(\d+)/([A-Za-z0-9]{6,})\?refer_flag=1001030103_', html)
+            tweet_ids = [tid[1] for tid in all_matches]  # 提取推文ID（第二个捕获组）
+            # 去重
+            tweet_ids = list(set(tweet_ids))
+            if tweet_ids:
+                logger.info(f"使用方法2（全HTML搜索）找到 {len(tweet_ids)} 个推文ID")
+        
+        # 方法3: 尝试匹配 mid 属性 (如 mid="4829255386537989") - 针对新版页面结构
+        if not tweet_ids:
+            mid_matches = re.findall(r'mid="(\d+)"', html)
+            if mid_matches:
+                tweet_ids = list(set(mid_matches))
+                logger.info(f"使用方法3（mid属性）找到 {len(tweet_ids)} 个推文ID")
+        
+        # 如果还是没找到，记录警告
+        if not tweet_ids:
+            logger.warning("未找到任何推文ID，HTML可能已变化")
+            # 尝试最简单的模式作为最后手段
+            simple_matches = re.findall(r'weibo\.com/\d+/([A-Za-z0-9]{6,})\?', html)
+            tweet_ids = list(set(simple_matches))
+            if tweet_ids:
+                logger.info(f"使用简单模式找到 {len(tweet_ids)} 个推文ID")
+        return tweet_ids
+
     def _get_tweet_detail(self, tweet_id, keyword):
         """获取推文详情"""
         try:
             url = f"https://weibo.com/ajax/statuses/show?id={tweet_id}"
-            response = self.session.get(url, timeout=15)
+            response = self._get(url)
             response.encoding = 'utf-8'
             
             if response.status_code != 200:
@@ -218,7 +651,8 @@ class WeiboSpiderService:
                 if not content.strip().startswith('{'):
                     logger.warning(f"推文详情响应内容不是JSON格式，可能Cookie已失效或触发验证。内容摘要: {content[:200]}")
                     return None
-                data = json.loads(content)
+                with self.timer.span('json'):
+                    data = json.loads(content)
             except json.JSONDecodeError as e:
                 logger.error(f"JSON解析失败: {e}, 内容摘要: {response.text[:200]}")
                 return None
@@ -236,25 +670,42 @@ class WeiboSpiderService:
                 return None
             
             # 直接使用顶层数据，不需要data['data']
-            item = parse_tweet_info(data)
+            with self.timer.span('parse'):
+                item = parse_tweet_info(data)
             item['keyword'] = keyword
+            item['keywords'] = [keyword]
+            
+            if self.near_dups is not None:
+                duplicate_of = self.near_dups.check(item['_id'], item.get('content'))
+                if duplicate_of is not None:
+                    logger.debug(f"近似重复的推文 {item['_id']}，与 {duplicate_of} 相似", extra=SAMPLED)
+                    if self.near_dup == 'drop':
+                        return None
+                    # 近似重复的推文不再获取长微博全文
+                    item['duplicate_of'] = duplicate_of
+                    return item
             
             # 如果是长微博，获取全文
             if item.get('isLongText'):
                 try:
                     long_url = f"https://weibo.com/ajax/statuses/longtext?id={item['mblogid']}"
-                    long_response = self.session.get(long_url, timeout=15)
+                    long_response = self._get(long_url)
                     long_response.encoding = 'utf-8'
                     if long_response.status_code == 200:
                         long_data = json.loads(long_response.text)
                         if 'data' in long_data:
                             item['content'] = long_data['data'].get('longTextContent', item.get('content', ''))
-                            logger.debug(f"成功获取长微博全文: {item['mblogid']}")
+                            logger.debug(f"成功获取长微博全文: {item['mblogid']}", extra=SAMPLED)
+                except BudgetExhausted:
+                    # 预算已用完时保留截断的正文
+                    pass
                 except Exception as e:
                     logger.warning(f"获取长微博失败 {item['mblogid']}: {e}")
             
             return item
             
+        except BudgetExhausted:
+            raise
         except json.JSONDecodeError as e:
             logger.error(f"JSON解析失败 {tweet_id}: {e}")
             return None
@@ -262,9 +713,53 @@ class WeiboSpiderService:
             logger.error(f"获取推文详情异常 {tweet_id}: {e}", exc_info=True)
             return None
 
+    def _get(self, url, timeout=15):
+        """
+        发送GET请求，并记录耗时和响应类型指标
+
+        请求计入任务预算，超过每分钟请求数时先等待；预算已用完时抛出 BudgetExhausted
+        """
+        self._sleep(self.budget.acquire())
+        started = time.perf_counter()
+        try:
+            response = self.session.get(url, timeout=timeout)
+        except requests.exceptions.RequestException:
+            elapsed = time.perf_counter() - started
+            self.timer.add(f'network.{metrics.endpoint_type(url)}', elapsed)
+            metrics.observe_error(self.task_id, url, elapsed)
+            raise
+        elapsed = time.perf_counter() - started
+        self.timer.add(f'network.{metrics.endpoint_type(url)}', elapsed)
+        metrics.observe_response(self.task_id, url, response.status_code, response.content, elapsed)
+        return response
+
+    def _sleep(self, seconds):
+        """
+        请求间隔，计入 sleep 阶段；收到停止信号或到达最长运行时间时立即结束等待
+        """
+        remaining = self.budget.remaining()
+        if remaining is not None:
+            seconds = min(seconds, remaining)
+        if seconds > 0:
+            with self.timer.span('sleep'):
+                if self.stop_flag:
+                    self.stop_flag.wait(seconds)
+                else:
+                    time.sleep(seconds)
+
+    def _stopped(self):
+        """
+        是否收到停止信号或任务预算已用完
+        """
+        if self.stop_flag and self.stop_flag.is_set():
+            return True
+        return self.budget.check() is not None
+
     def get_user_info(self, user_id):
         """
         获取用户信息
+
+        资料先查共享的用户资料缓存；同一用户并发的查询只请求一次
         
         Args:
             user_id: 用户ID
@@ -273,68 +768,118 @@ class WeiboSpiderService:
             dict: 用户信息字典
         """
         try:
-            logger.info(f"开始获取用户信息: {user_id}")
-            
-            # 1. 获取基本信息
-            url = f"https://weibo.com/ajax/profile/info?uid={user_id}"
-            response = self.session.get(url, timeout=15)
-            response.encoding = 'utf-8'
-            
-            if response.status_code != 200:
-                logger.warning(f"获取用户信息失败，状态码: {response.status_code}, URL: {url}")
-                return None
+            return self.profile_cache.get_or_load(user_id, self._fetch_user_info)
+        except Exception as e:
+            logger.error(f"获取用户信息异常 {user_id}: {e}", exc_info=True)
+            return None
+
+    def get_users_info(self, user_ids, timeout=None):
+        """
+        批量获取用户信息
+
+        缓存中已有的用户直接返回，其余用户在共享线程池中并发查询；超过 timeout 秒仍未完成的
+        标记为 timeout（已开始的查询会在后台完成并写入缓存），其余结果照常返回
+        
+        Args:
+            user_ids: 用户ID列表，重复的ID只查询一次
+            timeout: 整批查询的最长等待时间（秒），None表示等待全部完成
             
-            # 调试：检查响应内容是否为JSON
+        Returns:
+            list: 按输入顺序的 {'user_id', 'status', 'data'}，status 为 cached/ok/failed/timeout
+        """
+        user_ids = list(dict.fromkeys(str(user_id).strip() for user_id in user_ids if str(user_id).strip()))
+        results = {}
+        futures = {}
+        for user_id in user_ids:
+            cached = self.profile_cache.get(user_id)
+            if cached is not None:
+                results[user_id] = {'user_id': user_id, 'status': 'cached', 'data': cached}
+            else:
+                future = _lookup_executor.submit(self.get_user_info, user_id)
+                futures[future] = user_id
+                metrics.QUEUE_DEPTH.inc(task=self.task_id, queue='user_lookup')
+                future.add_done_callback(
+                    lambda f: metrics.QUEUE_DEPTH.inc(-1, task=self.task_id, queue='user_lookup'))
+        done, not_done = wait(futures, timeout=timeout)
+        for future in done:
+            user_id = futures[future]
+            data = future.result()
+            results[user_id] = {'user_id': user_id, 'status': 'ok' if data else 'failed', 'data': data}
+        for future in not_done:
+            # 还在排队的直接取消，不再占用线程池
+            future.cancel()
+            user_id = futures[future]
+            results[user_id] = {'user_id': user_id, 'status': 'timeout', 'data': None}
+        logger.info(f"批量获取用户信息: {len(user_ids)} 个用户, {len(futures)} 个未命中缓存, "
+                    f"{len(not_done)} 个超时")
+        return [results[user_id] for user_id in user_ids]
+
+    def _fetch_user_info(self, user_id):
+        """
+        请求用户信息，基本信息和详细信息两个接口并发请求
+        """
+        logger.info(f"开始获取用户信息: {user_id}", extra=SAMPLED)
+        detail_future = _profile_executor.submit(self._fetch_user_detail, user_id)
+        try:
+            item = self._fetch_user_basic(user_id)
+        finally:
+            detail_data = detail_future.result()
+        if item is None:
+            return None
+        if detail_data is not None:
             try:
-                content = response.text
-                if not content.strip().startswith('{'):
-                    logger.warning(f"响应内容不是JSON格式，可能Cookie已失效或触发验证。内容摘要: {content[:200]}")
-                    return None
-                data = json.loads(content)
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON解析失败: {e}, 内容摘要: {response.text[:200]}")
-                return None
+                parse_user_detail(item, detail_data)
+            except Exception as e:
+                logger.warning(f"解析用户详细信息失败: {e}")
+        logger.info(f"获取用户信息成功: {item.get('nick_name', user_id)}", extra=SAMPLED)
+        metrics.ITEMS.inc(task=self.task_id)
+        return item
 
-            if 'ok' in data and data['ok'] != 1:
-                logger.warning(f"API返回错误: {data.get('msg', 'unknown error')}, URL: {url}")
-                return None
-                
-            if 'data' not in data or 'user' not in data['data']:
-                logger.warning(f"返回数据格式异常: {url}")
+    def _fetch_user_basic(self, user_id):
+        """
+        1. 获取基本信息
+        """
+        url = f"https://weibo.com/ajax/profile/info?uid={user_id}"
+        response = self._get(url)
+        response.encoding = 'utf-8'
+        
+        if response.status_code != 200:
+            logger.warning(f"获取用户信息失败，状态码: {response.status_code}, URL: {url}")
+            return None
+        
+        # 调试：检查响应内容是否为JSON
+        try:
+            content = response.text
+            if not content.strip().startswith('{'):
+                logger.warning(f"响应内容不是JSON格式，可能Cookie已失效或触发验证。内容摘要: {content[:200]}")
                 return None
-                
-            from weibospider.spiders.common import parse_user_info
-            item = parse_user_info(data['data']['user'])
+            data = json.loads(content)
+        except json.JSONDecodeError as e:
+            logger.error(f"JSON解析失败: {e}, 内容摘要: {response.text[:200]}")
+            return None
+
+        if 'ok' in data and data['ok'] != 1:
+            logger.warning(f"API返回错误: {data.get('msg', 'unknown error')}, URL: {url}")
+            return None
             
-            # 2. 获取详细信息
+        if 'data' not in data or 'user' not in data['data']:
+            logger.warning(f"返回数据格式异常: {url}")
+            return None
+            
+        return parse_user_info(data['data']['user'])
+
+    def _fetch_user_detail(self, user_id):
+        """
+        2. 获取详细信息，失败时返回None，不影响基本信息
+        """
+        try:
             detail_url = f"https://weibo.com/ajax/profile/detail?uid={user_id}"
-            detail_response = self.session.get(detail_url, timeout=15)
+            detail_response = self._get(detail_url)
             detail_response.encoding = 'utf-8'
-            
-            if detail_response.status_code == 200:
-                try:
-                    detail_data = json.loads(detail_response.text)
-                    if 'data' in detail_data:
-                        d_data = detail_data['data']
-                        item['birthday'] = d_data.get('birthday', '')
-                        if 'created_at' not in item:
-                            item['created_at'] = d_data.get('created_at', '')
-                        item['desc_text'] = d_data.get('desc_text', '')
-                        item['ip_location'] = d_data.get('ip_location', '')
-                        if 'sunshine_credit' in d_data:
-                            item['sunshine_credit'] = d_data.get('sunshine_credit', {}).get('level', '')
-                        item['label_desc'] = [label['name'] for label in d_data.get('label_desc', [])]
-                        if 'company' in d_data:
-                            item['company'] = d_data['company']
-                        if 'education' in d_data:
-                            item['education'] = d_data['education']
-                except Exception as e:
-                    logger.warning(f"解析用户详细信息失败: {e}")
-            
-            logger.info(f"获取用户信息成功: {item.get('nick_name', user_id)}")
-            return item
-            
+            if detail_response.status_code != 200:
+                return None
+            return json.loads(detail_response.text).get('data')
         except Exception as e:
-            logger.error(f"获取用户信息异常 {user_id}: {e}", exc_info=True)
+            logger.warning(f"获取用户详细信息失败: {e}")
             return None
 
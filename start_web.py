@@ -13,12 +13,7 @@ if __name__ == '__main__':
     os.makedirs('output', exist_ok=True)
     os.makedirs('weibospider', exist_ok=True)
     
-    # 确保日志文件可写
-    log_file = 'spider.log'
-    if os.path.exists(log_file):
-        # 如果日志文件太大（>10MB），清空它
-        if os.path.getsize(log_file) > 10 * 1024 * 1024:
-            open(log_file, 'w').close()
+    # spider.log 超过 WEIBO_LOG_MAX_MB（默认10MB）时自动轮转，见 log_config.py
     
     # 导入并运行Flask应用
     from app import app
@@ -0,0 +1,131 @@
+# encoding: utf-8
+"""
+Scrapy扩展: 以Prometheus文本格式导出爬虫运行指标
+
+METRICS_PORT 不为0时在该端口提供 /metrics（多进程运行时端口被占用的进程只跳过HTTP服务）；
+METRICS_TEXTFILE_DIR 不为空时定期写入 {dir}/{spider.name}_{pid}.prom，供 node_exporter 的
+textfile collector 收集，适合 run_spider.py 的多进程/任务队列运行。
+"""
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+from spiders import metrics
+
+
+class CrawlerStatsCache(object):
+    """
+    把Scrapy统计中的缓存命中数包装成 metrics.watch_cache 需要的 stats()
+    """
+
+    def __init__(self, stats, hit_key, miss_key):
+        self.stats_collector = stats
+        self.hit_key = hit_key
+        self.miss_key = miss_key
+
+    def stats(self):
+        return {'hits': self.stats_collector.get_value(self.hit_key, 0),
+                'misses': self.stats_collector.get_value(self.miss_key, 0)}
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics.REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsExporter(object):
+    """
+    记录每个响应的耗时（download_latency）和类型、采集的数据量、调度队列长度和缓存命中率，
+    标签 task 为 METRICS_TASK，未设置时为爬虫名
+    """
+
+    def __init__(self, crawler, port, textfile_dir, interval):
+        self.crawler = crawler
+        self.port = port
+        self.textfile_dir = textfile_dir
+        self.interval = interval
+        self.task = None
+        self.server = None
+        self.loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        port = settings.getint('METRICS_PORT')
+        textfile_dir = settings.get('METRICS_TEXTFILE_DIR')
+        if not port and not textfile_dir:
+            raise NotConfigured
+        exporter = cls(crawler, port, textfile_dir, settings.getfloat('METRICS_INTERVAL', 15))
+        crawler.signals.connect(exporter.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(exporter.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(exporter.response_received, signal=signals.response_received)
+        crawler.signals.connect(exporter.item_scraped, signal=signals.item_scraped)
+        return exporter
+
+    def spider_opened(self, spider):
+        self.task = self.crawler.settings.get('METRICS_TASK') or spider.name
+        metrics.start_task(self.task)
+        metrics.watch_cache('httpcache', CrawlerStatsCache(self.crawler.stats, 'httpcache/hit', 'httpcache/miss'))
+        metrics.REGISTRY.add_collector(self.collect_queue_depth)
+        if self.port:
+            try:
+                self.server = ThreadingHTTPServer(('0.0.0.0', self.port), MetricsHandler)
+            except OSError as e:
+                spider.logger.warning(f'metrics port {self.port} unavailable: {e}')
+            else:
+                self.server.daemon_threads = True
+                threading.Thread(target=self.server.serve_forever, daemon=True).start()
+                spider.logger.info(f'Serving metrics on http://0.0.0.0:{self.port}/metrics')
+        if self.textfile_dir:
+            os.makedirs(self.textfile_dir, exist_ok=True)
+            self.loop = task.LoopingCall(self.write_textfile, spider)
+            self.loop.start(self.interval, now=False)
+
+    def spider_closed(self, spider):
+        metrics.finish_task(self.task)
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+        if self.textfile_dir:
+            self.write_textfile(spider)
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def response_received(self, response, request, spider):
+        metrics.observe_response(self.task, response.url, response.status, response.body,
+                                 request.meta.get('download_latency', 0))
+
+    def item_scraped(self, item, response, spider):
+        metrics.ITEMS.inc(task=self.task)
+
+    def collect_queue_depth(self):
+        engine = self.crawler.engine
+        if engine is None or engine.slot is None:
+            return
+        metrics.QUEUE_DEPTH.set(len(engine.slot.scheduler), task=self.task, queue='scheduler')
+        metrics.QUEUE_DEPTH.set(len(engine.downloader.active), task=self.task, queue='downloading')
+
+    def write_textfile(self, spider):
+        """
+        先写临时文件再改名，避免收集到写了一半的文件
+        """
+        path = os.path.join(self.textfile_dir, f'{spider.name}_{os.getpid()}.prom')
+        with open(path + '.tmp', 'wt', encoding='utf-8') as f:
+            f.write(metrics.REGISTRY.render())
+        os.replace(path + '.tmp', path)
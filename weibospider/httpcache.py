@@ -0,0 +1,118 @@
+# encoding: utf-8
+"""
+HTTP缓存: 配合Scrapy自带的 HttpCacheMiddleware 使用
+
+SqliteCacheStorage 把响应压缩后存到单个SQLite文件中，以规范化后的URL为键，
+并按接口设置不同的过期时间；WeiboCachePolicy 只缓存200的正常响应，验证码/登录页、登录跳转和418等
+异常响应都不写入缓存。
+"""
+import hashlib
+import os
+import sqlite3
+import time
+import zlib
+
+from scrapy.extensions.httpcache import DummyPolicy
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from w3lib.http import headers_dict_to_raw, headers_raw_to_dict
+from w3lib.url import canonicalize_url
+
+from spiders import metrics
+
+
+def url_cache_key(url):
+    """
+    规范化URL（参数排序、去掉锚点）后取摘要作为缓存键
+    """
+    return hashlib.sha1(canonicalize_url(url).encode('utf-8')).hexdigest()
+
+
+class WeiboCachePolicy(DummyPolicy):
+    """
+    只缓存正常响应: 与运行指标的响应分类一致，非200（包括未跟随的登录跳转）、验证码页、
+    ajax接口返回非JSON内容（登录页）时都不缓存
+    """
+
+    def should_cache_response(self, response, request):
+        if not super().should_cache_response(response, request):
+            return False
+        return metrics.classify_response(response.url, response.status, response.body) == 'ok'
+
+
+class SqliteCacheStorage(object):
+    """
+    基于SQLite的压缩缓存存储
+
+    - HTTPCACHE_ENDPOINT_TTL: {URL片段: 过期秒数}，按顺序匹配，未匹配时使用 HTTPCACHE_EXPIRATION_SECS
+    - HTTPCACHE_IGNORE_MISSING 为True时为严格回放模式: 不检查过期，未缓存的请求由中间件直接忽略
+    """
+
+    commit_every = 100
+
+    def __init__(self, settings):
+        self.cachedir = settings['HTTPCACHE_DIR']
+        self.expiration_secs = settings.getint('HTTPCACHE_EXPIRATION_SECS')
+        self.endpoint_ttl = list(settings.getdict('HTTPCACHE_ENDPOINT_TTL').items())
+        self.replay_only = settings.getbool('HTTPCACHE_IGNORE_MISSING')
+        self.db = None
+        self.pending = 0
+
+    def open_spider(self, spider):
+        os.makedirs(self.cachedir, exist_ok=True)
+        path = os.path.join(self.cachedir, f'{spider.name}.sqlite')
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                        'key TEXT PRIMARY KEY, url TEXT, status INTEGER, headers BLOB, body BLOB, timestamp REAL)')
+        spider.logger.debug(f'Using sqlite cache storage in {path}')
+
+    def close_spider(self, spider):
+        if self.db is not None:
+            self.db.commit()
+            self.db.close()
+            self.db = None
+
+    def ttl_for(self, url):
+        """
+        返回URL对应的过期时间（秒），0表示永不过期
+        """
+        for pattern, ttl in self.endpoint_ttl:
+            if pattern in url:
+                return int(ttl)
+        return self.expiration_secs
+
+    def retrieve_response(self, spider, request):
+        """
+        命中且未过期时返回缓存的响应，否则返回None
+        """
+        row = self.db.execute('SELECT url, status, headers, body, timestamp FROM responses WHERE key = ?',
+                              (url_cache_key(request.url),)).fetchone()
+        if row is None:
+            return None
+        url, status, headers, body, timestamp = row
+        if not self.replay_only:
+            ttl = self.ttl_for(request.url)
+            if 0 < ttl < time.time() - timestamp:
+                return None
+        headers = Headers(headers_raw_to_dict(zlib.decompress(headers)))
+        respcls = responsetypes.from_args(headers=headers, url=url)
+        return respcls(url=url, headers=headers, status=status, body=zlib.decompress(body))
+
+    def store_response(self, spider, request, response):
+        """
+        压缩写入，批量提交以减少磁盘同步
+        """
+        self.db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)', (
+            url_cache_key(request.url),
+            response.url,
+            response.status,
+            zlib.compress(headers_dict_to_raw(response.headers)),
+            zlib.compress(response.body),
+            time.time(),
+        ))
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.db.commit()
+            self.pending = 0
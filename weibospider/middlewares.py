@@ -1,4 +1,14 @@
 # encoding: utf-8
+from collections.abc import Mapping
+
+from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import Request
+
+from spiders import metrics
+from spiders.common import rewrite_host
+from spiders.near_dup import NearDuplicateIndex
+from spiders.profile import ProfileCache, ProfileFetcher
 
 
 class IPProxyMiddleware(object):
@@ -6,14 +16,20 @@ class IPProxyMiddleware(object):
     代理IP中间件
     """
 
-    @staticmethod
-    def fetch_proxy():
+    def __init__(self, proxy=None):
+        self.proxy = proxy
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings.get('PROXY'))
+
+    def fetch_proxy(self):
         """
-        获取一个代理IP
+        获取一个代理IP，默认使用 PROXY 配置（run_spider.py 多进程运行时每个进程可分配不同代理）
         """
         # You need to rewrite this function if you want to add proxy pool
         # the function should return an ip in the format of "ip:port" like "12.34.1.4:9090"
-        return None
+        return self.proxy
 
     def process_request(self, request, spider):
         """
@@ -24,3 +40,137 @@ class IPProxyMiddleware(object):
             current_proxy = f'http://{proxy_data}'
             spider.logger.debug(f"current proxy:{current_proxy}")
             request.meta['proxy'] = current_proxy
+
+
+class MockServerMiddleware(object):
+    """
+    把请求改写到本地模拟微博服务，未配置 MOCK_SERVER 时不启用
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        base_url = crawler.settings.get('MOCK_SERVER')
+        if not base_url:
+            raise NotConfigured
+        return cls(base_url)
+
+    def process_request(self, request, spider):
+        """
+        改写后的请求重新进入调度，再次经过时URL已不匹配，直接放行
+        """
+        url = rewrite_host(request.url, self.base_url)
+        if url != request.url:
+            return request.replace(url=url)
+
+
+class PageFanOutMiddleware(object):
+    """
+    丢弃已知空页之后的分页请求，配合 spiders.pagination.PageFanOutMixin 使用
+    """
+
+    def process_request(self, request, spider):
+        key = request.meta.get('fan_out_key')
+        if key is None or not hasattr(spider, 'is_page_exhausted'):
+            return None
+        if spider.is_page_exhausted(key, request.meta.get('page_num', 0)):
+            spider.crawler.stats.inc_value('fan_out/pages_dropped')
+            raise IgnoreRequest(f'page beyond the last non-empty page: {request.url}')
+
+
+class ProfileEnrichMiddleware(object):
+    """
+    为数据中内嵌的用户补全完整资料，PROFILE_ENRICH 未开启时不启用
+
+    每个uid只请求一次（缓存有效期内跨运行也不重复），补全后的用户数据作为单独的数据输出
+    """
+
+    def __init__(self, cache, fields):
+        self.fetcher = ProfileFetcher(cache)
+        self.fields = fields
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('PROFILE_ENRICH'):
+            raise NotConfigured
+        middleware = cls(ProfileCache.from_settings(crawler.settings),
+                         crawler.settings.getlist('PROFILE_ENRICH_FIELDS'))
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        metrics.watch_cache('profile', middleware.fetcher.cache)
+        return middleware
+
+    def process_spider_output(self, response, result, spider):
+        for output in result:
+            yield output
+            if isinstance(output, Request) or not isinstance(output, Mapping):
+                continue
+            if output.get('duplicate_of'):
+                continue
+            for field in self.fields:
+                user = output.get(field)
+                if isinstance(user, Mapping) and user.get('_id'):
+                    yield from self.fetcher.requests(user['_id'])
+
+    def spider_closed(self, spider):
+        stats = self.fetcher.cache.stats()
+        spider.crawler.stats.set_value('profile_cache/hits', stats['hits'])
+        spider.crawler.stats.set_value('profile_cache/misses', stats['misses'])
+        self.fetcher.cache.close()
+
+
+class NearDuplicateMiddleware(object):
+    """
+    标记或丢弃近似重复的推文/评论，NEAR_DUP 为 tag 或 drop，为空时不启用
+
+    tag: 保留数据，在 duplicate_of 中记下最早收录的相似内容的ID；drop: 直接丢弃。
+    近似重复的推文不再请求长微博全文，用户资料补全和图片下载也会跳过
+    """
+
+    def __init__(self, index, mode):
+        self.index = index
+        self.mode = mode
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        mode = settings.get('NEAR_DUP')
+        if mode not in ('tag', 'drop'):
+            raise NotConfigured
+        index = NearDuplicateIndex(threshold=settings.getfloat('NEAR_DUP_THRESHOLD', 0.7),
+                                   min_length=settings.getint('NEAR_DUP_MIN_LENGTH', 10),
+                                   max_size=settings.getint('NEAR_DUP_MAX_SIZE', 1000000))
+        middleware = cls(index, mode)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        metrics.watch_cache('near_dup', index)
+        return middleware
+
+    def process_spider_output(self, response, result, spider):
+        for output in result:
+            if isinstance(output, Request):
+                item = output.meta.get('item')
+                if isinstance(item, Mapping) and self.is_duplicate(item, spider):
+                    # 长微博全文请求: 近似重复的推文直接输出截断的正文
+                    if self.mode == 'tag':
+                        yield item
+                    continue
+                yield output
+            elif isinstance(output, Mapping) and self.is_duplicate(output, spider):
+                if self.mode == 'tag':
+                    yield output
+            else:
+                yield output
+
+    def is_duplicate(self, item, spider):
+        if not item.get('_id') or not item.get('content'):
+            return False
+        duplicate_of = self.index.check(item['_id'], item['content'])
+        if duplicate_of is None:
+            return False
+        item['duplicate_of'] = duplicate_of
+        spider.crawler.stats.inc_value('near_dup/duplicates')
+        return True
+
+    def spider_closed(self, spider):
+        spider.crawler.stats.set_value('near_dup/indexed', self.index.stats()['size'])
@@ -4,27 +4,118 @@ import json
 import os.path
 import time
 
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import defer, reactor
+from twisted.python.failure import Failure
+
+from spiders import metrics
+from spiders.items import SlotItem
+from spiders.media import MediaStore
+
 
 class JsonWriterPipeline(object):
     """
     写入json文件的pipline
     """
 
-    def __init__(self):
+    def __init__(self, output_file=None):
         self.file = None
+        self.output_file = output_file
         if not os.path.exists('../output'):
             os.mkdir('../output')
 
+    @classmethod
+    def from_crawler(cls, crawler):
+        # OUTPUT_FILE 指定输出文件，多进程运行时每个进程写各自的分片文件
+        return cls(crawler.settings.get('OUTPUT_FILE'))
+
     def process_item(self, item, spider):
         """
         处理item
         """
         if not self.file:
-            now = datetime.datetime.now()
-            file_name = spider.name + "_" + now.strftime("%Y%m%d%H%M%S") + '.jsonl'
-            self.file = open(f'../output/{file_name}', 'wt', encoding='utf-8')
+            if self.output_file:
+                self.file = open(self.output_file, 'wt', encoding='utf-8')
+            else:
+                now = datetime.datetime.now()
+                file_name = spider.name + "_" + now.strftime("%Y%m%d%H%M%S") + '.jsonl'
+                self.file = open(f'../output/{file_name}', 'wt', encoding='utf-8')
         item['crawl_time'] = int(time.time())
-        line = json.dumps(dict(item), ensure_ascii=False) + "\n"
+        if isinstance(item, SlotItem):
+            line = item.to_json() + "\n"
+        else:
+            line = json.dumps(dict(item), ensure_ascii=False) + "\n"
         self.file.write(line)
         self.file.flush()
         return item
+
+
+class MediaDownloadPipeline(object):
+    """
+    下载推文的图片（MEDIA_VIDEO 开启时包括视频），本地路径（相对 MEDIA_STORE）记录在
+    pic_paths（与 pic_urls 一一对应，下载失败为None）和 video_path 中；MEDIA_STORE 为空时不启用。
+    数据项在下载期间占用 CONCURRENT_ITEMS 的名额，下载跟不上时自然限制采集速度
+    """
+
+    def __init__(self, store, download_video=False):
+        self.store = store
+        self.download_video = download_video
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.get('MEDIA_STORE'):
+            raise NotConfigured
+        pipeline = cls(MediaStore.from_settings(crawler.settings), crawler.settings.getbool('MEDIA_VIDEO'))
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        metrics.watch_cache('media', pipeline.store)
+        return pipeline
+
+    def process_item(self, item, spider):
+        if item.get('duplicate_of'):
+            # 近似重复的推文不下载
+            return item
+        urls = list(item.get('pic_urls') or [])
+        if self.download_video and item.get('video'):
+            urls.append(item['video'])
+        if not urls:
+            return item
+        downloads = defer.DeferredList([self._deferred(self.store.fetch(url)) for url in urls],
+                                       consumeErrors=True)
+        downloads.addCallback(self._record, item, urls, spider)
+        return downloads
+
+    @staticmethod
+    def _deferred(future):
+        """
+        在下载线程中完成的Future转为Deferred，回调回到reactor线程执行
+        """
+        d = defer.Deferred()
+
+        def done(future):
+            if future.exception() is not None:
+                reactor.callFromThread(d.errback, Failure(future.exception()))
+            else:
+                reactor.callFromThread(d.callback, future.result())
+
+        future.add_done_callback(done)
+        return d
+
+    def _record(self, results, item, urls, spider):
+        paths = []
+        for url, (success, result) in zip(urls, results):
+            if success:
+                paths.append(result)
+            else:
+                spider.logger.warning(f'media download failed {url}: {result.getErrorMessage()}')
+                paths.append(None)
+        if self.download_video and item.get('video'):
+            item['video_path'] = paths.pop()
+        if 'pic_urls' in item:
+            item['pic_paths'] = paths
+        return item
+
+    def spider_closed(self, spider):
+        for key, value in self.store.stats().items():
+            spider.crawler.stats.set_value(f'media/{key}', value)
+        self.store.close()
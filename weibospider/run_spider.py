@@ -5,10 +5,18 @@ Author: nghuyong
 Mail: nghuyong@163.com
 Created Time: 2019-12-07 21:27
 """
+import argparse
+import datetime
+import json
+import multiprocessing
 import os
+import shutil
 import sys
+import time
 from scrapy.crawler import CrawlerProcess
 from scrapy.utils.project import get_project_settings
+from seeds import load_seeds, read_lines, shard_seeds
+from spiders.work_queue import WorkQueue, default_owner
 from spiders.tweet_by_user_id import TweetSpiderByUserID
 from spiders.tweet_by_keyword import TweetSpiderByKeyword
 from spiders.tweet_by_tweet_id import TweetSpiderByTweetID
@@ -17,22 +25,350 @@ from spiders.follower import FollowerSpider
 from spiders.user import UserSpider
 from spiders.fan import FanSpider
 from spiders.repost import RepostSpider
+from spiders.social_graph import SocialGraphSpider
 
-if __name__ == '__main__':
-    mode = sys.argv[1]
+mode_to_spider = {
+    'comment': CommentSpider,
+    'fan': FanSpider,
+    'follow': FollowerSpider,
+    'user': UserSpider,
+    'repost': RepostSpider,
+    'social_graph': SocialGraphSpider,
+    'tweet_by_tweet_id': TweetSpiderByTweetID,
+    'tweet_by_user_id': TweetSpiderByUserID,
+    'tweet_by_keyword': TweetSpiderByKeyword,
+}
+
+# 种子文件中对应的字段名
+mode_to_seed_field = {
+    'comment': 'tweet_id',
+    'fan': 'user_id',
+    'follow': 'user_id',
+    'user': 'user_id',
+    'repost': 'tweet_id',
+    'social_graph': 'user_id',
+    'tweet_by_tweet_id': 'tweet_id',
+    'tweet_by_user_id': 'user_id',
+    'tweet_by_keyword': 'keyword',
+}
+
+
+# 爬虫写到固定路径的附加输出（评论树、关系图/级联目录）；多进程运行时每个进程使用带后缀的路径，
+# 作为爬虫参数传入。水位线文件由 WatermarkStore 按键合并，多个进程可以共用
+WORKER_PATHS = ('tree_path', 'output_dir')
+# 等待退避中或被其他进程租出的任务时，最长的重新检查间隔（秒）
+QUEUE_POLL_SECONDS = 60
+# 视为正常结束的 finish_reason；closespider_errorcount、shutdown 等都算失败
+FINISH_REASONS_OK = ('finished', 'closespider_timeout', 'closespider_itemcount', 'closespider_pagecount')
+# 出错的请求（网络错误、封禁等错误状态码、回调异常）超过该比例时，即使采集到了数据也算失败
+MAX_ERROR_RATIO = 0.5
+# 子进程采集失败时的退出码
+CRAWL_FAILED_EXIT = 3
+
+
+def crawl(mode, seeds=None, cookie=None, proxy=None, output_file=None, spider_args=None):
+    """
+    在当前进程中运行一个爬虫，cookie/proxy/output_file 为空时使用 settings 中的配置，
+    spider_args 为额外的爬虫参数（同 scrapy crawl -a）；返回爬虫结束时的统计
+    """
     os.environ['SCRAPY_SETTINGS_MODULE'] = 'settings'
     settings = get_project_settings()
+    if cookie:
+        headers = dict(settings.getdict('DEFAULT_REQUEST_HEADERS'))
+        headers['Cookie'] = cookie
+        settings.set('DEFAULT_REQUEST_HEADERS', headers)
+    if proxy:
+        settings.set('PROXY', proxy)
+    if output_file:
+        settings.set('OUTPUT_FILE', output_file)
     process = CrawlerProcess(settings)
-    mode_to_spider = {
-        'comment': CommentSpider,
-        'fan': FanSpider,
-        'follow': FollowerSpider,
-        'user': UserSpider,
-        'repost': RepostSpider,
-        'tweet_by_tweet_id': TweetSpiderByTweetID,
-        'tweet_by_user_id': TweetSpiderByUserID,
-        'tweet_by_keyword': TweetSpiderByKeyword,
-    }
-    process.crawl(mode_to_spider[mode])
+    kwargs = dict(spider_args or {})
+    if seeds:
+        kwargs['seeds'] = seeds
+    crawler = process.create_crawler(mode_to_spider[mode])
+    process.crawl(crawler, **kwargs)
     # the script will block here until the crawling is finished
     process.start()
+    return crawler.stats.get_stats()
+
+
+def crawl_failure(stats):
+    """
+    根据爬虫统计判断采集是否失败，返回失败原因，成功时返回None。
+    Scrapy遇到418、验证码或网络错误时仍会正常结束，只看退出码无法发现整批都没采到的情况
+    """
+    reason = stats.get('finish_reason')
+    if reason not in FINISH_REASONS_OK:
+        return f'finish_reason {reason}'
+    errors = stats.get('downloader/exception_count', 0)
+    for key, value in stats.items():
+        if key.startswith('spider_exceptions/') and key.count('/') == 1:
+            errors += value
+        elif key.startswith('downloader/response_status_count/'):
+            status = int(key.rsplit('/', 1)[1])
+            # 404 多为已删除的推文/用户，不算失败
+            if status >= 400 and status != 404:
+                errors += value
+    if not errors:
+        return None
+    items = stats.get('item_scraped_count', 0)
+    requests = stats.get('response_received_count', 0) + stats.get('downloader/exception_count', 0)
+    if not items:
+        return f'no items scraped, {errors} errors'
+    if errors > requests * MAX_ERROR_RATIO:
+        return f'{errors} errors in {requests} requests'
+    return None
+
+
+def crawl_worker(mode, seeds=None, cookie=None, proxy=None, output_file=None, spider_args=None):
+    """
+    子进程入口: 采集失败时以 CRAWL_FAILED_EXIT 退出，由父进程统计或交回任务队列重试
+    """
+    failure = crawl_failure(crawl(mode, seeds, cookie, proxy, output_file, spider_args))
+    if failure:
+        print(f'crawl failed: {failure}')
+        sys.exit(CRAWL_FAILED_EXIT)
+
+
+def merge_outputs(part_files, output_file):
+    """
+    合并各进程的输出分片，按 _id 去重（如多个用户的关系图中出现的同一用户）
+    """
+    seen = set()
+    count = 0
+    with open(output_file, 'wt', encoding='utf-8') as out:
+        for part_file in part_files:
+            if not os.path.exists(part_file):
+                continue
+            with open(part_file, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    _id = json.loads(line).get('_id')
+                    if _id is not None:
+                        if _id in seen:
+                            continue
+                        seen.add(_id)
+                    out.write(line)
+                    count += 1
+            os.remove(part_file)
+    return count
+
+
+def worker_paths(mode, suffix):
+    """
+    返回该进程使用的附加输出路径 {爬虫属性: 路径}，在爬虫的默认路径后加 _{suffix}
+    """
+    paths = {}
+    for attr in WORKER_PATHS:
+        path = getattr(mode_to_spider[mode], attr, None)
+        if path:
+            root, ext = os.path.splitext(path)
+            paths[attr] = f'{root}_{suffix}{ext}'
+    return paths
+
+
+def merge_worker_paths(mode, parts):
+    """
+    把各进程的附加输出合并到爬虫的默认路径，合并后删除各进程的文件
+    """
+    spider_cls = mode_to_spider[mode]
+    tree_parts = [paths['tree_path'] for paths in parts if 'tree_path' in paths]
+    if tree_parts:
+        with open(spider_cls.tree_path, 'wt', encoding='utf-8') as out:
+            for part_file in tree_parts:
+                if os.path.exists(part_file):
+                    with open(part_file, 'rt', encoding='utf-8') as f:
+                        shutil.copyfileobj(f, out)
+                    os.remove(part_file)
+    dir_parts = [paths['output_dir'] for paths in parts if 'output_dir' in paths]
+    if dir_parts and any(os.path.isdir(part_dir) for part_dir in dir_parts):
+        spider_cls.merge_output_dirs(spider_cls.output_dir, dir_parts)
+
+
+def run_sharded(mode, seeds, workers, cookies, proxies, output):
+    """
+    按种子分片，每个分片一个进程；Cookie和代理按进程轮流分配
+    """
+    name = mode_to_spider[mode].name
+    stamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    os.makedirs('../output', exist_ok=True)
+    # 每个进程独立运行Twisted reactor，使用spawn避免继承父进程状态
+    context = multiprocessing.get_context('spawn')
+    processes, part_files, part_paths = [], [], []
+    for index, shard in enumerate(shard_seeds(seeds, workers)):
+        if not shard:
+            continue
+        part_file = f'../output/{name}_{stamp}_part{index}.jsonl'
+        paths = worker_paths(mode, f'{stamp}_part{index}')
+        kwargs = {
+            'seeds': shard,
+            'cookie': cookies[index % len(cookies)] if cookies else None,
+            'proxy': proxies[index % len(proxies)] if proxies else None,
+            'output_file': part_file,
+            'spider_args': paths,
+        }
+        process = context.Process(target=crawl_worker, args=(mode,), kwargs=kwargs, name=f'{name}-{index}')
+        process.start()
+        print(f'worker {index}: pid {process.pid}, {len(shard)} seeds -> {part_file}')
+        processes.append(process)
+        part_files.append(part_file)
+        part_paths.append(paths)
+    failed = 0
+    for process in processes:
+        process.join()
+        if process.exitcode != 0:
+            failed += 1
+            print(f'worker {process.name} exited with code {process.exitcode}')
+    if output == 'merge':
+        merged = f'../output/{name}_{stamp}.jsonl'
+        count = merge_outputs(part_files, merged)
+        print(f'merged {count} items into {merged}')
+        merge_worker_paths(mode, part_paths)
+    return 1 if failed else 0
+
+
+def keyword_slices(keywords, start, end, hours):
+    """
+    把关键词按时间切成多个任务，时间格式为 %Y-%m-%d-%H
+    """
+    start = datetime.datetime.strptime(start, '%Y-%m-%d-%H')
+    end = datetime.datetime.strptime(end, '%Y-%m-%d-%H')
+    slices = []
+    for keyword in keywords:
+        time_cur = start
+        while time_cur < end:
+            time_next = min(time_cur + datetime.timedelta(hours=hours), end)
+            slices.append({'keyword': keyword, 'start_time': time_cur.strftime('%Y-%m-%d-%H'),
+                           'end_time': time_next.strftime('%Y-%m-%d-%H')})
+            time_cur = time_next
+    return slices
+
+
+def queue_worker(mode, queue_path, batch_size, cookie=None, proxy=None, shared=False):
+    """
+    从任务队列循环领取一批种子，在子进程中采集；子进程运行期间定期续租，
+    采集成功则确认，异常退出或采集失败（见 crawl_failure）则交回队列重试。暂时没有可领取的任务但还有退避中或被其他进程租出的任务时，
+    等到最早的退避结束/租约到期（最多 QUEUE_POLL_SECONDS 秒）再领取；队列中只剩完成或失败的任务时退出
+    """
+    queue = WorkQueue(queue_path, shared=shared)
+    owner = default_owner()
+    name = mode_to_spider[mode].name
+    stamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    context = multiprocessing.get_context('spawn')
+    os.makedirs('../output', exist_ok=True)
+    batch_no = 0
+    while True:
+        tasks = queue.lease(mode, owner, batch_size)
+        if not tasks:
+            ready_at = queue.next_available(mode)
+            if ready_at is None:
+                break
+            wait = min(max(ready_at - time.time(), 1), QUEUE_POLL_SECONDS)
+            print(f'{owner}: no task ready, retrying in {wait:.0f}s')
+            time.sleep(wait)
+            continue
+        task_ids = [task_id for task_id, _ in tasks]
+        seeds = [payload for _, payload in tasks]
+        output_file = f'../output/{name}_{stamp}_{os.getpid()}_{batch_no}.jsonl'
+        # 评论树等附加输出与结果文件一样每批单独保存
+        paths = worker_paths(mode, f'{stamp}_{os.getpid()}_{batch_no}')
+        print(f'{owner}: leased {len(tasks)} tasks -> {output_file}')
+        process = context.Process(target=crawl_worker, args=(mode, seeds, cookie, proxy, output_file, paths))
+        process.start()
+        while True:
+            process.join(timeout=queue.lease_seconds / 3)
+            if process.exitcode is not None:
+                break
+            kept = queue.heartbeat(task_ids, owner)
+            if kept < len(task_ids):
+                print(f'{owner}: lost lease on {len(task_ids) - kept} tasks')
+        if process.exitcode == 0:
+            queue.ack(task_ids, owner)
+        elif process.exitcode == CRAWL_FAILED_EXIT:
+            queue.fail(task_ids, owner, 'crawl failed (errors or bans, see worker log)')
+        else:
+            queue.fail(task_ids, owner, f'crawler exited with code {process.exitcode}')
+        batch_no += 1
+    print(f'{owner}: queue drained, {json.dumps(queue.stats(mode))}')
+    queue.close()
+
+
+def run_queue(args, cookies, proxies):
+    """
+    任务队列相关的命令: 添加任务、查看状态或启动消费进程
+    """
+    queue = WorkQueue(args.queue, shared=args.queue_shared)
+    if args.enqueue:
+        seeds = load_seeds(args.enqueue, mode_to_seed_field[args.mode])
+        payloads = seeds
+        if args.mode == 'tweet_by_keyword' and args.slice_hours:
+            payloads = keyword_slices(seeds, args.start, args.end, args.slice_hours)
+        added = queue.put_many(args.mode, payloads)
+        print(f'enqueued {added} new tasks ({len(payloads) - added} already queued)')
+    if args.retry_failed:
+        print(f'requeued {queue.retry_failed(args.mode)} failed tasks')
+    if args.enqueue or args.retry_failed or args.queue_stats:
+        print(json.dumps(queue.stats(args.mode)))
+        queue.close()
+        return 0
+    queue.close()
+    if args.workers <= 1:
+        queue_worker(args.mode, args.queue, args.batch_size,
+                     cookies[0] if cookies else None, proxies[0] if proxies else None, args.queue_shared)
+        return 0
+    context = multiprocessing.get_context('spawn')
+    workers = []
+    for index in range(args.workers):
+        kwargs = {
+            'cookie': cookies[index % len(cookies)] if cookies else None,
+            'proxy': proxies[index % len(proxies)] if proxies else None,
+            'shared': args.queue_shared,
+        }
+        worker = context.Process(target=queue_worker, args=(args.mode, args.queue, args.batch_size), kwargs=kwargs)
+        worker.start()
+        workers.append(worker)
+    for worker in workers:
+        worker.join()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='运行微博爬虫')
+    parser.add_argument('mode', choices=sorted(mode_to_spider))
+    parser.add_argument('--seeds', help='种子文件（.jsonl/.csv/每行一个），不指定时使用爬虫中写好的数据')
+    parser.add_argument('--workers', type=int, default=1, help='按种子分片的进程数')
+    parser.add_argument('--cookies', help='Cookie文件，每行一个账号的Cookie，按进程轮流分配')
+    parser.add_argument('--proxies', help='代理文件，每行一个 ip:port，按进程轮流分配')
+    parser.add_argument('--output', choices=['merge', 'partition'], default='merge',
+                        help='多进程的输出: merge 合并为一个文件（按_id去重），partition 保留每个进程的分片文件')
+    parser.add_argument('--queue', help='任务队列数据库文件，同一台机器上的多个进程共用')
+    parser.add_argument('--queue-shared', action='store_true',
+                        help='队列文件放在多台机器共用的存储（NFS等）上，改用回滚日志模式')
+    parser.add_argument('--enqueue', metavar='SEEDS', help='把种子文件中的数据加入任务队列后退出')
+    parser.add_argument('--slice-hours', type=int, help='关键词任务按多少小时切分（配合 --start/--end）')
+    parser.add_argument('--start', help='关键词时间片的开始时间，格式 2022-01-01-00')
+    parser.add_argument('--end', help='关键词时间片的结束时间，格式 2022-01-02-00')
+    parser.add_argument('--batch-size', type=int, default=50, help='每次从队列领取的任务数')
+    parser.add_argument('--queue-stats', action='store_true', help='查看任务队列状态')
+    parser.add_argument('--retry-failed', action='store_true', help='把失败的任务重新放回队列')
+    args = parser.parse_args()
+
+    if args.slice_hours and not (args.start and args.end):
+        parser.error('--slice-hours 需要同时指定 --start 和 --end')
+    if args.queue:
+        return run_queue(args, read_lines(args.cookies), read_lines(args.proxies))
+    seeds = load_seeds(args.seeds, mode_to_seed_field[args.mode]) if args.seeds else None
+    cookies, proxies = read_lines(args.cookies), read_lines(args.proxies)
+    if args.workers <= 1:
+        failure = crawl_failure(crawl(args.mode, seeds, cookies[0] if cookies else None,
+                                      proxies[0] if proxies else None))
+        if failure:
+            print(f'crawl failed: {failure}')
+            return 1
+        return 0
+    if not seeds:
+        parser.error('--workers 大于1时需要通过 --seeds 指定种子文件')
+    return run_sharded(args.mode, seeds, args.workers, cookies, proxies, args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,38 @@
+# encoding: utf-8
+"""
+磁盘上的请求队列
+
+种子多、分页和时间窗口展开后，待下载的请求可能有几十万个，默认的内存调度器会让内存持续增长。
+FRONTIER_DIR 不为空（且未设置 JOBDIR）时，待下载的请求改为保存在该目录下的磁盘优先级队列中，
+内存中只保留无法序列化的请求（回调不是爬虫方法的请求，如长微博全文、用户资料补全）。
+每个进程使用各自的子目录，爬虫结束时删除；需要暂停/恢复时仍使用Scrapy的 JOBDIR。
+"""
+import os
+import shutil
+import tempfile
+
+from scrapy.core.scheduler import Scheduler
+
+
+class DiskFrontierScheduler(Scheduler):
+    """
+    FRONTIER_DIR 为空时与Scrapy默认的调度器相同
+    """
+    frontier = None  # 本进程的队列目录
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        scheduler = super().from_crawler(crawler)
+        frontier_dir = crawler.settings.get('FRONTIER_DIR')
+        if frontier_dir and scheduler.dqdir is None:
+            os.makedirs(frontier_dir, exist_ok=True)
+            scheduler.frontier = tempfile.mkdtemp(prefix=f'{crawler.spidercls.name}_{os.getpid()}_',
+                                                  dir=frontier_dir)
+            scheduler.dqdir = scheduler._dqdir(scheduler.frontier)
+        return scheduler
+
+    def close(self, reason):
+        result = super().close(reason)
+        if self.frontier:
+            shutil.rmtree(self.frontier, ignore_errors=True)
+        return result
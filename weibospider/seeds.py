@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+种子文件读取与分片
+
+种子文件支持三种格式:
+- .jsonl: 每行一个JSON对象（取指定字段，没有时取 id 字段）或一个JSON字符串/数字
+- .csv: 有指定字段的表头时取该列，否则取第一列
+- 其他: 纯文本，每行一个
+"""
+import csv
+import json
+import zlib
+
+
+def load_seeds(path, field):
+    """
+    读取种子，去掉空值和重复值，保持文件中的顺序
+    """
+    seeds = []
+    with open(path, 'rt', encoding='utf-8-sig', newline='') as f:
+        if path.endswith('.jsonl'):
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                row = json.loads(line)
+                if isinstance(row, dict):
+                    row = row.get(field, row.get('id'))
+                seeds.append(row)
+        elif path.endswith('.csv'):
+            reader = csv.reader(f)
+            header = next(reader, [])
+            if field in header:
+                column = header.index(field)
+            else:
+                # 没有表头时第一行也是数据
+                column = 0
+                seeds.append(header[0] if header else None)
+            for row in reader:
+                seeds.append(row[column] if len(row) > column else None)
+        else:
+            seeds = [line.strip() for line in f]
+    seeds = [str(seed).strip() for seed in seeds if seed is not None and str(seed).strip()]
+    return list(dict.fromkeys(seeds))
+
+
+def shard_seeds(seeds, num_shards):
+    """
+    按种子的哈希分片，同一种子在多次运行中总是落在同一个分片
+    """
+    shards = [[] for _ in range(num_shards)]
+    for seed in seeds:
+        shards[zlib.crc32(seed.encode('utf-8')) % num_shards].append(seed)
+    return shards
+
+
+def read_lines(path):
+    """
+    读取每行一个的配置（如Cookie、代理），忽略空行和 # 开头的注释
+    """
+    if not path:
+        return []
+    with open(path, 'rt', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import os
 
 BOT_NAME = 'spider'
 
@@ -16,15 +17,93 @@ DEFAULT_REQUEST_HEADERS = {
 
 CONCURRENT_REQUESTS = 16
 
+# 待下载的请求: WEIBO_FRONTIER_DIR 指定目录时保存在磁盘优先级队列中，种子再多内存也基本不变
+SCHEDULER = 'scheduler.DiskFrontierScheduler'
+FRONTIER_DIR = os.environ.get('WEIBO_FRONTIER_DIR')
+
 DOWNLOAD_DELAY = 1
 
 DOWNLOADER_MIDDLEWARES = {
     'scrapy.downloadermiddlewares.cookies.CookiesMiddleware': None,
     'scrapy.downloadermiddlewares.redirect.RedirectMiddleware': None,
+    'middlewares.PageFanOutMiddleware': 40,
+    'middlewares.MockServerMiddleware': 50,
     'middlewares.IPProxyMiddleware': 100,
     'scrapy.downloadermiddlewares.httpproxy.HttpProxyMiddleware': 101,
 }
 
+SPIDER_MIDDLEWARES = {
+    'middlewares.ProfileEnrichMiddleware': 600,
+    'middlewares.NearDuplicateMiddleware': 650,
+}
+
+EXTENSIONS = {
+    'extensions.MetricsExporter': 500,
+}
+
 ITEM_PIPELINES = {
+    'pipelines.MediaDownloadPipeline': 200,
     'pipelines.JsonWriterPipeline': 300,
 }
+
+# 代理 "ip:port"，为空时不使用代理
+PROXY = os.environ.get('WEIBO_PROXY')
+
+# 输出文件，为空时写入 ../output/{spider.name}_{datetime}.jsonl
+OUTPUT_FILE = None
+
+# 本地模拟微博服务地址，如 http://127.0.0.1:8765，用于压测；为空时直连微博
+MOCK_SERVER = os.environ.get('WEIBO_MOCK_SERVER')
+
+# HTTP缓存: WEIBO_HTTPCACHE=record 录制响应并在有效期内复用；
+# WEIBO_HTTPCACHE=replay 严格回放，只使用缓存、未缓存的请求直接忽略，不消耗账号额度
+HTTPCACHE_MODE = os.environ.get('WEIBO_HTTPCACHE', '')
+HTTPCACHE_ENABLED = HTTPCACHE_MODE in ('record', 'replay')
+HTTPCACHE_IGNORE_MISSING = HTTPCACHE_MODE == 'replay'
+HTTPCACHE_DIR = '../httpcache'
+HTTPCACHE_STORAGE = 'httpcache.SqliteCacheStorage'
+HTTPCACHE_POLICY = 'httpcache.WeiboCachePolicy'
+HTTPCACHE_IGNORE_HTTP_CODES = [414, 418, 500, 502, 503, 504]
+HTTPCACHE_EXPIRATION_SECS = 0
+# 各接口的缓存有效期（秒），按顺序匹配URL片段
+HTTPCACHE_ENDPOINT_TTL = {
+    '/ajax/statuses/longtext': 30 * 24 * 3600,
+    '/ajax/statuses/show': 24 * 3600,
+    '/ajax/profile/': 24 * 3600,
+    '/ajax/friendships/': 24 * 3600,
+    '/ajax/statuses/searchProfile': 6 * 3600,
+    '/ajax/statuses/buildComments': 3600,
+    '/ajax/statuses/repostTimeline': 3600,
+    '/weibo?': 600,
+}
+
+# 用户资料缓存，Web服务默认使用同一个文件（WEIBO_PROFILE_CACHE 可修改），资料在有效期内不会重复请求
+PROFILE_CACHE_PATH = os.environ.get('WEIBO_PROFILE_CACHE', '../output/profile_cache.db')
+PROFILE_CACHE_TTL = 24 * 3600
+# 为推文/评论/关系中出现的作者补全完整的用户资料（额外输出用户数据），默认关闭
+PROFILE_ENRICH = os.environ.get('WEIBO_PROFILE_ENRICH', '') == '1'
+PROFILE_ENRICH_FIELDS = ['user', 'comment_user', 'fan_info', 'follower_info']
+
+# 运行指标（Prometheus文本格式）: WEIBO_METRICS_PORT 指定端口时提供 /metrics，
+# WEIBO_METRICS_DIR 指定目录时定期写入 .prom 文件（node_exporter textfile collector）；都为空时不启用
+METRICS_PORT = int(os.environ.get('WEIBO_METRICS_PORT', 0))
+METRICS_TEXTFILE_DIR = os.environ.get('WEIBO_METRICS_DIR')
+METRICS_INTERVAL = 15
+# 指标的 task 标签，为空时使用爬虫名
+METRICS_TASK = os.environ.get('WEIBO_METRICS_TASK')
+
+# 图片/视频下载: WEIBO_MEDIA_DIR 指定存储目录时启用，文件按内容哈希保存，同一URL或相同内容只保存一份；
+# WEIBO_MEDIA_VIDEO=1 时同时下载视频
+MEDIA_STORE = os.environ.get('WEIBO_MEDIA_DIR')
+MEDIA_VIDEO = os.environ.get('WEIBO_MEDIA_VIDEO', '') == '1'
+MEDIA_CONCURRENCY = 8
+MEDIA_MAX_SIZE = 200 * 1024 * 1024
+MEDIA_TIMEOUT = 60
+
+# 近似重复的推文/评论（复制粘贴的广告、只改了几个字的转发）: WEIBO_NEAR_DUP=tag 时在 duplicate_of 中标出
+# 最早的相似内容，WEIBO_NEAR_DUP=drop 时直接丢弃；近似重复的推文不再请求全文、补全用户资料和下载图片
+NEAR_DUP = os.environ.get('WEIBO_NEAR_DUP', '')
+# 正文三元组的Jaccard相似度不低于该值视为近似重复；去掉链接、@、话题和标点后短于 NEAR_DUP_MIN_LENGTH 的不判断
+NEAR_DUP_THRESHOLD = 0.7
+NEAR_DUP_MIN_LENGTH = 10
+NEAR_DUP_MAX_SIZE = 1000000
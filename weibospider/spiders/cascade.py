@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+转发级联树
+
+转发按到达顺序编号，树结构只用父节点下标数组表示（根节点为0，父下标为-1）。
+转发的直接来源取自转发内容中的第一个 "//@昵称:"，来源尚未出现时先挂起，
+等该昵称的转发到达后再回填，始终找不到的挂在根节点下。
+"""
+import json
+import os
+import re
+from array import array
+from collections import defaultdict
+
+PARENT_PATTERN = re.compile(r'//@([^:：\s]+)[:：]')
+
+
+def parse_parent_nick(text):
+    """
+    "好看 //@用户A:转发 //@用户B:原因" => 用户A
+    """
+    match = PARENT_PATTERN.search(text or '')
+    return match.group(1) if match else None
+
+
+class RepostCascade(object):
+    """
+    单条原微博的转发级联
+    """
+
+    def __init__(self, root_mid, root_uid=0, root_time=0, root_nick=None):
+        self.root_mid = int(root_mid)
+        self.mids = array('q', [self.root_mid])
+        self.uids = array('q', [int(root_uid)])
+        self.times = array('q', [int(root_time)])
+        self.parents = array('i', [-1])
+        self.nick_index = {}  # 昵称 -> 该用户第一次转发的节点下标
+        if root_nick:
+            self.nick_index[root_nick] = 0
+        self.pending = defaultdict(list)  # 尚未出现的来源昵称 -> 等待回填的子节点下标
+
+    def __len__(self):
+        return len(self.mids)
+
+    def add(self, mid, uid, nick, created_ts, parent_nick=None):
+        """
+        加入一条转发，返回 (节点下标, 父节点下标)；父节点暂未出现时父下标为None
+        """
+        idx = len(self.mids)
+        self.mids.append(int(mid))
+        self.uids.append(int(uid))
+        self.times.append(int(created_ts))
+        parent, resolved = 0, True
+        if parent_nick:
+            found = self.nick_index.get(parent_nick)
+            if found is None:
+                self.pending[parent_nick].append(idx)
+                resolved = False
+            else:
+                parent = found
+        self.parents.append(parent)
+        if nick not in self.nick_index:
+            self.nick_index[nick] = idx
+            for child in self.pending.pop(nick, []):
+                if child != idx:
+                    self.parents[child] = idx
+        return idx, (parent if resolved else None)
+
+    def depths(self):
+        """
+        各节点深度（根为0），同时切断昵称重复导致的环
+        """
+        n = len(self.mids)
+        depth = array('i', [-1]) * n
+        depth[0] = 0
+        for node in range(1, n):
+            path = []
+            cur = node
+            while depth[cur] < 0:
+                path.append(cur)
+                cur = self.parents[cur]
+                if len(path) > n:
+                    # 出现环，挂到根节点下
+                    self.parents[node] = 0
+                    path = [node]
+                    cur = 0
+                    break
+            base = depth[cur]
+            for offset, p in enumerate(reversed(path)):
+                depth[p] = base + offset + 1
+        return depth
+
+    def stats(self, milestones=(10, 100, 1000, 10000)):
+        """
+        规模、深度、最大宽度以及达到N次转发所用的秒数
+        """
+        depth = self.depths()
+        width = defaultdict(int)
+        for d in depth[1:]:
+            width[d] += 1
+        times = sorted(self.times[1:])
+        root_time = self.times[0] or (times[0] if times else 0)
+        time_to = {}
+        for n in milestones:
+            if len(times) >= n:
+                time_to[str(n)] = times[n - 1] - root_time
+        return {
+            'root_mid': self.root_mid,
+            'size': len(self.mids) - 1,
+            'depth': max(depth) if len(depth) else 0,
+            'breadth': max(width.values()) if width else 0,
+            'unresolved': sum(len(v) for v in self.pending.values()),
+            'time_to_reposts': time_to,
+        }
+
+    def save(self, path):
+        """
+        保存父下标等数组到目录
+        """
+        os.makedirs(path, exist_ok=True)
+        for name in ('mids', 'uids', 'times', 'parents'):
+            with open(os.path.join(path, f'{name}.bin'), 'wb') as f:
+                getattr(self, name).tofile(f)
+        with open(os.path.join(path, 'meta.json'), 'wt', encoding='utf-8') as f:
+            json.dump({'num_nodes': len(self.mids),
+                       'typecodes': {'mids': 'q', 'uids': 'q', 'times': 'q', 'parents': 'i'}}, f)
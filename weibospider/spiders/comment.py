@@ -6,9 +6,14 @@ Mail: nghuyong@163.com
 Created Time: 2020/4/14
 """
 import json
-from scrapy import Spider
+import os
+from collections import defaultdict, deque
+
+from scrapy import Spider, signals
 from scrapy.http import Request
-from spiders.common import parse_user_info, parse_time, url_to_mid
+from spiders.common import parse_bool, parse_user_info, parse_time, url_to_mid
+from spiders.items import CommentItem
+from spiders.watermark import WatermarkStore
 
 
 class CommentSpider(Spider):
@@ -16,42 +21,216 @@ class CommentSpider(Spider):
     微博评论数据采集
     """
     name = "comment"
+    # 增量采集: 按时间倒序翻页，遇到上次采集过的评论即停止，只采集新评论
+    incremental = False
+    # 每条推文的水位线（上次采集到的最新评论）保存位置
+    watermark_path = '../output/watermarks.json'
+    # 采集层级: 1 只采集一级评论，2 同时采集每条评论下的全部回复（楼中楼）
+    max_depth = 2
+    # 每条一级评论最多采集的回复数，0表示不限制
+    max_replies = 0
+    # 同时翻页的回复楼数，其余的排队等待
+    max_concurrent_threads = 16
+    # 评论树（父子评论ID）的保存位置，为空时不保存
+    tree_path = '../output/comment_tree.jsonl'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # scrapy crawl -a 传入的参数都是字符串
+        self.max_depth = int(self.max_depth)
+        self.max_replies = int(self.max_replies)
+        self.max_concurrent_threads = int(self.max_concurrent_threads)
+        self.incremental = parse_bool(self.incremental)
+        self.newest = {}
+        self.active_threads = 0
+        self.pending_threads = deque()
+        self.children = defaultdict(list)  # 父评论ID -> 子评论ID列表
+        self.comment_mids = {}  # 一级评论ID -> 所属推文mid
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.reply_dropped, signal=signals.request_dropped)
+        return spider
 
     def start_requests(self):
         """
         爬虫入口
         """
-        # 这里tweet_ids可替换成实际待采集的数据
-        tweet_ids = ['Mb15BDYR0']
+        # 这里tweet_ids可替换成实际待采集的数据，run_spider.py --seeds 指定种子文件时使用文件中的数据
+        tweet_ids = getattr(self, 'seeds', None) or ['Mb15BDYR0']
+        self.watermarks = WatermarkStore(self.watermark_path, self.name)
         for tweet_id in tweet_ids:
             mid = url_to_mid(tweet_id)
             url = f"https://weibo.com/ajax/statuses/buildComments?" \
                   f"is_reload=1&id={mid}&is_show_bulletin=2&is_mix=0&count=20"
-            yield Request(url, callback=self.parse, meta={'source_url': url})
+            watermark = None
+            if self.incremental:
+                # flow=1 按时间排序，默认的热度排序无法据此提前停止
+                url += '&flow=1'
+                watermark = self.watermarks.get(mid)
+            yield Request(url, callback=self.parse, meta={'source_url': url, 'mid': mid, 'watermark': watermark})
 
     def parse(self, response, **kwargs):
         """
         网页解析
         """
         data = json.loads(response.text)
+        mid = response.meta['mid']
+        watermark = response.meta.get('watermark')
         for comment_info in data['data']:
             item = self.parse_comment(comment_info)
+            if watermark and self.is_seen(item, watermark):
+                # 置顶评论可能比水位线旧，这里只跳过，是否停止翻页看本页最后一条
+                continue
+            item['mid'] = mid
+            item['root_id'] = item['_id']
+            item['parent_id'] = None
+            self.track_newest(mid, item)
             yield item
             # 解析二级评论
-            if 'more_info' in comment_info:
-                url = f"https://weibo.com/ajax/statuses/buildComments?is_reload=1&id={comment_info['id']}" \
-                      f"&is_show_bulletin=2&is_mix=1&fetch_level=1&max_id=0&count=100"
-                yield Request(url, callback=self.parse, priority=20)
-        if data.get('max_id', 0) != 0 and 'fetch_level=1' not in response.url:
+            if self.max_depth > 1 and 'more_info' in comment_info:
+                self.comment_mids[item['_id']] = mid
+                request = self.open_thread(mid, item['_id'])
+                if request:
+                    yield request
+        reached_watermark = bool(watermark and data['data']) and \
+            self.is_seen(self.parse_comment(data['data'][-1]), watermark)
+        if data.get('max_id', 0) != 0 and not reached_watermark:
             url = response.meta['source_url'] + '&max_id=' + str(data['max_id'])
             yield Request(url, callback=self.parse, meta=response.meta)
+        else:
+            self.finish_tweet(mid)
+
+    @staticmethod
+    def reply_url(root_id, max_id=0):
+        return f"https://weibo.com/ajax/statuses/buildComments?is_reload=1&id={root_id}" \
+               f"&is_show_bulletin=2&is_mix=1&fetch_level=1&max_id={max_id}&count=100"
+
+    def reply_request(self, mid, root_id, max_id=0, fetched=0):
+        meta = {'mid': mid, 'root_id': root_id, 'fetched': fetched}
+        # 回复请求占用并发名额，不能被去重过滤掉，否则名额永远不会释放
+        return Request(self.reply_url(root_id, max_id), callback=self.parse_replies, errback=self.reply_failed,
+                       meta=meta, priority=20, dont_filter=True)
+
+    def open_thread(self, mid, root_id):
+        """
+        开始翻页一条评论下的回复，超过并发上限时排队并返回None
+        """
+        if self.max_concurrent_threads and self.active_threads >= self.max_concurrent_threads:
+            self.pending_threads.append((mid, root_id))
+            return None
+        self.active_threads += 1
+        return self.reply_request(mid, root_id)
+
+    def close_thread(self):
+        """
+        一条回复楼翻页结束，返回排队中下一条楼的请求
+        """
+        self.active_threads -= 1
+        if self.pending_threads:
+            return self.open_thread(*self.pending_threads.popleft())
+        return None
+
+    def parse_replies(self, response, **kwargs):
+        """
+        解析楼中楼回复，沿 max_id 翻页直到结束或达到 max_replies
+        """
+        try:
+            data = json.loads(response.text)
+            mid, root_id, fetched = response.meta['mid'], response.meta['root_id'], response.meta['fetched']
+            for comment_info in data['data']:
+                if self.max_replies and fetched >= self.max_replies:
+                    break
+                item = self.parse_comment(comment_info)
+                item['mid'] = mid
+                item['root_id'] = root_id
+                # 回复其他回复时带有 reply_comment，否则直接挂在一级评论下
+                item['parent_id'] = item['reply_comment']['_id'] if 'reply_comment' in item else root_id
+                self.children[item['parent_id']].append(item['_id'])
+                self.comment_mids.setdefault(item['parent_id'], mid)
+                fetched += 1
+                yield item
+            reached_budget = bool(self.max_replies) and fetched >= self.max_replies
+            if data['data'] and data.get('max_id', 0) != 0 and not reached_budget:
+                yield self.reply_request(mid, root_id, data['max_id'], fetched)
+                return
+        except Exception:
+            # 登录页、验证码等非JSON响应或缺少字段时回调抛出异常，errback 不会被调用，
+            # 这里同样释放并发名额，再抛出交给Scrapy记录
+            request = self.close_thread()
+            if request:
+                yield request
+            raise
+        request = self.close_thread()
+        if request:
+            yield request
+
+    def reply_failed(self, failure):
+        """
+        回复请求失败也要释放并发名额，否则排队的楼永远不会开始
+        """
+        self.logger.warning(f'reply thread failed: {failure.request.url}')
+        request = self.close_thread()
+        if request:
+            yield request
+
+    def reply_dropped(self, request, spider):
+        """
+        回复请求被调度器丢弃时同样释放并发名额
+        """
+        if spider is not self or request.callback != self.parse_replies:
+            return
+        request = self.close_thread()
+        if request:
+            self.crawler.engine.crawl(request, self)
+
+    @staticmethod
+    def is_seen(item, watermark):
+        """
+        评论是否不晚于水位线
+        """
+        return (item['created_at'], int(item['_id'])) <= (watermark['created_at'], watermark['id'])
+
+    def track_newest(self, mid, item):
+        """
+        记录本次运行中每条推文的最新评论
+        """
+        newest = self.newest.get(mid)
+        if newest is None or (item['created_at'], int(item['_id'])) > (newest['created_at'], newest['id']):
+            self.newest[mid] = {'created_at': item['created_at'], 'id': int(item['_id'])}
+
+    def finish_tweet(self, mid):
+        """
+        翻页完整结束后才推进水位线，中途中断的推文下次仍从旧水位线开始
+        """
+        if mid in self.newest:
+            self.watermarks.set(mid, self.newest[mid])
+
+    def closed(self, reason):
+        """
+        爬虫结束时保存水位线和评论树
+        """
+        self.watermarks.save()
+        if self.tree_path and self.children:
+            self.save_tree(self.tree_path)
+
+    def save_tree(self, path):
+        """
+        每行一个有回复的评论: {"mid": 推文mid, "_id": 评论ID, "children": [子评论ID, ...]}
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'wt', encoding='utf-8') as f:
+            for parent_id, children in self.children.items():
+                line = {'mid': self.comment_mids.get(parent_id), '_id': parent_id, 'children': children}
+                f.write(json.dumps(line) + '\n')
 
     @staticmethod
     def parse_comment(data):
         """
         解析comment
         """
-        item = dict()
+        item = CommentItem()
         item['created_at'] = parse_time(data['created_at'])
         item['_id'] = data['id']
         item['like_counts'] = data['like_counts']
@@ -9,6 +9,8 @@ import re
 
 import dateutil.parser
 
+from .items import TweetItem, UserItem
+
 
 def base62_decode(string):
     """
@@ -26,6 +28,21 @@ def base62_decode(string):
     return num
 
 
+def base62_encode(num):
+    """
+    base62编码，base62_decode的逆运算
+    """
+    alphabet = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    num = int(num)
+    if num == 0:
+        return alphabet[0]
+    chars = []
+    while num:
+        num, rem = divmod(num, 62)
+        chars.append(alphabet[rem])
+    return ''.join(reversed(chars))
+
+
 def reverse_cut_to_length(content, code_func, cut_num=4, fill_num=7):
     """
     url to mid
@@ -50,6 +67,37 @@ def url_to_mid(url: str):
     return int(result)
 
 
+def mid_to_url(mid):
+    """>>> mid_to_url(3501756485200075)
+    'z0JH2lOMb'
+    """
+    return reverse_cut_to_length(mid, base62_encode, cut_num=7, fill_num=4)
+
+
+# 微博的两个站点，用于把请求改写到本地模拟服务等场景
+WEIBO_HOSTS = ('https://s.weibo.com', 'https://weibo.com')
+
+
+def rewrite_host(url, base_url):
+    """
+    把微博站点的URL改写到 base_url 下，路径和参数保持不变
+    https://weibo.com/ajax/statuses/show?id=1 => http://127.0.0.1:8765/ajax/statuses/show?id=1
+    """
+    for host in WEIBO_HOSTS:
+        if url.startswith(host + '/'):
+            return base_url.rstrip('/') + url[len(host):]
+    return url
+
+
+def parse_bool(value):
+    """
+    爬虫参数转为布尔值: scrapy crawl -a 传入的都是字符串，'0'、'false' 也不能当作真
+    """
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+
 def parse_time(s):
     """
     Wed Oct 19 23:44:36 +0800 2022 => 2022-10-19 23:44:36
@@ -62,12 +110,12 @@ def parse_user_info(data):
     解析用户信息
     """
     # 基础信息
-    user = {
-        "_id": str(data['id']),
-        "avatar_hd": data['avatar_hd'],
-        "nick_name": data['screen_name'],
-        "verified": data['verified'],
-    }
+    user = UserItem(
+        _id=str(data['id']),
+        avatar_hd=data['avatar_hd'],
+        nick_name=data['screen_name'],
+        verified=data['verified'],
+    )
     # 额外的信息
     keys = ['description', 'followers_count', 'friends_count', 'statuses_count',
             'gender', 'location', 'mbrank', 'mbtype', 'credit_score']
@@ -87,23 +135,23 @@ def parse_tweet_info(data):
     """
     解析推文数据
     """
-    tweet = {
-        "_id": str(data['mid']),
-        "mblogid": data['mblogid'],
-        "created_at": parse_time(data['created_at']),
-        "geo": data.get('geo', None),
-        "ip_location": data.get('region_name', None),
-        "reposts_count": data['reposts_count'],
-        "comments_count": data['comments_count'],
-        "attitudes_count": data['attitudes_count'],
-        "source": data['source'],
-        "content": data['text_raw'].replace('\u200b', ''),
-        "pic_urls": ["https://wx1.sinaimg.cn/orj960/" + pic_id for pic_id in data.get('pic_ids', [])],
-        "pic_num": data['pic_num'],
-        'isLongText': False,
-        'is_retweet': False,
-        "user": parse_user_info(data['user']),
-    }
+    tweet = TweetItem(
+        _id=str(data['mid']),
+        mblogid=data['mblogid'],
+        created_at=parse_time(data['created_at']),
+        geo=data.get('geo', None),
+        ip_location=data.get('region_name', None),
+        reposts_count=data['reposts_count'],
+        comments_count=data['comments_count'],
+        attitudes_count=data['attitudes_count'],
+        source=data['source'],
+        content=data['text_raw'].replace('\u200b', ''),
+        pic_urls=["https://wx1.sinaimg.cn/orj960/" + pic_id for pic_id in data.get('pic_ids', [])],
+        pic_num=data['pic_num'],
+        isLongText=False,
+        is_retweet=False,
+        user=parse_user_info(data['user']),
+    )
     if '</a>' in tweet['source']:
         tweet['source'] = re.search(r'>(.*?)</a>', tweet['source']).group(1)
     if 'page_info' in data and data['page_info'].get('object_type', '') == 'video':
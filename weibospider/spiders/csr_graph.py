@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+压缩稀疏行（CSR）格式的有向图存储
+
+节点为微博用户uid，内部映射为连续的整数下标；边先追加到两个数组缓冲区，
+达到阈值或导出前压缩进 indptr/indices 数组并去重。每条边约占4字节，
+百万级的边可以常驻内存。
+"""
+import json
+import os
+from array import array
+
+
+class CSRGraph(object):
+    """
+    有向图: 边 src -> dst 表示 src 关注了 dst
+    """
+
+    def __init__(self, compact_every=1000000):
+        self.index = {}  # uid -> 下标
+        self.uids = array('q')  # 下标 -> uid
+        self.indptr = array('Q', [0])  # 第i个节点的出边为 indices[indptr[i]:indptr[i + 1]]
+        self.indices = array('I')
+        self._src = array('I')  # 尚未压缩的新增边
+        self._dst = array('I')
+        self.compact_every = compact_every
+
+    def node(self, uid):
+        """
+        返回uid对应的下标，不存在时新建
+        """
+        uid = int(uid)
+        idx = self.index.get(uid)
+        if idx is None:
+            idx = len(self.uids)
+            self.index[uid] = idx
+            self.uids.append(uid)
+        return idx
+
+    def add_edge(self, src_uid, dst_uid):
+        """
+        添加一条边
+        """
+        self._src.append(self.node(src_uid))
+        self._dst.append(self.node(dst_uid))
+        if len(self._src) >= self.compact_every:
+            self.compact()
+
+    @property
+    def num_nodes(self):
+        return len(self.uids)
+
+    @property
+    def num_edges(self):
+        self.compact()
+        return len(self.indices)
+
+    def compact(self):
+        """
+        把缓冲区的边合并进CSR数组: 计数排序按行放置，再逐行排序去重
+        """
+        if not self._src and len(self.indptr) == len(self.uids) + 1:
+            return
+        n = len(self.uids)
+        old_rows = len(self.indptr) - 1
+        counts = array('Q', bytes(8 * (n + 1)))
+        for row in range(old_rows):
+            counts[row + 1] = self.indptr[row + 1] - self.indptr[row]
+        for src in self._src:
+            counts[src + 1] += 1
+        for row in range(n):
+            counts[row + 1] += counts[row]
+        merged = array('I', bytes(4 * counts[n]))
+        cursor = array('Q', counts)
+        for row in range(old_rows):
+            start, end = self.indptr[row], self.indptr[row + 1]
+            merged[cursor[row]:cursor[row] + end - start] = self.indices[start:end]
+            cursor[row] += end - start
+        for src, dst in zip(self._src, self._dst):
+            merged[cursor[src]] = dst
+            cursor[src] += 1
+
+        indptr = array('Q', [0])
+        indices = array('I')
+        for row in range(n):
+            indices.extend(sorted(set(merged[counts[row]:counts[row + 1]])))
+            indptr.append(len(indices))
+        self.indptr, self.indices = indptr, indices
+        self._src, self._dst = array('I'), array('I')
+
+    def neighbors(self, uid):
+        """
+        uid 关注的用户列表
+        """
+        self.compact()
+        idx = self.index.get(int(uid))
+        if idx is None:
+            return []
+        return [self.uids[i] for i in self.indices[self.indptr[idx]:self.indptr[idx + 1]]]
+
+    def out_degree(self, uid):
+        self.compact()
+        idx = self.index.get(int(uid))
+        if idx is None:
+            return 0
+        return self.indptr[idx + 1] - self.indptr[idx]
+
+    def merge(self, other):
+        """
+        并入另一个图的全部边（如多进程各自采集的部分）
+        """
+        other.compact()
+        for row in range(other.num_nodes):
+            src = other.uids[row]
+            for i in other.indices[other.indptr[row]:other.indptr[row + 1]]:
+                self.add_edge(src, other.uids[i])
+        self.compact()
+
+    def save(self, path):
+        """
+        保存为目录: uids/indptr/indices 三个二进制数组文件和 meta.json
+        """
+        self.compact()
+        os.makedirs(path, exist_ok=True)
+        for name in ('uids', 'indptr', 'indices'):
+            with open(os.path.join(path, f'{name}.bin'), 'wb') as f:
+                getattr(self, name).tofile(f)
+        with open(os.path.join(path, 'meta.json'), 'wt', encoding='utf-8') as f:
+            json.dump({'num_nodes': self.num_nodes, 'num_edges': len(self.indices),
+                       'typecodes': {'uids': 'q', 'indptr': 'Q', 'indices': 'I'}}, f)
+
+    @classmethod
+    def load(cls, path):
+        """
+        从 save 生成的目录加载
+        """
+        graph = cls()
+        with open(os.path.join(path, 'meta.json'), 'rt', encoding='utf-8') as f:
+            meta = json.load(f)
+        sizes = {'uids': meta['num_nodes'], 'indptr': meta['num_nodes'] + 1, 'indices': meta['num_edges']}
+        for name, typecode in meta['typecodes'].items():
+            values = array(typecode)
+            with open(os.path.join(path, f'{name}.bin'), 'rb') as f:
+                values.fromfile(f, sizes[name])
+            setattr(graph, name, values)
+        graph.index = {uid: idx for idx, uid in enumerate(graph.uids)}
+        return graph
+
+    def export_edgelist(self, path):
+        """
+        导出为 "src_uid\\tdst_uid" 的边列表，便于 networkx/igraph 等工具读取
+        """
+        self.compact()
+        with open(path, 'wt', encoding='utf-8') as f:
+            for row in range(self.num_nodes):
+                src = self.uids[row]
+                for i in self.indices[self.indptr[row]:self.indptr[row + 1]]:
+                    f.write(f'{src}\t{self.uids[i]}\n')
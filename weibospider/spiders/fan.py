@@ -9,9 +9,11 @@ import json
 from scrapy import Spider
 from scrapy.http import Request
 from spiders.comment import parse_user_info
+from spiders.items import RelationItem
+from spiders.pagination import PageFanOutMixin
 
 
-class FanSpider(Spider):
+class FanSpider(PageFanOutMixin, Spider):
     """
     微博粉丝数据采集
     """
@@ -22,11 +24,18 @@ class FanSpider(Spider):
         """
         爬虫入口
         """
-        # 这里user_ids可替换成实际待采集的数据
-        user_ids = ['1087770692']
+        # 这里user_ids可替换成实际待采集的数据，run_spider.py --seeds 指定种子文件时使用文件中的数据
+        user_ids = getattr(self, 'seeds', None) or ['1087770692']
         for user_id in user_ids:
-            url = self.base_url + f"?relate=fans&page=1&uid={user_id}&type=fans"
-            yield Request(url, callback=self.parse, meta={'user': user_id, 'page_num': 1})
+            yield self.page_request(user_id, 1, None)
+
+    def page_request(self, user_id, page_num, last_page):
+        """
+        列表的某一页
+        """
+        url = self.base_url + f"?relate=fans&page={page_num}&uid={user_id}&type=fans"
+        meta = {'user': user_id, 'page_num': page_num, 'fan_out_key': user_id, 'last_page': last_page}
+        return Request(url, callback=self.parse, meta=meta, priority=-page_num)
 
     def parse(self, response, **kwargs):
         """
@@ -34,12 +43,11 @@ class FanSpider(Spider):
         """
         data = json.loads(response.text)
         for user in data['users']:
-            item = dict()
+            item = RelationItem()
             item['follower_id'] = response.meta['user']
             item['fan_info'] = parse_user_info(user)
             item['_id'] = response.meta['user'] + '_' + item['fan_info']['_id']
             yield item
-        if data['users']:
-            response.meta['page_num'] += 1
-            url = self.base_url + f"?relate=fans&page={response.meta['page_num']}&uid={response.meta['user']}&type=fans"
-            yield Request(url, callback=self.parse, meta=response.meta)
+        user_id = response.meta['user']
+        yield from self.paginate(response, data.get('total_number'), 20, bool(data['users']),
+                                 lambda page_num, last_page: self.page_request(user_id, page_num, last_page))
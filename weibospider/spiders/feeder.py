@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+按调度器的空余逐批放入请求
+
+Scrapy只要下载器有空位就会继续取 start_requests，种子多、每个种子又会展开出大量分页时，
+调度器中堆积的请求远多于正在下载的请求。登记到 feed 的请求迭代器只在调度器中待处理的请求
+少于 feed_low_water 时才继续取，每次最多 feed_batch 个，种子再多内存占用也基本不变。
+"""
+from collections import deque
+
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
+
+
+class RequestFeederMixin(object):
+    """
+    爬虫在 start_requests 或其他地方调用 self.feed(请求迭代器)，请求按登记顺序逐批放入调度器
+    """
+    # 调度器中待处理的请求少于该值时继续放入
+    feed_low_water = 1000
+    # 每次最多放入的请求数
+    feed_batch = 200
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        # start_requests 在引擎创建调度器之前调用，其中登记的请求在 spider_opened 时放入第一批
+        crawler.signals.connect(spider.feed_more, signal=signals.spider_opened)
+        crawler.signals.connect(spider.feed_more, signal=signals.response_received)
+        crawler.signals.connect(spider.feed_on_idle, signal=signals.spider_idle)
+        return spider
+
+    def feed(self, requests):
+        """
+        登记请求迭代器，迭代器只在需要时才继续生成请求；引擎还没有打开爬虫时等到 spider_opened 再放入
+        """
+        self.__dict__.setdefault('feeds', deque()).append(iter(requests))
+        self.feed_more()
+
+    def feeding(self):
+        """
+        是否还有未放完的请求
+        """
+        return bool(self.__dict__.get('feeds'))
+
+    def feed_more(self):
+        """
+        调度器有空余时放入下一批请求，返回放入的数量
+        """
+        feeds = self.__dict__.get('feeds')
+        engine = self.crawler.engine
+        if not feeds or engine is None or engine.slot is None:
+            return 0
+        room = min(self.feed_low_water - len(engine.slot.scheduler), self.feed_batch)
+        fed = 0
+        while feeds and fed < room:
+            request = next(feeds[0], None)
+            if request is None:
+                feeds.popleft()
+                continue
+            engine.crawl(request, self)
+            fed += 1
+        if fed:
+            self.crawler.stats.inc_value('feeder/requests', fed)
+        return fed
+
+    def feed_on_idle(self, spider):
+        """
+        调度器和下载器都空了但还有未放完的请求时，继续放入并保持爬虫运行
+        """
+        if self.feed_more() or self.feeding():
+            raise DontCloseSpider
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+紧凑的数据项类型
+
+每条数据使用 __slots__ 存储字段，相比自由字典显著降低内存占用；
+同时实现 MutableMapping 接口，原有 item['key'] 写法、Scrapy pipeline
+以及 Web API 的 JSON 输出都无需改动。未赋值的字段视为不存在的键。
+"""
+import json
+from collections.abc import MutableMapping
+
+
+def _plain(value):
+    """
+    将嵌套的数据项转换为普通字典
+    """
+    if isinstance(value, SlotItem):
+        return value.to_dict()
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    return value
+
+
+class SlotItem(MutableMapping):
+    """
+    数据项基类，子类只需声明 fields
+    """
+    __slots__ = ('_extra',)
+    fields = ()
+    _field_set = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # fields 同时作为 __slots__，这里做一次快速查找集合
+        cls._field_set = frozenset(cls.fields)
+
+    def __init__(self, **kwargs):
+        self._extra = None
+        for key, value in kwargs.items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        if key in self._field_set:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self._field_set:
+            setattr(self, key, value)
+        else:
+            # 未声明的字段放到附加字典中，保持与原有dict写法兼容
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self._field_set:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self._extra is not None and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if key in self._field_set:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        for key in self.fields:
+            if hasattr(self, key):
+                yield key
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.to_dict()!r})'
+
+    def to_dict(self):
+        """
+        转换为普通字典（嵌套数据项一并转换）
+        """
+        result = {}
+        for key in self.fields:
+            try:
+                value = getattr(self, key)
+            except AttributeError:
+                continue
+            result[key] = _plain(value)
+        if self._extra:
+            for key, value in self._extra.items():
+                result[key] = _plain(value)
+        return result
+
+    def to_json(self):
+        """
+        序列化为一行JSON
+        """
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+
+    @classmethod
+    def row_header(cls):
+        """
+        to_row 对应的列名
+        """
+        return cls.fields
+
+    def to_row(self):
+        """
+        转换为扁平的一行数据，嵌套数据项只保留其_id，列表/字典序列化为JSON
+        """
+        row = []
+        for key in self.fields:
+            value = getattr(self, key, None)
+            if isinstance(value, SlotItem):
+                value = value.get('_id')
+            elif isinstance(value, (list, dict)):
+                value = json.dumps(_plain(value), ensure_ascii=False)
+            row.append(value)
+        return tuple(row)
+
+
+class UserItem(SlotItem):
+    """
+    用户
+    """
+    fields = ('_id', 'avatar_hd', 'nick_name', 'verified', 'description', 'followers_count',
+              'friends_count', 'statuses_count', 'gender', 'location', 'mbrank', 'mbtype',
+              'credit_score', 'created_at', 'verified_type', 'verified_reason', 'birthday',
+              'desc_text', 'ip_location', 'sunshine_credit', 'label_desc', 'company', 'education',
+              'crawl_time')
+    __slots__ = fields
+
+
+class TweetItem(SlotItem):
+    """
+    推文
+    """
+    fields = ('_id', 'mblogid', 'created_at', 'geo', 'ip_location', 'reposts_count', 'comments_count',
+              'attitudes_count', 'source', 'content', 'pic_urls', 'pic_num', 'isLongText', 'is_retweet',
+              'user', 'video', 'video_online_numbers', 'url', 'retweet_id', 'reads_count', 'keyword',
+              'keywords', 'pic_paths', 'video_path', 'duplicate_of', 'crawl_time')
+    __slots__ = fields
+
+
+class CommentItem(SlotItem):
+    """
+    评论
+    """
+    fields = ('created_at', '_id', 'like_counts', 'ip_location', 'content', 'comment_user',
+              'reply_comment', 'mid', 'root_id', 'parent_id', 'duplicate_of', 'crawl_time')
+    __slots__ = fields
+
+
+class RelationItem(SlotItem):
+    """
+    粉丝/关注关系
+    """
+    fields = ('follower_id', 'fan_info', 'fan_id', 'follower_info', '_id', 'crawl_time')
+    __slots__ = fields
+
+
+try:
+    from itemadapter import ItemAdapter
+    from itemadapter.adapter import AdapterInterface
+except ImportError:  # 仅使用requests服务时可不安装Scrapy
+    ItemAdapter = None
+else:
+    class SlotItemAdapter(AdapterInterface):
+        """
+        让Scrapy识别SlotItem
+        """
+
+        @classmethod
+        def is_item_class(cls, item_class):
+            return issubclass(item_class, SlotItem)
+
+        @classmethod
+        def get_field_names_from_class(cls, item_class):
+            return list(item_class.fields)
+
+        def __getitem__(self, field_name):
+            return self.item[field_name]
+
+        def __setitem__(self, field_name, value):
+            self.item[field_name] = value
+
+        def __delitem__(self, field_name):
+            del self.item[field_name]
+
+        def __iter__(self):
+            return iter(self.item)
+
+        def __len__(self):
+            return len(self.item)
+
+    ItemAdapter.ADAPTER_CLASSES.appendleft(SlotItemAdapter)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+推文图片/视频的下载与内容寻址存储
+
+文件按内容的sha256保存为 {root}/{前2位}/{3-4位}/{sha256}{扩展名}，内容相同的文件只保存一份；
+URL与文件的对应关系记录在 {root}/index.db（sqlite），已下载过的URL不再请求。
+下载在有界线程池中进行，响应按块写入临时文件并同时计算哈希，不在内存中保留整个文件；
+同一URL同时被多条推文引用时（如热门图片被大量转发）只下载一次，其余调用等待同一个结果。
+"""
+import hashlib
+import mimetypes
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 按URL路径判断的扩展名，其余按响应的 Content-Type 推断
+MEDIA_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp4', '.mov', '.m3u8')
+CHUNK_SIZE = 64 * 1024
+
+
+class MediaError(Exception):
+    """
+    下载失败（状态码异常、超过大小限制等）
+    """
+
+
+class MediaStore(object):
+    """
+    线程安全的媒体文件下载与存储，fetch 返回 concurrent.futures.Future，结果为相对 root 的路径
+    """
+
+    def __init__(self, root, concurrency=8, max_size=200 * 1024 * 1024, timeout=60, headers=None,
+                 proxy=None, mock_server=None):
+        self.root = root
+        self.max_size = max_size
+        self.timeout = timeout
+        self.mock_server = mock_server
+        self.tmp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='media')
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=concurrency))
+        self.session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=concurrency))
+        self.session.headers.update(headers or {})
+        if proxy:
+            self.session.proxies = {'http': f'http://{proxy}', 'https': f'http://{proxy}'}
+        self.inflight = {}  # url -> Future
+        self.lock = threading.Lock()
+        self.hits = 0  # 已下载过或正在下载的URL
+        self.misses = 0  # 实际发起的下载
+        self.duplicates = 0  # 下载后发现内容已存在
+        self.failures = 0
+        self.bytes = 0
+        self.db = sqlite3.connect(os.path.join(root, 'index.db'), timeout=30, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS media '
+                        '(url TEXT PRIMARY KEY, sha256 TEXT, path TEXT, size INTEGER, fetched_at REAL)')
+        self.db.commit()
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(settings.get('MEDIA_STORE'),
+                   concurrency=settings.getint('MEDIA_CONCURRENCY', 8),
+                   max_size=settings.getint('MEDIA_MAX_SIZE', 200 * 1024 * 1024),
+                   timeout=settings.getfloat('MEDIA_TIMEOUT', 60),
+                   headers={'User-Agent': settings.getdict('DEFAULT_REQUEST_HEADERS').get('User-Agent', ''),
+                            'Referer': 'https://weibo.com/'},
+                   proxy=settings.get('PROXY'),
+                   mock_server=settings.get('MOCK_SERVER'))
+
+    def fetch(self, url):
+        """
+        获取URL对应的本地文件，已下载过的直接返回，正在下载的合并到同一个Future
+        """
+        with self.lock:
+            future = self.inflight.get(url)
+            if future is not None:
+                self.hits += 1
+                return future
+            row = self.db.execute('SELECT path FROM media WHERE url = ?', (url,)).fetchone()
+            if row and os.path.exists(os.path.join(self.root, row[0])):
+                self.hits += 1
+                future = Future()
+                future.set_result(row[0])
+                return future
+            self.misses += 1
+            future = self.inflight[url] = self.executor.submit(self._download, url)
+        future.add_done_callback(lambda _: self._finish(url))
+        return future
+
+    def _finish(self, url):
+        with self.lock:
+            self.inflight.pop(url, None)
+
+    def _download(self, url):
+        """
+        边下载边计算sha256写入临时文件，完成后移动到内容寻址的位置
+        """
+        tmp_path = None
+        try:
+            with self.session.get(self._request_url(url), stream=True, timeout=self.timeout) as response:
+                if response.status_code != 200:
+                    raise MediaError(f'HTTP {response.status_code}: {url}')
+                if int(response.headers.get('Content-Length') or 0) > self.max_size:
+                    raise MediaError(f'larger than {self.max_size} bytes: {url}')
+                fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+                digest = hashlib.sha256()
+                size = 0
+                with os.fdopen(fd, 'wb') as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > self.max_size:
+                            raise MediaError(f'larger than {self.max_size} bytes: {url}')
+                        digest.update(chunk)
+                        f.write(chunk)
+                extension = self._extension(url, response.headers.get('Content-Type'))
+            sha256 = digest.hexdigest()
+            path = os.path.join(sha256[:2], sha256[2:4], sha256 + extension)
+            target = os.path.join(self.root, path)
+            if os.path.exists(target):
+                os.remove(tmp_path)
+                duplicate = True
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(tmp_path, target)
+                duplicate = False
+            tmp_path = None
+            with self.lock:
+                self.duplicates += duplicate
+                self.bytes += size
+                self.db.execute('INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?)',
+                                (url, sha256, path, size, time.time()))
+                self.db.commit()
+            return path
+        except Exception:
+            with self.lock:
+                self.failures += 1
+            raise
+        finally:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _request_url(self, url):
+        """
+        配置了模拟服务时，图片/视频CDN的请求也改写到模拟服务
+        """
+        if not self.mock_server:
+            return url
+        parts = urlsplit(url)
+        return self.mock_server.rstrip('/') + parts.path + (f'?{parts.query}' if parts.query else '')
+
+    @staticmethod
+    def _extension(url, content_type):
+        extension = os.path.splitext(urlsplit(url).path)[1].lower()
+        if extension in MEDIA_EXTENSIONS:
+            return extension
+        if content_type:
+            return mimetypes.guess_extension(content_type.split(';')[0].strip()) or ''
+        return ''
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'duplicates': self.duplicates,
+                    'failures': self.failures, 'bytes': self.bytes, 'inflight': len(self.inflight)}
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
+        with self.lock:
+            self.db.close()
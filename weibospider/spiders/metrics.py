@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Prometheus 文本格式的运行指标
+
+不依赖 prometheus_client，Web服务（/metrics）和Scrapy爬虫（extensions.MetricsExporter）共用:
+- weibo_request_duration_seconds: 请求耗时直方图，按任务和接口类型（search/show/longtext/profile等）
+- weibo_responses_total: 按响应类型计数，ok / non_json / captcha / http_error / network_error
+- weibo_items_total、weibo_items_per_second: 采集的数据量和任务开始以来的平均速率
+- weibo_queue_depth: 待处理的请求数
+- weibo_cache_*: 缓存命中情况
+
+Web服务长期运行，每个任务都有自己的 task 标签；任务结束后其样本再输出一次（最后一次抓取拿到最终值），
+之后计数器和直方图并入 task="finished"，速率、队列长度等按任务的仪表直接删除，样本数不随任务数增长。
+"""
+import threading
+import time
+
+# 已结束任务的样本并入的 task 标签
+FINISHED_TASK = 'finished'
+# 结束后一直没有被抓取的任务，超过该秒数也会并入
+FINISHED_TTL = 600
+
+# 请求耗时直方图的分桶（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# 按顺序匹配URL片段得到接口类型
+ENDPOINT_PATTERNS = [
+    ('/ajax/statuses/longtext', 'longtext'),
+    ('/ajax/statuses/show', 'show'),
+    ('/ajax/profile/', 'profile'),
+    ('/ajax/statuses/buildComments', 'comment'),
+    ('/ajax/statuses/repostTimeline', 'repost'),
+    ('/ajax/friendships/', 'relation'),
+    ('/ajax/statuses/mymblog', 'timeline'),
+    ('/ajax/statuses/searchProfile', 'timeline'),
+    ('/weibo?', 'search'),
+    ('/realtime?', 'search'),
+]
+
+
+def endpoint_type(url):
+    for pattern, name in ENDPOINT_PATTERNS:
+        if pattern in url:
+            return name
+    return 'other'
+
+
+def classify_response(url, status, body):
+    """
+    响应类型: 非200为 http_error；验证码页为 captcha；ajax接口返回非JSON（多为登录页）为 non_json
+    """
+    if status != 200:
+        return 'http_error'
+    head = body[:4096]
+    if b'passport.weibo.com' in head or '验证码'.encode('utf-8') in head:
+        return 'captcha'
+    if '/ajax/' in url and body.lstrip()[:1] != b'{':
+        return 'non_json'
+    return 'ok'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = ('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+class Metric(object):
+    """
+    带标签的指标，每组标签值一个样本
+    """
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}  # 标签值元组 -> 样本
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def remove(self, **labels):
+        """
+        删除匹配给定标签的全部样本，如任务结束后清理
+        """
+        with self.lock:
+            for key in list(self.values):
+                if all(key[self.labelnames.index(name)] == str(value) for name, value in labels.items()):
+                    del self.values[key]
+
+    def fold(self, label, value, into):
+        """
+        标签 label 为 value 的样本并入 into；仪表没有可累加的意义，直接删除
+        """
+        self.remove(**{label: value})
+
+    def _fold(self, label, value, into, merge):
+        index = self.labelnames.index(label)
+        with self.lock:
+            for key in [key for key in self.values if key[index] == str(value)]:
+                target = key[:index] + (str(into),) + key[index + 1:]
+                sample = self.values.pop(key)
+                if target in self.values:
+                    self.values[target] = merge(self.values[target], sample)
+                else:
+                    self.values[target] = sample
+
+    def samples(self):
+        with self.lock:
+            items = list(self.values.items())
+        for key, value in items:
+            yield self.name, _format_labels(self.labelnames, key), value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for name, labels, value in self.samples():
+            lines.append(f'{name}{labels} {_format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def fold(self, label, value, into):
+        self._fold(label, value, into, lambda total, amount: total + amount)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self._key(labels), 0)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def fold(self, label, value, into):
+        def merge(counts, other):
+            return [[a + b for a, b in zip(counts[0], other[0])], counts[1] + other[1], counts[2] + other[2]]
+        self._fold(label, value, into, merge)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # 各分桶计数（非累计）、总和、总数
+                counts = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][index] += 1
+                    break
+            counts[1] += value
+            counts[2] += 1
+
+    def samples(self):
+        with self.lock:
+            items = [(key, (list(counts[0]), counts[1], counts[2])) for key, counts in self.values.items()]
+        for key, (buckets, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, buckets):
+                cumulative += bucket_count
+                yield (f'{self.name}_bucket', _format_labels(self.labelnames, key, ('le', _format_value(bound))),
+                       cumulative)
+            labels = _format_labels(self.labelnames, key)
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, count
+
+
+class Registry(object):
+    """
+    指标集合；collectors 为输出前调用的函数，用于更新由其他对象维护的数值（如缓存统计）
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector):
+        with self.lock:
+            self.collectors.append(collector)
+
+    def render(self):
+        with self.lock:
+            collectors = list(self.collectors)
+            metrics = list(self.metrics)
+        for collector in collectors:
+            collector()
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+REQUEST_LATENCY = REGISTRY.histogram('weibo_request_duration_seconds', '请求耗时（秒）', ('task', 'endpoint'))
+RESPONSES = REGISTRY.counter('weibo_responses_total', '按类型统计的响应数', ('task', 'endpoint', 'result'))
+ITEMS = REGISTRY.counter('weibo_items_total', '采集到的数据条数', ('task',))
+ITEMS_RATE = REGISTRY.gauge('weibo_items_per_second', '任务开始以来平均每秒采集的数据条数', ('task',))
+TASK_START = REGISTRY.gauge('weibo_task_start_time_seconds', '任务开始时间（Unix时间戳）', ('task',))
+QUEUE_DEPTH = REGISTRY.gauge('weibo_queue_depth', '待处理的请求数', ('task', 'queue'))
+CACHE_HITS = REGISTRY.gauge('weibo_cache_hits', '缓存命中次数', ('cache',))
+CACHE_MISSES = REGISTRY.gauge('weibo_cache_misses', '缓存未命中次数', ('cache',))
+CACHE_HIT_RATIO = REGISTRY.gauge('weibo_cache_hit_ratio', '缓存命中率', ('cache',))
+
+_caches = {}  # 名称 -> 提供 stats() 的缓存对象，stats 中需含 hits/misses
+_finished = {}  # 已结束、尚未并入的任务 -> [结束时间, 是否已输出过]
+_finished_lock = threading.Lock()
+
+
+def start_task(task):
+    TASK_START.set(time.time(), task=task)
+
+
+def finish_task(task):
+    """
+    任务结束后固定平均速率，之后不再随时间下降；下一次输出之后该任务的样本并入 task="finished"
+    """
+    now = time.time()
+    _update_rate(task, now)
+    TASK_START.remove(task=task)
+    with _finished_lock:
+        _finished[task] = [now, False]
+    _retire_tasks(now, scraped=False)
+
+
+def observe_response(task, url, status, body, seconds):
+    """
+    记录一次请求的耗时和响应类型，返回响应类型
+    """
+    endpoint = endpoint_type(url)
+    result = classify_response(url, status, body)
+    REQUEST_LATENCY.observe(seconds, task=task, endpoint=endpoint)
+    RESPONSES.inc(task=task, endpoint=endpoint, result=result)
+    return result
+
+
+def observe_error(task, url, seconds):
+    """
+    记录没有拿到响应的请求（超时、连接失败等）
+    """
+    endpoint = endpoint_type(url)
+    REQUEST_LATENCY.observe(seconds, task=task, endpoint=endpoint)
+    RESPONSES.inc(task=task, endpoint=endpoint, result='network_error')
+
+
+def watch_cache(name, cache):
+    """
+    输出指标时读取缓存的 stats()；同名缓存以最后一次注册的为准
+    """
+    _caches[name] = cache
+
+
+def _update_rate(task, now):
+    start = TASK_START.get(task=task)
+    if start:
+        ITEMS_RATE.set(round(ITEMS.get(task=task) / max(now - start, 1e-6), 3), task=task)
+
+
+def _retire_tasks(now, scraped):
+    """
+    并入已输出过一次或结束超过 FINISHED_TTL 秒的任务；scraped 为True时本次输出后其余任务也算已输出
+    """
+    with _finished_lock:
+        retired = [task for task, (finished_at, seen) in _finished.items()
+                   if seen or now - finished_at > FINISHED_TTL]
+        for task in retired:
+            del _finished[task]
+        if scraped:
+            for state in _finished.values():
+                state[1] = True
+    for task in retired:
+        if task == FINISHED_TASK or (str(task),) in TASK_START.values:
+            # 同名任务已重新开始
+            continue
+        for metric in REGISTRY.metrics:
+            if 'task' in metric.labelnames:
+                metric.fold('task', task, FINISHED_TASK)
+
+
+def _collect():
+    now = time.time()
+    _retire_tasks(now, scraped=True)
+    for key in list(TASK_START.values):
+        _update_rate(key[0], now)
+    for name, cache in list(_caches.items()):
+        stats = cache.stats()
+        hits, misses = stats.get('hits', 0), stats.get('misses', 0)
+        CACHE_HITS.set(hits, cache=name)
+        CACHE_MISSES.set(misses, cache=name)
+        CACHE_HIT_RATIO.set(round(hits / (hits + misses), 4) if hits + misses else 0, cache=name)
+
+
+REGISTRY.add_collector(_collect)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+近似重复内容检测
+
+热门话题下大量推文/评论是复制粘贴的广告或只改了几个字的转发。正文去掉链接、@、话题、表情和标点后
+取字符三元组，用MinHash估计两段文本三元组集合的Jaccard相似度，不低于 threshold（默认0.7）的视为近似重复。
+微博正文很短，SimHash在这种长度下改动一个字就会翻转十几位，MinHash更稳定。
+签名按 bands 段分别建索引（LSH），查询时只比较至少一段完全相同的候选，不用与全部内容逐一比较。
+"""
+import random
+import re
+import threading
+from collections import deque
+
+# 链接、@用户、#话题#、[表情] 和标点空白不参与比较
+_NOISE = re.compile(r'https?://\S+|@[\w\-]+|#[^#]*#|\[[^\]]{1,8}\]')
+_PUNCTUATION = re.compile(r'[\W_]+')
+
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 64) - 1
+
+
+def normalize(text):
+    return _PUNCTUATION.sub('', _NOISE.sub('', str(text or ''))).lower()
+
+
+def shingles(text, size=3):
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class NearDuplicateIndex(object):
+    """
+    线程安全的MinHash近似重复索引，最多保留最近的 max_size 条内容。
+    进程内使用内置hash，索引不落盘
+    """
+
+    def __init__(self, threshold=0.7, min_length=10, num_perm=32, bands=8, max_size=1000000):
+        self.threshold = threshold
+        self.min_length = min_length
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_size = max_size
+        rng = random.Random(1)
+        self.perms = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(num_perm)]
+        self.tables = [{} for _ in range(bands)]  # 第i段的签名 -> [(签名, key)]
+        self.order = deque()  # 按收录顺序的 (签名, key)，用于淘汰
+        self.keys = set()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def signature(self, text):
+        hashes = [hash(gram) & _MASK for gram in shingles(text)]
+        return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in self.perms)
+
+    def _bands(self, signature):
+        rows = self.rows
+        return [signature[i * rows:(i + 1) * rows] for i in range(self.bands)]
+
+    def check(self, key, text):
+        """
+        返回与 text 近似重复的已收录内容的key；没有时收录并返回None。
+        同一key再次出现（如长微博补全全文后）不算重复，归一化后过短的文本不判断
+        """
+        key = str(key)
+        text = normalize(text)
+        if len(text) < self.min_length:
+            return None
+        signature = self.signature(text)
+        bands = self._bands(signature)
+        need = self.threshold * self.num_perm
+        with self.lock:
+            if key in self.keys:
+                return None
+            for table, band in zip(self.tables, bands):
+                for candidate, candidate_key in table.get(band, ()):
+                    if sum(x == y for x, y in zip(signature, candidate)) >= need:
+                        self.hits += 1
+                        return candidate_key
+            self.misses += 1
+            for table, band in zip(self.tables, bands):
+                table.setdefault(band, []).append((signature, key))
+            self.order.append((signature, key))
+            self.keys.add(key)
+            while len(self.order) > self.max_size:
+                self._evict()
+        return None
+
+    def _evict(self):
+        signature, key = self.order.popleft()
+        self.keys.discard(key)
+        for table, band in zip(self.tables, self._bands(signature)):
+            bucket = table.get(band)
+            if bucket is None:
+                continue
+            bucket.remove((signature, key))
+            if not bucket:
+                del table[band]
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.order), 'hits': self.hits, 'misses': self.misses}
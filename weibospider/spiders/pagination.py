@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+分页并发展开
+
+对返回总数（如 total_number）的分页接口，第一页返回后一次性发出剩余页的请求，
+交给Scrapy按并发上限调度，而不是解析完一页再请求下一页。某一页返回为空时，
+记下该页码，PageFanOutMiddleware 会丢弃同一序列中尚未下载的更靠后的页。
+"""
+
+
+class PageFanOutMixin(object):
+    """
+    分页并发展开，请求的meta中需要带上 fan_out_key（区分不同的分页序列）和 page_num
+    """
+    # 一次最多展开到第几页，0表示不限制；微博的很多列表实际可翻页数远小于总数
+    fan_out_max_pages = 50
+
+    def fan_out_pages(self, total, page_size):
+        """
+        第一页之后需要请求的页码
+        """
+        pages = -(-int(total) // page_size)
+        if self.fan_out_max_pages:
+            pages = min(pages, self.fan_out_max_pages)
+        return range(2, pages + 1)
+
+    def mark_page_empty(self, key, page_num):
+        """
+        记录某个分页序列中最早出现空页的页码
+        """
+        exhausted = self.__dict__.setdefault('exhausted_pages', {})
+        if key not in exhausted or page_num < exhausted[key]:
+            exhausted[key] = page_num
+
+    def is_page_exhausted(self, key, page_num):
+        """
+        该页是否在已知的空页之后
+        """
+        exhausted = self.__dict__.get('exhausted_pages', {})
+        return key in exhausted and page_num > exhausted[key]
+
+    def paginate(self, response, total, page_size, has_items, build_request):
+        """
+        根据当前页生成后续分页请求
+
+        - 第一页且接口给出总数: 一次性发出第2页到最后一页
+        - 没有总数，或展开的最后一页仍有数据: 按原方式顺序请求下一页
+        - 当前页为空: 记录空页，不再继续
+        build_request(page_num, last_page) 由爬虫构造具体请求
+        """
+        key, page_num = response.meta['fan_out_key'], response.meta['page_num']
+        if not has_items:
+            self.mark_page_empty(key, page_num)
+            return
+        last_page = response.meta.get('last_page')
+        if page_num == 1 and total is not None:
+            pages = self.fan_out_pages(total, page_size)
+            last_page = pages[-1] if pages else 1
+            for page in pages:
+                yield build_request(page, last_page)
+        if last_page is None or page_num >= last_page:
+            yield build_request(page_num + 1, None)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+用户资料补全
+
+用户资料由 /ajax/profile/info 和 /ajax/profile/detail 两个接口拼成。
+ProfileCache 按uid缓存拼好的资料（带过期时间，可选落盘到sqlite以便在
+Scrapy爬虫和Web服务之间共享），并合并同一uid同时发起的多次加载；
+ProfileFetcher 供Scrapy爬虫使用，两个接口并发请求，都返回后再拼成一条用户数据。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+try:
+    from scrapy.http import Request
+except ImportError:  # 仅使用requests服务时可不安装Scrapy，ProfileFetcher 只在爬虫中使用
+    Request = None
+
+from .common import parse_user_info
+from .items import UserItem
+
+INFO_URL = 'https://weibo.com/ajax/profile/info?uid={}'
+DETAIL_URL = 'https://weibo.com/ajax/profile/detail?uid={}'
+
+
+def parse_user_detail(item, data):
+    """
+    把 /ajax/profile/detail 返回的 data 合并进用户数据
+    """
+    item['birthday'] = data.get('birthday', '')
+    if 'created_at' not in item:
+        item['created_at'] = data.get('created_at', '')
+    item['desc_text'] = data.get('desc_text', '')
+    item['ip_location'] = data.get('ip_location', '')
+    item['sunshine_credit'] = data.get('sunshine_credit', {}).get('level', '')
+    item['label_desc'] = [label['name'] for label in data.get('label_desc', [])]
+    if 'company' in data:
+        item['company'] = data['company']
+    if 'education' in data:
+        item['education'] = data['education']
+    return item
+
+
+class ProfileCache(object):
+    """
+    线程安全的用户资料缓存: 内存中按LRU保留最近的 max_size 条，设置 path 时同时写入sqlite。
+    ttl 为0时不命中缓存，只合并并发的加载
+    """
+
+    def __init__(self, ttl=86400, max_size=100000, path=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.path = path
+        self.memory = OrderedDict()  # uid -> (写入时间, 资料dict)
+        self.inflight = {}  # uid -> Future
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.db = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS profiles '
+                            '(uid TEXT PRIMARY KEY, fetched_at REAL, profile TEXT)')
+            self.db.commit()
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(ttl=settings.getint('PROFILE_CACHE_TTL', 86400),
+                   max_size=settings.getint('PROFILE_CACHE_SIZE', 100000),
+                   path=settings.get('PROFILE_CACHE_PATH'))
+
+    def get(self, uid):
+        """
+        返回未过期的资料，没有时返回None
+        """
+        uid = str(uid)
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(uid)
+            if entry is None and self.db is not None:
+                row = self.db.execute('SELECT fetched_at, profile FROM profiles WHERE uid = ?', (uid,)).fetchone()
+                if row:
+                    entry = (row[0], json.loads(row[1]))
+                    self._remember(uid, entry)
+            if entry is None or now - entry[0] >= self.ttl:
+                self.misses += 1
+                return None
+            self.memory.move_to_end(uid)
+            self.hits += 1
+            return UserItem(**entry[1])
+
+    def set(self, uid, profile):
+        uid = str(uid)
+        profile = dict(profile)
+        profile.pop('crawl_time', None)
+        entry = (time.time(), profile)
+        with self.lock:
+            self._remember(uid, entry)
+            if self.db is not None:
+                self.db.execute('INSERT OR REPLACE INTO profiles VALUES (?, ?, ?)',
+                                (uid, entry[0], json.dumps(profile, ensure_ascii=False)))
+                self.db.commit()
+
+    def _remember(self, uid, entry):
+        self.memory[uid] = entry
+        self.memory.move_to_end(uid)
+        while len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+
+    def get_or_load(self, uid, loader):
+        """
+        命中缓存直接返回；否则调用 loader(uid) 加载，同一uid并发的调用只加载一次。
+        加载失败（返回None）不缓存
+        """
+        uid = str(uid)
+        profile = self.get(uid)
+        if profile is not None:
+            return profile
+        with self.lock:
+            future = self.inflight.get(uid)
+            owner = future is None
+            if owner:
+                future = self.inflight[uid] = Future()
+        if not owner:
+            return future.result()
+        try:
+            profile = loader(uid)
+            if profile is not None:
+                self.set(uid, profile)
+            future.set_result(profile)
+            return profile
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(uid, None)
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.memory), 'hits': self.hits, 'misses': self.misses,
+                    'inflight': len(self.inflight)}
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+
+class ProfileFetcher(object):
+    """
+    Scrapy中的用户资料补全: info 和 detail 两个请求同时发出，都返回后输出完整的用户数据。
+    已缓存或正在请求的uid不会重复请求
+    """
+
+    def __init__(self, cache, priority=0):
+        self.cache = cache
+        self.priority = priority
+        self.pending = {}  # uid -> {'info': 用户数据或None, 'detail': data或None}
+
+    def requests(self, uid, refresh=False):
+        """
+        返回补全该用户所需的请求；已在请求中，或已缓存且不要求刷新时返回空列表
+        """
+        uid = str(uid)
+        if uid in self.pending or (not refresh and self.cache.get(uid) is not None):
+            return []
+        self.pending[uid] = {'info': None, 'detail': None}
+        meta = {'profile_uid': uid}
+        return [
+            Request(INFO_URL.format(uid), callback=self.parse_info, errback=self.failed,
+                    meta=meta, priority=self.priority, dont_filter=True),
+            Request(DETAIL_URL.format(uid), callback=self.parse_detail, errback=self.failed,
+                    meta=meta, priority=self.priority, dont_filter=True),
+        ]
+
+    def parse_info(self, response, **kwargs):
+        uid = response.meta['profile_uid']
+        user = json.loads(response.text).get('data', {}).get('user')
+        if not user:
+            self.pending.pop(uid, None)
+            return []
+        return self.join(uid, 'info', parse_user_info(user))
+
+    def parse_detail(self, response, **kwargs):
+        data = json.loads(response.text)
+        return self.join(response.meta['profile_uid'], 'detail', data.get('data') or {})
+
+    def join(self, uid, part, value):
+        parts = self.pending.get(uid)
+        if parts is None:
+            return []
+        parts[part] = value
+        if parts['info'] is None or parts['detail'] is None:
+            return []
+        del self.pending[uid]
+        item = parse_user_detail(parts['info'], parts['detail'])
+        self.cache.set(uid, item)
+        return [item]
+
+    def failed(self, failure):
+        """
+        任一请求失败则放弃该用户，允许之后重新请求
+        """
+        self.pending.pop(failure.request.meta['profile_uid'], None)
+        return []
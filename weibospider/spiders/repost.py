@@ -5,28 +5,49 @@ Author: nghuyong
 Mail: nghuyong@163.com
 Created Time: 2020/4/14
 """
+import datetime
 import json
+import os
+import shutil
 from scrapy import Spider
 from scrapy.http import Request
-from spiders.common import parse_tweet_info, url_to_mid
+from spiders.cascade import RepostCascade, parse_parent_nick
+from spiders.common import parse_bool, parse_tweet_info, parse_time, url_to_mid
+from spiders.pagination import PageFanOutMixin
 
 
-class RepostSpider(Spider):
+class RepostSpider(PageFanOutMixin, Spider):
     """
     微博转发数据采集
     """
     name = "repost"
+    # 级联模式: 根据转发链还原传播树，每条转发附带直接来源，结束时保存树结构和统计
+    cascade = False
+    output_dir = '../output/repost_cascade'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # scrapy crawl -a 传入的参数都是字符串，-a cascade=0 不能开启级联
+        self.cascade = parse_bool(self.cascade)
 
     def start_requests(self):
         """
         爬虫入口
         """
-        # 这里tweet_ids可替换成实际待采集的数据
-        tweet_ids = ['Mb15BDYR0']
+        # 这里tweet_ids可替换成实际待采集的数据，run_spider.py --seeds 指定种子文件时使用文件中的数据
+        tweet_ids = getattr(self, 'seeds', None) or ['Mb15BDYR0']
+        self.cascades = {}
         for tweet_id in tweet_ids:
             mid = url_to_mid(tweet_id)
-            url = f"https://weibo.com/ajax/statuses/repostTimeline?id={mid}&page=1&moduleID=feed&count=10"
-            yield Request(url, callback=self.parse, meta={'page_num': 1, 'mid': mid})
+            yield self.page_request(mid, 1, None)
+
+    def page_request(self, mid, page_num, last_page):
+        """
+        转发列表的某一页
+        """
+        url = f"https://weibo.com/ajax/statuses/repostTimeline?id={mid}&page={page_num}&moduleID=feed&count=10"
+        meta = {'page_num': page_num, 'mid': mid, 'fan_out_key': str(mid), 'last_page': last_page}
+        return Request(url, callback=self.parse, meta=meta, priority=-page_num)
 
     def parse(self, response, **kwargs):
         """
@@ -35,9 +56,67 @@ class RepostSpider(Spider):
         data = json.loads(response.text)
         for tweet in data['data']:
             item = parse_tweet_info(tweet)
+            if self.cascade:
+                self.add_to_cascade(response.meta['mid'], tweet, item)
             yield item
-        if data['data']:
-            mid, page_num = response.meta['mid'], response.meta['page_num']
-            page_num += 1
-            url = f"https://weibo.com/ajax/statuses/repostTimeline?id={mid}&page={page_num}&moduleID=feed&count=10"
-            yield Request(url, callback=self.parse, meta={'page_num': page_num, 'mid': mid})
+        mid = response.meta['mid']
+        yield from self.paginate(response, data.get('total_number'), 10, bool(data['data']),
+                                 lambda page_num, last_page: self.page_request(mid, page_num, last_page))
+
+    @staticmethod
+    def to_timestamp(created_at):
+        return int(datetime.datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S').timestamp())
+
+    def add_to_cascade(self, mid, tweet, item):
+        """
+        把一条转发加入所属原微博的级联树，并在item上标注直接来源
+        """
+        cascade = self.cascades.get(mid)
+        if cascade is None:
+            root = tweet.get('retweeted_status', {})
+            root_user = root.get('user') or {}
+            root_time = self.to_timestamp(parse_time(root['created_at'])) if 'created_at' in root else 0
+            cascade = RepostCascade(mid, root_user.get('id', 0), root_time, root_user.get('screen_name'))
+            self.cascades[mid] = cascade
+        parent_nick = parse_parent_nick(item['content'])
+        _, parent = cascade.add(item['_id'], item['user']['_id'], item['user']['nick_name'],
+                                self.to_timestamp(item['created_at']), parent_nick)
+        item['repost_root_mid'] = str(mid)
+        item['repost_parent_nick'] = parent_nick
+        # 来源转发尚未采集到时为None，最终结果以保存的级联树为准
+        item['repost_parent_mid'] = str(cascade.mids[parent]) if parent is not None else None
+
+    def closed(self, reason):
+        """
+        保存各级联的父下标数组，并输出统计
+        """
+        if not self.cascades:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(os.path.join(self.output_dir, 'summary.jsonl'), 'at', encoding='utf-8') as f:
+            for mid, cascade in self.cascades.items():
+                cascade.save(os.path.join(self.output_dir, str(mid)))
+                stats = cascade.stats()
+                self.logger.info(f'repost cascade {mid}: {stats}')
+                f.write(json.dumps(stats, ensure_ascii=False) + '\n')
+
+    @classmethod
+    def merge_output_dirs(cls, output_dir, part_dirs):
+        """
+        合并多进程各自保存的级联: 各推文的目录移到 output_dir 下，summary.jsonl 追加到一起
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        for part_dir in part_dirs:
+            if not os.path.isdir(part_dir):
+                continue
+            for name in os.listdir(part_dir):
+                source = os.path.join(part_dir, name)
+                if name == 'summary.jsonl':
+                    with open(source, 'rt', encoding='utf-8') as f, \
+                            open(os.path.join(output_dir, name), 'at', encoding='utf-8') as out:
+                        shutil.copyfileobj(f, out)
+                else:
+                    target = os.path.join(output_dir, name)
+                    shutil.rmtree(target, ignore_errors=True)
+                    shutil.move(source, target)
+            shutil.rmtree(part_dir, ignore_errors=True)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+多跳社交关系图采集
+"""
+import json
+import os
+import shutil
+
+from scrapy import Spider, signals
+from scrapy.exceptions import DontCloseSpider
+from scrapy.http import Request
+from spiders.common import parse_bool, parse_user_info
+from spiders.csr_graph import CSRGraph
+
+
+class SocialGraphSpider(Spider):
+    """
+    从种子用户出发，按广度优先逐跳展开粉丝和关注列表
+
+    每一跳的请求全部完成后（爬虫空闲时）才展开下一跳；已见过的用户不会重复展开。
+    关系边存入 CSRGraph，结束时保存到 output_dir；每个新出现的用户输出一条用户信息。
+    """
+    name = "social_graph"
+    base_url = 'https://weibo.com/ajax/friendships/friends'
+    # 展开的跳数，1表示只采集种子用户自己的粉丝和关注
+    max_depth = 2
+    # 每一跳最多展开的用户数
+    max_nodes_per_hop = 1000
+    # 每个列表最多翻的页数，0表示不限制
+    max_pages = 0
+    # 要展开的关系: fans 粉丝，follow 关注
+    relations = ('fans', 'follow')
+    output_dir = '../output/social_graph'
+    # 是否额外导出文本格式的边列表
+    export_edgelist = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # scrapy crawl -a 传入的参数都是字符串，relations 用逗号分隔，如 -a relations=fans,follow
+        self.max_depth = int(self.max_depth)
+        self.max_nodes_per_hop = int(self.max_nodes_per_hop)
+        self.max_pages = int(self.max_pages)
+        if isinstance(self.relations, str):
+            self.relations = tuple(part.strip() for part in self.relations.split(',') if part.strip())
+        unknown = set(self.relations) - {'fans', 'follow'}
+        if unknown:
+            raise ValueError(f'unknown relations: {sorted(unknown)}')
+        self.export_edgelist = parse_bool(self.export_edgelist)
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        return spider
+
+    def start_requests(self):
+        """
+        爬虫入口
+        """
+        # 这里user_ids可替换成实际待采集的数据，run_spider.py --seeds 指定种子文件时使用文件中的数据
+        user_ids = getattr(self, 'seeds', None) or ['1087770692']
+        self.graph = CSRGraph()
+        self.seen = set(user_ids)
+        self.frontier = []
+        self.hop = 0
+        yield from self.expand(user_ids)
+
+    def list_url(self, user_id, relation, page_num):
+        if relation == 'fans':
+            return self.base_url + f"?relate=fans&page={page_num}&uid={user_id}&type=fans"
+        return self.base_url + f"?page={page_num}&uid={user_id}"
+
+    def expand(self, user_ids):
+        """
+        展开一批用户的关系列表
+        """
+        self.logger.info(f'hop {self.hop}: expanding {len(user_ids)} users')
+        for user_id in user_ids:
+            for relation in self.relations:
+                meta = {'user': user_id, 'relation': relation, 'page_num': 1}
+                yield Request(self.list_url(user_id, relation, 1), callback=self.parse, meta=meta)
+
+    def spider_idle(self, spider):
+        """
+        当前跳全部完成，展开下一跳
+        """
+        if not self.frontier or self.hop + 1 >= self.max_depth:
+            return
+        self.hop += 1
+        user_ids, self.frontier = self.frontier[:self.max_nodes_per_hop], []
+        for request in self.expand(user_ids):
+            self.crawler.engine.crawl(request, self)
+        raise DontCloseSpider
+
+    def parse(self, response, **kwargs):
+        """
+        网页解析
+        """
+        data = json.loads(response.text)
+        user_id, relation = response.meta['user'], response.meta['relation']
+        for user in data['users']:
+            user_info = parse_user_info(user)
+            other_id = user_info['_id']
+            if relation == 'fans':
+                self.graph.add_edge(other_id, user_id)
+            else:
+                self.graph.add_edge(user_id, other_id)
+            if other_id not in self.seen:
+                self.seen.add(other_id)
+                if self.hop + 1 < self.max_depth:
+                    self.frontier.append(other_id)
+                yield user_info
+        page_num = response.meta['page_num']
+        if data['users'] and (not self.max_pages or page_num < self.max_pages):
+            meta = {'user': user_id, 'relation': relation, 'page_num': page_num + 1}
+            yield Request(self.list_url(user_id, relation, page_num + 1), callback=self.parse, meta=meta)
+
+    def closed(self, reason):
+        """
+        保存关系图
+        """
+        self.graph.save(self.output_dir)
+        if self.export_edgelist:
+            self.graph.export_edgelist(os.path.join(self.output_dir, 'edges.tsv'))
+        self.logger.info(f'social graph saved to {self.output_dir}: '
+                         f'{self.graph.num_nodes} nodes, {self.graph.num_edges} edges')
+
+    @classmethod
+    def merge_output_dirs(cls, output_dir, part_dirs):
+        """
+        合并多进程各自保存的关系图，合并后删除各进程的目录
+        """
+        graph = CSRGraph()
+        for part_dir in part_dirs:
+            if os.path.exists(os.path.join(part_dir, 'meta.json')):
+                graph.merge(CSRGraph.load(part_dir))
+            shutil.rmtree(part_dir, ignore_errors=True)
+        graph.save(output_dir)
+        if cls.export_edgelist:
+            graph.export_edgelist(os.path.join(output_dir, 'edges.tsv'))
+        return graph
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+耗时分析
+
+StageTimer 按阶段（网络请求、正则提取、解析、等待等）累计耗时，开销只有两次 perf_counter；
+SamplingProfiler 对正在运行的线程定时采样调用栈，不需要重启任务，也不依赖第三方库，
+结果可按函数汇总，或输出折叠栈格式（flamegraph.pl / speedscope 可直接读取）。
+"""
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+class StageTimer(object):
+    """
+    线程安全的分阶段耗时统计
+    """
+
+    def __init__(self):
+        self.stages = {}  # 阶段名 -> [次数, 总耗时, 最大耗时]
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name):
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - begin)
+
+    def add(self, name, seconds):
+        with self.lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                self.stages[name] = [1, seconds, seconds]
+            else:
+                stage[0] += 1
+                stage[1] += seconds
+                if seconds > stage[2]:
+                    stage[2] = seconds
+
+    def breakdown(self):
+        """
+        各阶段的次数、总耗时、平均/最大耗时（毫秒）及占总运行时间的比例，按总耗时降序；
+        other 为未被任何阶段覆盖的时间
+        """
+        with self.lock:
+            stages = {name: list(values) for name, values in self.stages.items()}
+        wall = time.perf_counter() - self.started
+        result = {}
+        for name, (count, total, longest) in sorted(stages.items(), key=lambda item: -item[1][1]):
+            result[name] = {
+                'count': count,
+                'total_seconds': round(total, 3),
+                'avg_ms': round(total / count * 1000, 2),
+                'max_ms': round(longest * 1000, 2),
+                'share': round(total / wall, 4) if wall else 0,
+            }
+        covered = sum(values[1] for values in stages.values())
+        return {'wall_seconds': round(wall, 3), 'other_seconds': round(max(wall - covered, 0), 3),
+                'stages': result}
+
+
+class SamplingProfiler(object):
+    """
+    按固定间隔采样指定线程的调用栈
+    """
+
+    def __init__(self, thread_id, interval=0.005, max_depth=64):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = Counter()  # 调用栈（由外到内的函数元组）-> 采样次数
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = None
+        self.started = None
+        self.elapsed = 0.0
+
+    def start(self):
+        self.started = time.time()
+        self.thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.elapsed = time.time() - self.started
+        return self
+
+    def run_for(self, seconds):
+        """
+        采样 seconds 秒，目标线程提前结束时也随之结束
+        """
+        self.start()
+        self.stopped.wait(seconds)
+        return self.stop()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                # 目标线程已结束
+                self.stopped.set()
+                break
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({code.co_filename.rsplit("/", 1)[-1]}:{code.co_firstlineno})')
+                frame = frame.f_back
+            del frame
+            self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+            self.stopped.wait(self.interval)
+
+    def top(self, limit=30):
+        """
+        按函数汇总: self 为位于栈顶的采样数，total 为出现在栈中的采样数
+        """
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for function in set(stack):
+                total[function] += count
+        rows = []
+        for function, count in total.most_common(limit):
+            rows.append({
+                'function': function,
+                'self': own.get(function, 0),
+                'total': count,
+                'self_share': round(own.get(function, 0) / self.samples, 4) if self.samples else 0,
+                'total_share': round(count / self.samples, 4) if self.samples else 0,
+            })
+        return rows
+
+    def folded(self):
+        """
+        折叠栈格式，每行 "外层;...;内层 次数"
+        """
+        return '\n'.join(f'{";".join(stack)} {count}' for stack, count in self.stacks.most_common()) + '\n'
+
+    def summary(self, limit=30):
+        return {
+            'samples': self.samples,
+            'interval_ms': self.interval * 1000,
+            'duration_seconds': round(self.elapsed, 3),
+            'top': self.top(limit),
+        }
@@ -7,23 +7,49 @@ Created Time: 2022/10/22
 import datetime
 import json
 import re
-from scrapy import Spider, Request
+from scrapy import Spider, Request, signals
+from scrapy.exceptions import DontCloseSpider
 from spiders.common import parse_tweet_info, parse_long_tweet
+from spiders.feeder import RequestFeederMixin
 
 
-class TweetSpiderByKeyword(Spider):
+class TweetSpiderByKeyword(RequestFeederMixin, Spider):
     """
     关键词搜索采集
+
+    多个关键词共用一个调度器: 先翻完所有关键词的搜索结果页，只记录推文ID及命中的关键词；
+    搜索页全部完成（爬虫空闲）后，每条推文只请求一次详情，并在 keywords 中带上命中的全部关键词
     """
     name = "tweet_spider_by_keyword"
     base_url = "https://s.weibo.com/"
+    # 这里keywords可替换成实际待采集的数据，也可以用 -a keywords=关键词1,关键词2 指定
+    keywords = ['两个退伍军人被冤枉陷害']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.matches = {}  # 推文ID -> 命中的关键词列表
+        self.requested = set()  # 已请求详情的推文ID
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        return spider
 
     def start_requests(self):
         """
-        爬虫入口
+        爬虫入口: 搜索请求按调度器的空余逐批放入，按小时切分时也不会一次生成全部时间片
+        """
+        self.feed(self.search_requests())
+        return []
+
+    def search_requests(self):
+        """
+        所有关键词（时间片）的第一页搜索请求
         """
-        # 这里keywords可替换成实际待采集的数据
-        keywords = ['两个退伍军人被冤枉陷害']
+        keywords = self.keywords.split(',') if isinstance(self.keywords, str) else self.keywords
+        # run_spider.py --seeds 指定种子文件时使用文件中的关键词
+        keywords = getattr(self, 'seeds', None) or keywords
         # 这里的时间可替换成实际需要的时间段
         # 设置为最近一年的时间范围，您可以根据需要修改
         end_time = datetime.datetime.now()
@@ -31,7 +57,12 @@ class TweetSpiderByKeyword(Spider):
         # 是否按照小时进行切分，数据量更大; 对于非热门关键词**不需要**按照小时切分
         is_split_by_hour = False  # 非热门关键词建议设为False，提高效率
         for keyword in keywords:
-            if not is_split_by_hour:
+            if isinstance(keyword, dict):
+                # 任务队列中的关键词时间片: {"keyword": ..., "start_time": "2022-01-01-00", "end_time": ...}
+                _start_time, _end_time, keyword = keyword['start_time'], keyword['end_time'], keyword['keyword']
+                url = f"https://s.weibo.com/weibo?q={keyword}&timescope=custom%3A{_start_time}%3A{_end_time}&page=1"
+                yield Request(url, callback=self.parse, meta={'keyword': keyword})
+            elif not is_split_by_hour:
                 _start_time = start_time.strftime("%Y-%m-%d-%H")
                 _end_time = end_time.strftime("%Y-%m-%d-%H")
                 url = f"https://s.weibo.com/weibo?q={keyword}&timescope=custom%3A{_start_time}%3A{_end_time}&page=1"
@@ -54,24 +85,49 @@ class TweetSpiderByKeyword(Spider):
             self.logger.info(f'no search result. url: {response.url}')
             return
         tweets_infos = re.findall('<div class="from"\s+>(.*?)</div>', html, re.DOTALL)
+        keyword = response.meta['keyword']
         for tweets_info in tweets_infos:
             tweet_ids = re.findall(r'weibo\.com/\d+/(.+?)\?refer_flag=1001030103_" ', tweets_info)
             for tweet_id in tweet_ids:
-                url = f"https://weibo.com/ajax/statuses/show?id={tweet_id}"
-                yield Request(url, callback=self.parse_tweet, meta=response.meta, priority=10)
+                keywords = self.matches.setdefault(tweet_id, [])
+                if keyword not in keywords:
+                    keywords.append(keyword)
         next_page = re.search('<a href="(.*?)" class="next">下一页</a>', html)
         if next_page:
             url = "https://s.weibo.com" + next_page.group(1)
             yield Request(url, callback=self.parse, meta=response.meta)
 
-    @staticmethod
-    def parse_tweet(response):
+    def detail_requests(self):
+        """
+        尚未请求过详情的推文
+        """
+        for tweet_id in list(self.matches):
+            if tweet_id in self.requested:
+                continue
+            self.requested.add(tweet_id)
+            keywords = self.matches[tweet_id]
+            url = f"https://weibo.com/ajax/statuses/show?id={tweet_id}"
+            yield Request(url, callback=self.parse_tweet, meta={'keyword': keywords[0], 'keywords': keywords},
+                          priority=10)
+
+    def spider_idle(self, spider):
+        """
+        搜索结果页全部完成后再请求推文详情，详情请求同样逐批放入
+        """
+        if self.feeding():
+            return
+        if len(self.requested) < len(self.matches):
+            self.feed(self.detail_requests())
+            raise DontCloseSpider
+
+    def parse_tweet(self, response):
         """
-        解析推文
+        解析推文（回调需为爬虫方法，请求才能写入磁盘队列）
         """
         data = json.loads(response.text)
         item = parse_tweet_info(data)
         item['keyword'] = response.meta['keyword']
+        item['keywords'] = response.meta.get('keywords') or [item['keyword']]
         if item['isLongText']:
             url = "https://weibo.com/ajax/statuses/longtext?id=" + item['mblogid']
             yield Request(url, callback=parse_long_tweet, meta={'item': item}, priority=20)
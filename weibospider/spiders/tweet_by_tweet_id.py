@@ -22,8 +22,8 @@ class TweetSpiderByTweetID(Spider):
         """
         爬虫入口
         """
-        # 这里user_ids可替换成实际待采集的数据
-        tweet_ids = ['LqlZNhJFm']
+        # 这里tweet_ids可替换成实际待采集的数据，run_spider.py --seeds 指定种子文件时使用文件中的数据
+        tweet_ids = getattr(self, 'seeds', None) or ['LqlZNhJFm']
         for tweet_id in tweet_ids:
             url = f"https://weibo.com/ajax/statuses/show?id={tweet_id}"
             yield Request(url, callback=self.parse)
@@ -11,38 +11,121 @@ import re
 
 from scrapy import Spider
 from scrapy.http import Request
-from spiders.common import parse_tweet_info, parse_long_tweet
+from spiders.common import parse_bool, parse_tweet_info, parse_long_tweet, parse_time
+from spiders.feeder import RequestFeederMixin
+from spiders.pagination import PageFanOutMixin
+from spiders.watermark import WatermarkStore
 
 
-class TweetSpiderByUserID(Spider):
+class TweetSpiderByUserID(RequestFeederMixin, PageFanOutMixin, Spider):
     """
     用户推文数据采集
     """
     name = "tweet_spider_by_user_id"
+    # 每个时间窗口期望包含的推文数，窗口大小按首个探测请求得到的发帖密度自适应
+    window_size = 200
+    # 最小窗口（秒），避免对高频账号无限切分
+    min_window_seconds = 3600
+    # 增量采集: 只采集每个用户上次运行之后的新推文
+    incremental = False
+    watermark_path = '../output/watermarks.json'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # scrapy crawl -a 传入的参数都是字符串
+        self.window_size = int(self.window_size)
+        self.min_window_seconds = int(self.min_window_seconds)
+        self.incremental = parse_bool(self.incremental)
+        self.newest = {}
 
     def start_requests(self):
         """
-        爬虫入口
+        爬虫入口: 每个用户的首个请求按调度器的空余逐批放入
+        """
+        self.watermarks = WatermarkStore(self.watermark_path, self.name)
+        self.feed(self.user_requests())
+        return []
+
+    def user_requests(self):
+        """
+        每个用户的第一个请求
         """
-        # 这里user_ids可替换成实际待采集的数据
-        user_ids = ['1087770692']
+        # 这里user_ids可替换成实际待采集的数据，run_spider.py --seeds 指定种子文件时使用文件中的数据
+        user_ids = getattr(self, 'seeds', None) or ['1087770692']
         # 这里的时间替换成实际需要的时间段，如果要采集用户全部推文 is_crawl_specific_time_span 设置为False
         is_crawl_specific_time_span = True
         start_time = datetime.datetime(year=2022, month=1, day=1)
         end_time = datetime.datetime(year=2023, month=1, day=1)
         for user_id in user_ids:
-            url = f"https://weibo.com/ajax/statuses/searchProfile?uid={user_id}&page=1&hasori=1&hastext=1&haspic=1&hasvideo=1&hasmusic=1&hasret=1"
+            mark = self.watermarks.get(user_id) if self.incremental else None
+            if not is_crawl_specific_time_span and not mark:
+                yield self.page_request(user_id, 1, None, None, None, None)
+                continue
+            tmp_start_time, tmp_end_time = start_time, end_time
             if not is_crawl_specific_time_span:
-                yield Request(url, callback=self.parse, meta={'user_id': user_id, 'page_num': 1})
-            else:
-                # 切分成10天进行
-                tmp_start_time = start_time
-                while tmp_start_time <= end_time:
-                    tmp_end_time = tmp_start_time + datetime.timedelta(days=10)
-                    tmp_end_time = min(tmp_end_time, end_time)
-                    tmp_url = url + f'&starttime={int(tmp_start_time.timestamp())}&endtime={int(tmp_end_time.timestamp())}'
-                    yield Request(tmp_url, callback=self.parse, meta={'user_id': user_id, 'page_num': 1})
-                    tmp_start_time = tmp_end_time + datetime.timedelta(days=1)
+                tmp_end_time = datetime.datetime.now()
+            if mark:
+                # 增量: 从上次采集到的最新推文时间开始
+                mark_time = datetime.datetime.strptime(mark['created_at'], '%Y-%m-%d %H:%M:%S')
+                tmp_start_time = mark_time if not is_crawl_specific_time_span else max(tmp_start_time, mark_time)
+            if tmp_start_time > tmp_end_time:
+                continue
+            yield self.window_request(user_id, int(tmp_start_time.timestamp()), int(tmp_end_time.timestamp()), mark)
+
+    @staticmethod
+    def build_url(user_id, page_num=1, start=None, end=None):
+        """
+        构造用户推文列表的URL
+        """
+        url = f"https://weibo.com/ajax/statuses/searchProfile?uid={user_id}&page={page_num}" \
+              f"&hasori=1&hastext=1&haspic=1&hasvideo=1&hasmusic=1&hasret=1"
+        if start is not None:
+            url += f'&starttime={start}&endtime={end}'
+        return url
+
+    def window_request(self, user_id, start, end, mark):
+        """
+        时间窗口的第一页，同时作为探测请求估计窗口内的推文数
+        """
+        request = self.page_request(user_id, 1, start, end, mark, None)
+        request.meta['probe'] = True
+        return request
+
+    def page_request(self, user_id, page_num, start, end, mark, last_page):
+        """
+        用户推文列表（或某个时间窗口）的某一页
+        """
+        meta = {'user_id': user_id, 'page_num': page_num, 'start': start, 'end': end, 'mark': mark,
+                'fan_out_key': f'{user_id}:{start}:{end}', 'last_page': last_page}
+        return Request(self.build_url(user_id, page_num, start, end), callback=self.parse, meta=meta,
+                       priority=-page_num)
+
+    def split_window(self, meta, data, tweets):
+        """
+        根据探测结果切分时间窗口，不需要切分时返回None
+
+        优先使用接口返回的total，没有时按首页推文的时间跨度估计发帖密度；
+        相邻窗口首尾相接，不会遗漏时间段。
+        """
+        start, end = meta['start'], meta['end']
+        total = data['data'].get('total')
+        if total is None:
+            if len(tweets) < 20:
+                return None
+            times = [datetime.datetime.strptime(parse_time(tweet['created_at']), '%Y-%m-%d %H:%M:%S')
+                     for tweet in tweets]
+            page_seconds = max((max(times) - min(times)).total_seconds(), 60)
+            total = len(tweets) * (end - start) / page_seconds
+        if total <= self.window_size or end - start <= self.min_window_seconds:
+            return None
+        window_seconds = max(int((end - start) * self.window_size / total), self.min_window_seconds)
+        windows = []
+        window_start = start
+        while window_start <= end:
+            window_end = min(window_start + window_seconds - 1, end)
+            windows.append((window_start, window_end))
+            window_start = window_end + 1
+        return windows
 
     def parse(self, response, **kwargs):
         """
@@ -50,15 +133,44 @@ class TweetSpiderByUserID(Spider):
         """
         data = json.loads(response.text)
         tweets = data['data']['list']
+        meta = response.meta
+        if meta.get('probe'):
+            windows = self.split_window(meta, data, tweets)
+            if windows:
+                # 窗口内推文过多，切分后每个子窗口再各自探测
+                for window_start, window_end in windows:
+                    yield self.window_request(meta['user_id'], window_start, window_end, meta['mark'])
+                return
+        user_id, page_num, mark = meta['user_id'], meta['page_num'], meta.get('mark')
         for tweet in tweets:
             item = parse_tweet_info(tweet)
             del item['user']
+            if mark and (item['created_at'], int(item['_id'])) <= (mark['created_at'], mark['id']):
+                continue
+            self.track_newest(user_id, item)
             if item['isLongText']:
                 url = "https://weibo.com/ajax/statuses/longtext?id=" + item['mblogid']
                 yield Request(url, callback=parse_long_tweet, meta={'item': item})
             else:
                 yield item
-        if tweets:
-            user_id, page_num = response.meta['user_id'], response.meta['page_num']
-            url = response.url.replace(f'page={page_num}', f'page={page_num + 1}')
-            yield Request(url, callback=self.parse, meta={'user_id': user_id, 'page_num': page_num + 1})
+        start, end = meta.get('start'), meta.get('end')
+        yield from self.paginate(response, data['data'].get('total'), 20, bool(tweets),
+                                 lambda page, last_page: self.page_request(user_id, page, start, end, mark, last_page))
+
+    def track_newest(self, user_id, item):
+        """
+        记录每个用户本次采集到的最新推文
+        """
+        newest = self.newest.get(user_id)
+        if newest is None or (item['created_at'], int(item['_id'])) > (newest['created_at'], newest['id']):
+            self.newest[user_id] = {'created_at': item['created_at'], 'id': int(item['_id'])}
+
+    def closed(self, reason):
+        """
+        正常结束时才推进水位线，避免中断的采集留下空洞
+        """
+        if reason != 'finished':
+            return
+        for user_id, newest in self.newest.items():
+            self.watermarks.set(user_id, newest)
+        self.watermarks.save()
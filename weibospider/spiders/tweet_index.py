@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+已采集推文的本地全文检索
+
+对推文正文按字符二元组（bigram）建立倒排索引，推文到达时增量追加，文档号递增，
+因此每个倒排表天然有序，查询时从最短的倒排表出发二分求交，再用原文确认是否包含查询串。
+时间、用户、互动数等过滤条件保存在按文档号排列的紧凑数组中；另有一份按发布时间排序的文档号数组，
+时间范围用二分定位，按时间排序的查询从最新的推文往前扫描，取够一页并数到 count_limit 条即停止。
+按互动数排序时仍需检查全部候选，百万级推文应配合检索词或时间范围使用。
+"""
+import bisect
+import glob
+import heapq
+import itertools
+import json
+import threading
+import time
+from array import array
+from datetime import datetime
+
+# 排序字段 -> 数组名
+SORT_FIELDS = {
+    'time': 'created',
+    'reposts': 'reposts',
+    'comments': 'comments',
+    'attitudes': 'attitudes',
+}
+
+
+def normalize(text):
+    """
+    小写并去掉空白，查询与建索引使用同一规则
+    """
+    return ''.join(str(text).lower().split())
+
+
+def bigrams(text):
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def parse_created_at(value):
+    """
+    推文的 created_at（%Y-%m-%d %H:%M:%S）转为时间戳，无法解析时为0
+    """
+    if not value:
+        return 0.0
+    try:
+        return datetime.strptime(str(value)[:19], '%Y-%m-%d %H:%M:%S').timestamp()
+    except ValueError:
+        return 0.0
+
+
+class TweetIndex(object):
+    """
+    线程安全的增量倒排索引；同一推文（_id）重复添加时只更新互动数，不重复建索引
+    """
+    # 按时间排序时最多精确统计的匹配数
+    count_limit = 1000
+
+    def __init__(self):
+        self.tweets = []  # 文档号 -> 推文
+        self.doc_ids = {}  # 推文ID -> 文档号
+        self.postings = {}  # bigram -> array('I') 文档号；只出现过一次的bigram直接存文档号，节省内存
+        self.char_grams = {}  # 单个字符 -> 包含它的bigram集合，用于单字查询
+        self.user_docs = {}  # 用户ID -> array('I') 文档号
+        self.task_docs = {}  # 任务ID -> array('I') 文档号
+        self.created = array('d')
+        self.reposts = array('l')
+        self.comments = array('l')
+        self.attitudes = array('l')
+        # 按 (发布时间, 文档号) 升序排列的文档号及对应的发布时间；新文档先放入 time_pending，查询时再合并
+        self.time_docs = array('I')
+        self.time_keys = array('d')
+        self.time_pending = []
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.tweets)
+
+    def add(self, tweet, task_id=None):
+        """
+        添加一条推文，返回是否为新推文
+        """
+        tweet_id = str(tweet.get('_id') or tweet.get('mblogid') or '')
+        if not tweet_id:
+            return False
+        with self.lock:
+            doc = self.doc_ids.get(tweet_id)
+            if doc is not None:
+                # 已收录的推文: 更新互动数和引用（如批量搜索追加了命中的关键词）
+                self.tweets[doc] = tweet
+                self.reposts[doc] = int(tweet.get('reposts_count') or 0)
+                self.comments[doc] = int(tweet.get('comments_count') or 0)
+                self.attitudes[doc] = int(tweet.get('attitudes_count') or 0)
+                self._add_posting(self.task_docs, task_id, doc)
+                return False
+            doc = len(self.tweets)
+            self.doc_ids[tweet_id] = doc
+            self.tweets.append(tweet)
+            created = parse_created_at(tweet.get('created_at'))
+            self.created.append(created)
+            if not self.time_pending and (not self.time_keys or created >= self.time_keys[-1]):
+                self.time_docs.append(doc)
+                self.time_keys.append(created)
+            else:
+                self.time_pending.append(doc)
+            self.reposts.append(int(tweet.get('reposts_count') or 0))
+            self.comments.append(int(tweet.get('comments_count') or 0))
+            self.attitudes.append(int(tweet.get('attitudes_count') or 0))
+            postings = self.postings
+            for gram in bigrams(normalize(tweet.get('content', ''))):
+                posting = postings.get(gram)
+                if posting is None:
+                    postings[gram] = doc
+                    for char in gram:
+                        self.char_grams.setdefault(char, set()).add(gram)
+                elif type(posting) is int:
+                    postings[gram] = array('I', (posting, doc))
+                else:
+                    posting.append(doc)
+            user = tweet.get('user') or {}
+            self._add_posting(self.user_docs, user.get('_id'), doc)
+            self._add_posting(self.task_docs, task_id, doc)
+            return True
+
+    def add_many(self, tweets, task_id=None):
+        return sum(1 for tweet in tweets if self.add(tweet, task_id))
+
+    def load_jsonl(self, pattern, task_id=None):
+        """
+        从采集输出的jsonl文件（支持通配符）载入推文，跳过没有正文的数据（如用户、评论），返回新增数量
+        """
+        added = 0
+        for path in sorted(glob.glob(pattern)):
+            with open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    tweet = json.loads(line)
+                    if 'content' in tweet and 'mblogid' in tweet:
+                        added += self.add(tweet, task_id)
+        return added
+
+    @staticmethod
+    def _add_posting(table, key, doc):
+        if not key:
+            return
+        posting = table.get(str(key))
+        if posting is None:
+            posting = table[str(key)] = array('I')
+        if not posting or posting[-1] != doc:
+            if posting and posting[-1] > doc:
+                # 已收录的推文出现在新任务中，文档号不再递增，插入到有序位置
+                index = bisect.bisect_left(posting, doc)
+                if index < len(posting) and posting[index] == doc:
+                    return
+                posting.insert(index, doc)
+            else:
+                posting.append(doc)
+
+    def search(self, query=None, user_id=None, task_id=None, start_time=None, end_time=None,
+               min_reposts=0, min_comments=0, min_attitudes=0, keyword=None, sort='time',
+               offset=0, limit=20):
+        """
+        检索推文
+
+        query 中空格分隔的多个词需同时出现；start_time/end_time 为时间戳；
+        返回 (总数, 当前页推文列表, 耗时毫秒, 总数是否精确)，按 sort 字段降序。
+        按时间排序时最多数到 count_limit 条（且至少取够当前页）即停止，此时总数为下限
+        """
+        started = time.perf_counter()
+        terms = [normalize(term) for term in (query or '').split() if normalize(term)]
+        # 一到两个字的词由倒排表求交即可确定包含，更长的词需要用原文确认
+        verify_terms = [term for term in terms if len(term) > 2]
+        if sort not in SORT_FIELDS:
+            raise ValueError(f'sort 应为 {"/".join(SORT_FIELDS)}')
+        need = offset + limit
+        with self.lock:
+            candidates, common_terms = self._candidates(terms, user_id, task_id)
+            # 过于常见的单字不求倒排表的并集，改为用原文确认
+            verify_terms += common_terms
+            filtered = bool(verify_terms or keyword or min_reposts or min_comments or min_attitudes)
+            lo, hi = self._time_range(start_time, end_time)
+            created, reposts, comments, attitudes = self.created, self.reposts, self.comments, self.attitudes
+            tweets = self.tweets
+
+            def accept(doc):
+                if reposts[doc] < min_reposts or comments[doc] < min_comments or attitudes[doc] < min_attitudes:
+                    return False
+                tweet = tweets[doc]
+                if verify_terms:
+                    content = normalize(tweet.get('content', ''))
+                    if not all(term in content for term in verify_terms):
+                        return False
+                if keyword and keyword not in (tweet.get('keywords') or [tweet.get('keyword')]):
+                    return False
+                return True
+
+            if sort == 'time' and candidates is None and not filtered:
+                # 只有时间范围: 直接按位置取当前页
+                top = self.time_docs[max(hi - need, lo):max(hi - offset, lo)][::-1]
+                total, exact = hi - lo, True
+            elif sort == 'time' and (candidates is None or len(candidates) * 4 > hi - lo):
+                # 候选较多时从最新的推文往前扫描，取够一页并数到 count_limit 条即停止
+                members = None if candidates is None else set(candidates)
+                time_docs = self.time_docs
+                top, total, exact = [], 0, True
+                for i in range(hi - 1, lo - 1, -1):
+                    doc = time_docs[i]
+                    if members is not None and doc not in members:
+                        continue
+                    if filtered and not accept(doc):
+                        continue
+                    total += 1
+                    if total <= need:
+                        top.append(doc)
+                    elif total >= self.count_limit:
+                        exact = i == lo
+                        break
+                top = top[offset:]
+            else:
+                ranged = start_time is not None or end_time is not None
+                if candidates is None:
+                    docs = self.time_docs[lo:hi] if ranged else range(len(tweets))
+                    check_time = False
+                else:
+                    docs, check_time = candidates, ranged
+                matched = []
+                for doc in docs:
+                    if check_time:
+                        if start_time is not None and created[doc] < start_time:
+                            continue
+                        if end_time is not None and created[doc] >= end_time:
+                            continue
+                    if filtered and not accept(doc):
+                        continue
+                    matched.append(doc)
+                sort_values = getattr(self, SORT_FIELDS[sort])
+                top = heapq.nlargest(need, matched, key=lambda doc: (sort_values[doc], doc))[offset:]
+                total, exact = len(matched), True
+            results = [tweets[doc] for doc in top]
+        return total, results, round((time.perf_counter() - started) * 1000, 3), exact
+
+    def _time_range(self, start_time, end_time):
+        """
+        把待合并的新文档并入时间序数组，返回时间范围在 time_docs 中的 [lo, hi)
+        """
+        pending = self.time_pending
+        if pending:
+            created = self.created
+            if len(pending) <= max(1024, len(self.time_docs) >> 6):
+                # 少量新文档逐个插入（新文档号最大，放在同一时间的最后）
+                for doc in pending:
+                    index = bisect.bisect_right(self.time_keys, created[doc])
+                    self.time_docs.insert(index, doc)
+                    self.time_keys.insert(index, created[doc])
+            else:
+                docs = sorted(itertools.chain(self.time_docs, pending), key=created.__getitem__)
+                self.time_docs = array('I', docs)
+                self.time_keys = array('d', (created[doc] for doc in docs))
+            self.time_pending = []
+        lo = 0 if start_time is None else bisect.bisect_left(self.time_keys, start_time)
+        hi = len(self.time_keys) if end_time is None else bisect.bisect_left(self.time_keys, end_time)
+        return lo, max(lo, hi)
+
+    def _posting(self, gram):
+        posting = self.postings.get(gram)
+        if posting is None:
+            return array('I')
+        if type(posting) is int:
+            return array('I', (posting,))
+        return posting
+
+    def _candidates(self, terms, user_id, task_id):
+        """
+        由倒排表求交得到候选文档号，返回 (候选, 未用倒排表的单字)；没有任何可用的倒排表时候选为None（不限制）
+        """
+        lists = []
+        common_terms = []
+        for term in terms:
+            if len(term) == 1:
+                postings = [self._posting(gram) for gram in self.char_grams.get(term, ())]
+                if sum(map(len, postings)) * 4 > len(self.tweets):
+                    common_terms.append(term)
+                    continue
+                docs = set()
+                for posting in postings:
+                    docs.update(posting)
+                lists.append(array('I', sorted(docs)))
+                continue
+            for gram in bigrams(term):
+                lists.append(self._posting(gram))
+        if user_id:
+            lists.append(self.user_docs.get(str(user_id), array('I')))
+        if task_id:
+            lists.append(self.task_docs.get(str(task_id), array('I')))
+        if not lists:
+            return None, common_terms
+        lists.sort(key=len)
+        result = lists[0]
+        for posting in lists[1:]:
+            if not result:
+                break
+            result = intersect(result, posting)
+        return result, common_terms
+
+    def stats(self):
+        with self.lock:
+            return {
+                'tweets': len(self.tweets),
+                'grams': len(self.postings),
+                'postings': sum(1 if type(posting) is int else len(posting) for posting in self.postings.values()),
+                'users': len(self.user_docs),
+                'tasks': len(self.task_docs),
+            }
+
+
+def intersect(small, large):
+    """
+    有序数组求交: 在较长的数组中二分查找，每次从上次的位置继续
+    """
+    result = array('I')
+    low, size = 0, len(large)
+    for doc in small:
+        low = bisect.bisect_left(large, doc, low, size)
+        if low == size:
+            break
+        if large[low] == doc:
+            result.append(doc)
+    return result
@@ -5,15 +5,16 @@ Author: nghuyong
 Mail: nghuyong@163.com
 Created Time: 2020/4/14
 """
-import json
 from scrapy import Spider
-from scrapy.http import Request
-from spiders.common import parse_user_info
+from spiders import metrics
+from spiders.profile import ProfileCache, ProfileFetcher
 
 
 class UserSpider(Spider):
     """
     微博用户信息爬虫
+
+    info 和 detail 两个接口并发请求；采集结果同时写入用户资料缓存，供其他爬虫和Web服务复用
     """
     name = "user_spider"
     base_url = "https://weibo.cn"
@@ -22,37 +23,13 @@ class UserSpider(Spider):
         """
         爬虫入口
         """
-        # 这里user_ids可替换成实际待采集的数据
-        user_ids = ['1749127163']
-        urls = [f'https://weibo.com/ajax/profile/info?uid={user_id}' for user_id in user_ids]
-        for url in urls:
-            yield Request(url, callback=self.parse)
-
-    def parse(self, response, **kwargs):
-        """
-        网页解析
-        """
-        data = json.loads(response.text)
-        item = parse_user_info(data['data']['user'])
-        url = f"https://weibo.com/ajax/profile/detail?uid={item['_id']}"
-        yield Request(url, callback=self.parse_detail, meta={'item': item})
+        # 这里user_ids可替换成实际待采集的数据，run_spider.py --seeds 指定种子文件时使用文件中的数据
+        user_ids = getattr(self, 'seeds', None) or ['1749127163']
+        self.profiles = ProfileFetcher(ProfileCache.from_settings(self.settings))
+        metrics.watch_cache('profile', self.profiles.cache)
+        for user_id in user_ids:
+            # 显式指定的用户总是重新采集，并刷新缓存
+            yield from self.profiles.requests(user_id, refresh=True)
 
-    @staticmethod
-    def parse_detail(response):
-        """
-        解析详细数据
-        """
-        item = response.meta['item']
-        data = json.loads(response.text)['data']
-        item['birthday'] = data.get('birthday', '')
-        if 'created_at' not in item:
-            item['created_at'] = data.get('created_at', '')
-        item['desc_text'] = data.get('desc_text', '')
-        item['ip_location'] = data.get('ip_location', '')
-        item['sunshine_credit'] = data.get('sunshine_credit', {}).get('level', '')
-        item['label_desc'] = [label['name'] for label in data.get('label_desc', [])]
-        if 'company' in data:
-            item['company'] = data['company']
-        if 'education' in data:
-            item['education'] = data['education']
-        yield item
+    def closed(self, reason):
+        self.profiles.cache.close()
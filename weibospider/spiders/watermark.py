@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+增量采集的水位线存储
+
+每个命名空间（如 comment、tweet_by_user_id）下按键（推文mid、用户id等）记录
+上次采集到的最新位置，保存在本地JSON文件中，供下次运行时提前结束翻页。
+同一文件可能被多个实例同时写（如并发的关键词监控任务、run_spider.py 的多个进程），
+保存时只合并本实例改过的键；支持 fcntl 的系统上保存时还会加文件锁，避免进程间互相覆盖。
+"""
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# 同一文件的读-合并-替换在进程内串行进行
+_file_locks = {}
+_file_locks_lock = threading.Lock()
+
+
+def _file_lock(path):
+    with _file_locks_lock:
+        return _file_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+@contextmanager
+def _process_lock(path):
+    """
+    进程间的文件锁，锁在 {path}.lock 上
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(path + '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class WatermarkStore(object):
+    """
+    基于JSON文件的水位线存储，多个命名空间共用一个文件
+    """
+
+    def __init__(self, path, namespace):
+        self.path = path
+        self.namespace = namespace
+        self.lock = threading.Lock()
+        self.file_lock = _file_lock(path)
+        self.marks = self._load().get(namespace, {})
+        self.dirty = set()  # 本实例改过、尚未保存的键
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'rt', encoding='utf-8') as f:
+            return json.load(f)
+
+    def get(self, key, default=None):
+        """
+        获取水位线
+        """
+        return self.marks.get(str(key), default)
+
+    def set(self, key, value):
+        """
+        更新水位线（调用 save 后才会落盘）
+        """
+        with self.lock:
+            self.marks[str(key)] = value
+            self.dirty.add(str(key))
+
+    def save(self):
+        """
+        写回文件: 重新读取后只更新本实例改过的键，其他实例保存的键保持不变，再原子替换
+        """
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        with self.lock, self.file_lock, _process_lock(self.path):
+            data = self._load()
+            marks = data.setdefault(self.namespace, {})
+            for key in self.dirty:
+                marks[key] = self.marks[key]
+            fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(self.path) + '.', suffix='.tmp',
+                                            dir=directory)
+            try:
+                with os.fdopen(fd, 'wt', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, self.path)
+            except Exception:
+                os.remove(tmp_path)
+                raise
+            self.dirty.clear()
+            # 同时获得其他实例保存的键
+            self.marks = dict(marks)
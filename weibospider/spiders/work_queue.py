@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+基于SQLite的持久化任务队列
+
+多个进程/节点共用同一个数据库文件领取任务，无需额外部署服务:
+- lease: 领取任务并加租约，租约期内其他节点不会领到同一任务
+- heartbeat: 处理耗时较长时续租
+- ack: 完成任务
+- fail: 失败后按指数退避重新排队，超过最大次数标记为 failed
+节点崩溃或失联时租约到期，任务自动回到可领取状态（计为一次尝试）。
+任务按 (queue, key) 去重，重复添加同一任务不会重复执行。
+
+本机多进程使用时默认为WAL日志模式。SQLite不支持在NFS/SMB等网络文件系统上使用WAL，多台机器通过共享存储
+使用同一文件时需传入 shared=True，改用回滚日志（journal_mode=DELETE），租约的正确性依赖共享存储提供的文件锁
+（NFS需启用锁服务）；共享存储不能提供可靠的文件锁时，应只在一台机器上使用。
+"""
+import json
+import os
+import socket
+import sqlite3
+import time
+
+PENDING, LEASED, DONE, FAILED = 'pending', 'leased', 'done', 'failed'
+
+
+def default_owner():
+    """
+    当前进程的标识: 主机名:进程号
+    """
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class WorkQueue(object):
+    """
+    任务载荷为任意可JSON序列化的数据，如用户ID、推文ID或关键词时间片
+    """
+
+    def __init__(self, path, lease_seconds=600, max_attempts=3, retry_delay=60, shared=False):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay  # 第一次重试的等待秒数，之后每次翻倍
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # isolation_level=None 手动控制事务，领取任务时用 BEGIN IMMEDIATE 加写锁
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        # WAL依赖共享内存，只能在本机使用；多台机器共用文件时使用回滚日志
+        self.db.execute('PRAGMA journal_mode=DELETE' if shared else 'PRAGMA journal_mode=WAL')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                queue TEXT NOT NULL,
+                key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                owner TEXT,
+                lease_expires REAL,
+                available_at REAL NOT NULL,
+                last_error TEXT,
+                updated_at REAL NOT NULL,
+                UNIQUE (queue, key)
+            )''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS tasks_ready ON tasks (queue, status, available_at)')
+
+    def put(self, queue, payload, key=None):
+        """
+        添加任务，key 默认为载荷本身；已存在的任务忽略，返回是否新增
+        """
+        return self.put_many(queue, [payload], [key]) == 1
+
+    def put_many(self, queue, payloads, keys=None):
+        """
+        批量添加任务，返回新增的数量
+        """
+        now = time.time()
+        rows = []
+        for index, payload in enumerate(payloads):
+            data = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+            key = keys[index] if keys and keys[index] is not None else data
+            rows.append((queue, str(key), data, PENDING, now, now))
+        with self._transaction():
+            before = self.db.total_changes
+            self.db.executemany('INSERT OR IGNORE INTO tasks (queue, key, payload, status, available_at, updated_at) '
+                                'VALUES (?, ?, ?, ?, ?, ?)', rows)
+            return self.db.total_changes - before
+
+    def lease(self, queue, owner, limit=1):
+        """
+        领取最多 limit 个任务，返回 [(任务ID, 载荷), ...]
+        """
+        now = time.time()
+        with self._transaction():
+            # 租约到期且已用完尝试次数的任务不再发放
+            self.db.execute('UPDATE tasks SET status = ?, owner = NULL, last_error = ?, updated_at = ? '
+                            'WHERE queue = ? AND status = ? AND lease_expires < ? AND attempts >= ?',
+                            (FAILED, 'lease expired', now, queue, LEASED, now, self.max_attempts))
+            rows = self.db.execute(
+                'SELECT id, payload FROM tasks WHERE queue = ? AND '
+                '((status = ? AND available_at <= ?) OR (status = ? AND lease_expires < ?)) '
+                'ORDER BY id LIMIT ?', (queue, PENDING, now, LEASED, now, limit)).fetchall()
+            self.db.executemany(
+                'UPDATE tasks SET status = ?, owner = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? '
+                'WHERE id = ?', [(LEASED, owner, now + self.lease_seconds, now, row[0]) for row in rows])
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+    def next_available(self, queue):
+        """
+        最早可以领取到任务的时间（退避结束或租约到期）；没有排队中或租出的任务时返回None
+        """
+        row = self.db.execute(
+            'SELECT MIN(CASE WHEN status = ? THEN available_at ELSE lease_expires END) FROM tasks '
+            'WHERE queue = ? AND status IN (?, ?)', (PENDING, queue, PENDING, LEASED)).fetchone()
+        return row[0]
+
+    def heartbeat(self, task_ids, owner):
+        """
+        续租，返回仍由 owner 持有的任务数；少于传入数量说明部分租约已过期被其他节点领走
+        """
+        now = time.time()
+        return self._update_owned(task_ids, owner, 'lease_expires = ?, updated_at = ?',
+                                  (now + self.lease_seconds, now))
+
+    def ack(self, task_ids, owner):
+        """
+        完成任务，返回确认成功的数量
+        """
+        return self._update_owned(task_ids, owner, 'status = ?, owner = NULL, lease_expires = NULL, updated_at = ?',
+                                  (DONE, time.time()))
+
+    def fail(self, task_ids, owner, error=''):
+        """
+        任务失败: 未超过最大尝试次数的按指数退避重新排队，否则标记为 failed
+        """
+        now = time.time()
+        count = 0
+        with self._transaction():
+            for task_id in task_ids:
+                row = self.db.execute('SELECT attempts FROM tasks WHERE id = ? AND owner = ? AND status = ?',
+                                      (task_id, owner, LEASED)).fetchone()
+                if row is None:
+                    continue
+                attempts = row[0]
+                if attempts >= self.max_attempts:
+                    status, available_at = FAILED, now
+                else:
+                    status, available_at = PENDING, now + self.retry_delay * 2 ** (attempts - 1)
+                self.db.execute('UPDATE tasks SET status = ?, owner = NULL, lease_expires = NULL, available_at = ?, '
+                                'last_error = ?, updated_at = ? WHERE id = ?',
+                                (status, available_at, str(error)[:1000], now, task_id))
+                count += 1
+        return count
+
+    def retry_failed(self, queue):
+        """
+        把 failed 的任务重新放回队列，尝试次数清零
+        """
+        with self._transaction():
+            cursor = self.db.execute('UPDATE tasks SET status = ?, attempts = 0, available_at = ?, updated_at = ? '
+                                     'WHERE queue = ? AND status = ?',
+                                     (PENDING, time.time(), time.time(), queue, FAILED))
+            return cursor.rowcount
+
+    def stats(self, queue=None):
+        """
+        各状态的任务数
+        """
+        sql = 'SELECT queue, status, COUNT(*) FROM tasks'
+        params = ()
+        if queue:
+            sql += ' WHERE queue = ?'
+            params = (queue,)
+        result = {}
+        for name, status, count in self.db.execute(sql + ' GROUP BY queue, status', params):
+            result.setdefault(name, {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0})[status] = count
+        return result.get(queue, {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}) if queue else result
+
+    def close(self):
+        self.db.close()
+
+    def _update_owned(self, task_ids, owner, assignments, params):
+        with self._transaction():
+            count = 0
+            for task_id in task_ids:
+                cursor = self.db.execute(f'UPDATE tasks SET {assignments} WHERE id = ? AND owner = ? AND status = ?',
+                                         params + (task_id, owner, LEASED))
+                count += cursor.rowcount
+            return count
+
+    def _transaction(self):
+        return _Transaction(self.db)
+
+
+class _Transaction(object):
+    """
+    BEGIN IMMEDIATE 事务，多个进程同时领取任务时互斥
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False